@@ -1,19 +1,41 @@
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List, Dict, Any
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from typing import TypedDict, List, Dict, Any, AsyncIterator, Tuple
+from langchain_core.messages import ToolMessage
 from langchain_core.tools import tool
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, Field
+from services.llm_clients import get_chat_model_with_tools
+from services.routing import get_model_router, routed_ainvoke
+from services.metrics import span
+from services.streaming import stream_graph_events
+from services.messages import build_messages
+from services.context import compact_conversation
+from services.usage import token_counts, add_token_counts, empty_tokens
+from services.snapshots import get_snapshot_store
+from services.code_index import CodeIndex, project_index, drop_project_index, outline
+from services.checkpoints import get_checkpointer
+from services.sandbox import sandbox_enabled, get_sandbox_pool
+from services.iteration_budget import IterationBudget, plan_files, next_stop, stop_report
+from services.patches import PatchConflict, apply_patch
+from services.context import count_tokens
+from services.metrics import PATCH_OUTPUT_TOKENS, register_models
 from constants.system_prompts.dev import DEV_AGENT_PROMPT
 from constants.system_prompts.dev_without_tdd import DEV_AGENT_NO_TDD_PROMPT
 import time
 import json
+import uuid
 import asyncio
+import os
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "o1-mini"
+register_models(DEFAULT_MODEL)
+
 class CodeGenState(TypedDict):
     messages: List[Dict[str, Any]]
     files: Dict[str, str]
@@ -21,16 +43,66 @@ class CodeGenState(TypedDict):
     total_tokens: Dict[str, int]
     model: str
     tdd_enabled: bool
+    json_bytes_avoided: int
+    patch_savings: Dict[str, int]
+    routing: List[Dict[str, Any]]
+    llm_messages: List[Any]
+    iteration: int
+    budget: Dict[str, Any]
+    plan: List[str]
+    elapsed_seconds: float
+    model_seconds: float
+    stale_rounds: int
+    files_written: bool
+    stop: Dict[str, Any] | None
+
+class FileWriteResult(TypedDict):
+    """In-process result of `create_or_update_files`; file contents are passed by reference, never JSON-encoded."""
+    success: bool
+    files_created: List[str]
+    count: int
+    files: Dict[str, str]
 
 class FileSchema(BaseModel):
     path: str = Field(..., description="The file path relative to project root (e.g., 'src/index.ts', 'package.json')")
     content: str = Field(..., description="The complete content of the file")
 
+class FilePatchResult(TypedDict):
+    """In-process result of `apply_file_patches`: new contents of the patched files and the conflicts."""
+    files: Dict[str, str]
+    applied: List[Dict[str, Any]]
+    conflicts: List[Dict[str, Any]]
+
+class SearchReplaceSchema(BaseModel):
+    search: str = Field(..., description="Exact text to find, with enough surrounding lines to be unique; empty to fill a new file")
+    replace: str = Field(..., description="Text to put in its place")
+
+class FilePatchSchema(BaseModel):
+    path: str = Field(..., description="The file path relative to project root")
+    diff: str | None = Field(None, description="A unified diff for this file: @@ hunks with a few context lines")
+    edits: List[SearchReplaceSchema] = Field([], description="Search/replace edits, applied in order (instead of diff)")
+
+class ApplyFilePatchesInput(BaseModel):
+    patches: List[FilePatchSchema] = Field(..., description="One patch per file to change")
+
 class CreateOrUpdateFilesInput(BaseModel):
     files: List[FileSchema] = Field(..., description="List of files to create or update")
 
+class FileReadSchema(BaseModel):
+    path: str = Field(..., description="The file path relative to project root")
+    start_line: int | None = Field(None, ge=1, description="First line to return (1-based)")
+    end_line: int | None = Field(None, ge=1, description="Last line to return (inclusive)")
+    outline: bool = Field(False, description="Return only imports, declarations and signatures with line numbers")
+
 class ReadFilesInput(BaseModel):
-    files: List[str] = Field(..., description="List of file paths to read")
+    files: List[str | FileReadSchema] = Field(..., description="File paths to read in full, or objects with a line range or outline mode for large files")
+
+class SearchCodeInput(BaseModel):
+    query: str = Field(..., description="Identifiers, file names or keywords to look for")
+    limit: int = Field(10, description="Maximum number of files to return")
+
+class ProjectCommandInput(BaseModel):
+    """No arguments: the command runs against the project's current files."""
 
 class Message(BaseModel):
     type: str
@@ -38,7 +110,7 @@ class Message(BaseModel):
     content: str
 
 @tool(args_schema=CreateOrUpdateFilesInput)
-def create_or_update_files(files: List[FileSchema]) -> str:
+def create_or_update_files(files: List[FileSchema]) -> FileWriteResult:
     """Create or update multiple files in the project."""
     state_files = {}
     try:
@@ -53,276 +125,832 @@ def create_or_update_files(files: List[FileSchema]) -> str:
                 continue
                 
         logger.info(f"Successfully created/updated {len(state_files)} files: {list(state_files.keys())}")
-        return json.dumps({
+        return {
             "success": True,
             "files_created": list(state_files.keys()),
             "count": len(state_files),
-            "state_files": state_files
-        })
+            "files": state_files
+        }
     except Exception as e:
         logger.error(f"Error in create_or_update_files: {str(e)}")
         raise ValueError(f"Invalid file format: {str(e)}")
 
+@tool(args_schema=ApplyFilePatchesInput)
+def apply_file_patches(patches: List[FilePatchSchema], state_files: Dict[str, str] = None) -> FilePatchResult:
+    """Change files with unified diffs or search/replace edits instead of sending their full content. Prefer this over create_or_update_files for edits to existing files. Hunks are matched exactly, then ignoring whitespace, then approximately; a file with a hunk or edit that cannot be placed is left unchanged and the conflict is reported."""
+    state_files = state_files or {}
+    files: Dict[str, str] = {}
+    applied = []
+    conflicts = []
+    for patch in patches:
+        patch = FilePatchSchema.model_validate(patch) if isinstance(patch, dict) else patch
+        try:
+            content, matches = apply_patch(
+                files.get(patch.path, state_files.get(patch.path)),
+                patch.diff,
+                [edit.model_dump() for edit in patch.edits]
+            )
+        except PatchConflict as e:
+            logger.warning(f"Patch conflict in {patch.path}: {e.details}")
+            conflicts.append({"path": patch.path, **e.details})
+            continue
+        files[patch.path] = content
+        applied.append({"path": patch.path, "matches": matches})
+    return {"files": files, "applied": applied, "conflicts": conflicts}
+
+def _patch_savings(tool_args: Dict[str, Any], files: Dict[str, str], model: str) -> Dict[str, int]:
+    """Output tokens of a patch call against a create_or_update_files call writing the same files in full."""
+    rewrite = {"files": [{"path": path, "content": content} for path, content in files.items()]}
+    return {
+        "patch_tokens": count_tokens(json.dumps(tool_args), model),
+        "full_rewrite_tokens": count_tokens(json.dumps(rewrite), model)
+    }
+
+def _read_file(request: FileReadSchema, content: str, max_bytes: int) -> Dict[str, Any]:
+    """One read_files entry: the whole file, a line range or an outline, cut at `max_bytes` on a line boundary.
+
+    A first line longer than `max_bytes` (minified bundles, one-line JSON) is cut inside the line instead.
+    """
+    lines = content.split("\n")
+    entry: Dict[str, Any] = {"path": request.path, "exists": True, "total_lines": len(lines)}
+    if request.outline:
+        summary = outline(request.path, content)
+        if len(summary.encode("utf-8")) > max_bytes:
+            summary = summary.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore").rsplit("\n", 1)[0]
+            return {**entry, "outline": summary + "\n[... outline truncated; read a line range for the rest ...]", "truncated": True}
+        return {**entry, "outline": summary}
+    start = request.start_line or 1
+    end = min(request.end_line or len(lines), len(lines))
+    if request.start_line or request.end_line:
+        entry["start_line"], entry["end_line"] = start, end
+    selected = lines[start - 1:end]
+    size = 0
+    for index, line in enumerate(selected):
+        # Lines are joined with "\n": count the newline before each line but the first.
+        size += len(line.encode("utf-8")) + (1 if index else 0)
+        if size > max_bytes:
+            remaining = len("\n".join(selected[index:]).encode("utf-8")) + (1 if index else 0)
+            if index == 0:
+                # No whole line fits: keep the line's first `max_bytes` without splitting a character.
+                head = line.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+                marker = (
+                    f"[... truncated inside line {start} of {len(lines)}: showing its first {len(head.encode('utf-8'))} "
+                    f"of {len(line.encode('utf-8'))} bytes, {remaining - len(head.encode('utf-8'))} more bytes in the selection ...]"
+                )
+                return {**entry, "content": head + "\n" + marker, "truncated": True}
+            kept = selected[:index]
+            marker = (
+                f"[... truncated after line {start + index - 1} of {len(lines)}: {remaining} more bytes. "
+                f"Read a line range (start_line/end_line) or an outline to see the rest ...]"
+            )
+            return {**entry, "content": "\n".join(kept + [marker]), "truncated": True}
+    return {**entry, "content": "\n".join(selected)}
+
 @tool(args_schema=ReadFilesInput)
-def read_files(files: List[str], state_files: Dict[str, str] = None) -> str:
-    """Read the content of existing files in the project."""
+def read_files(files: List[str | FileReadSchema], state_files: Dict[str, str] = None) -> str:
+    """Read existing files in the project. Large files are cut at READ_FILES_MAX_BYTES; read them by line range, or ask for an outline of their signatures first."""
     if state_files is None:
         state_files = {}
+    max_bytes = int(os.getenv("READ_FILES_MAX_BYTES", "24000"))
     
     logger.info(f"Reading files: {files}")
     result = []
     for file in files:
-        result.append({
-            "path": file, 
-            "content": state_files.get(file, None),
-            "exists": file in state_files
-        })
+        request = FileReadSchema(path=file) if isinstance(file, str) else FileReadSchema.model_validate(file)
+        if request.path not in state_files:
+            result.append({"path": request.path, "content": None, "exists": False})
+            continue
+        result.append(_read_file(request, state_files[request.path], max_bytes))
     return json.dumps(result)
 
-async def developer_node(state: CodeGenState) -> CodeGenState:
-    """Process developer node for code generation."""
-    model_name = state.get("model", "o1-mini")
-    llm = ChatOpenAI(model=model_name, max_retries=3)
+@tool(args_schema=SearchCodeInput)
+def search_code(query: str, limit: int = 10, index: CodeIndex | None = None) -> str:
+    """Search the project's files by symbol, export, import and file name. Returns the best matching paths with their exports and matching lines."""
+    results = index.search(query, limit) if index is not None else []
+    logger.info(f"Search code for {query!r}: {[result['path'] for result in results]}")
+    return json.dumps(results)
+
+@tool(args_schema=ProjectCommandInput)
+async def run_tests(state_files: Dict[str, str] = None) -> str:
+    """Install the project's dependencies and run its `npm test` script in a sandbox. Returns the exit code and the tail of the output."""
+    return json.dumps(await get_sandbox_pool().run(state_files or {}, "test"))
+
+@tool(args_schema=ProjectCommandInput)
+async def typecheck(state_files: Dict[str, str] = None) -> str:
+    """Type-check the project with `tsc --noEmit` in a sandbox. Returns the exit code and the compiler errors."""
+    return json.dumps(await get_sandbox_pool().run(state_files or {}, "typecheck"))
+
+SANDBOX_TOOLS = {"run_tests": run_tests, "typecheck": typecheck}
+
+def _tool_call_paths(tool_call: Dict[str, Any]) -> Tuple[bool, set]:
+    """Return (writes, paths) for a tool call, used to order calls that touch the same files.
+
+    Code search and sandbox commands read the whole project, which is marked with the path "*".
+    """
+    tool_name = tool_call.get("name")
+    tool_args = tool_call.get("args", {})
+    if not isinstance(tool_args, dict):
+        return False, set()
+    if tool_name == "create_or_update_files":
+        paths = set()
+        for file in tool_args.get("files", []) or []:
+            path = file.get("path") if isinstance(file, dict) else getattr(file, "path", None)
+            if path:
+                paths.add(path)
+        return True, paths
+    if tool_name == "apply_file_patches":
+        paths = set()
+        for patch in tool_args.get("patches", []) or []:
+            path = patch.get("path") if isinstance(patch, dict) else getattr(patch, "path", None)
+            if path:
+                paths.add(path)
+        return True, paths
+    if tool_name == "read_files":
+        paths = set()
+        for file in tool_args.get("files", []) or []:
+            path = file if isinstance(file, str) else file.get("path") if isinstance(file, dict) else getattr(file, "path", None)
+            if path:
+                paths.add(path)
+        return False, paths
+    if tool_name == "search_code" or tool_name in SANDBOX_TOOLS:
+        return False, {"*"}
+    return False, set()
+
+async def _execute_tool_call(tool_call: Dict[str, Any], state: CodeGenState, iteration: int, index: CodeIndex) -> ToolMessage:
+    tool_name = tool_call.get("name")
+    tool_args = tool_call.get("args", {})
+    tool_call_id = tool_call.get("id", f"call_{iteration}")
     
-    tdd_enabled = state.get("tdd_enabled", False)
-    system_prompt = DEV_AGENT_PROMPT if tdd_enabled else DEV_AGENT_NO_TDD_PROMPT
+    logger.info(f"Tool: {tool_name}, Args keys: {list(tool_args.keys()) if isinstance(tool_args, dict) else 'not a dict'}")
     
-    conversation = state["messages"][-1]["content"]
+    try:
+        if tool_name == "create_or_update_files":
+            result = await asyncio.to_thread(create_or_update_files.invoke, tool_args)
+            
+            if result["success"] and result["files"]:
+                state["files"].update(result["files"])
+                index.update(result["files"])
+                # Payload the tool used to encode to JSON and the node decoded again.
+                state["json_bytes_avoided"] = state.get("json_bytes_avoided", 0) + sum(
+                    len(path) + len(content) for path, content in result["files"].items()
+                )
+                logger.info(f"✅ Created/updated {result['count']} files: {result['files_created']}")
+                await adispatch_custom_event("files", {
+                    "iteration": iteration,
+                    "count": result["count"],
+                    "files": result["files"]
+                })
+                
+                return ToolMessage(
+                    content=f"Successfully created {result['count']} files: {', '.join(result['files_created'])}",
+                    tool_call_id=tool_call_id
+                )
+            logger.error(f"❌ Tool returned unsuccessful result: {result}")
+            return ToolMessage(
+                content="Failed to create files: no valid files were provided.",
+                tool_call_id=tool_call_id
+            )
+        
+        if tool_name == "apply_file_patches":
+            # Call the underlying function directly: the tool's args_schema would drop `state_files`.
+            result = await asyncio.to_thread(apply_file_patches.func, tool_args.get("patches", []), state["files"])
+            savings = {"patches": len(result["applied"]), "conflicts": len(result["conflicts"])}
+            if result["files"]:
+                state["files"].update(result["files"])
+                index.update(result["files"])
+                savings.update(await asyncio.to_thread(_patch_savings, tool_args, result["files"], _route(state)[-1]))
+                PATCH_OUTPUT_TOKENS.labels("patch").inc(savings["patch_tokens"])
+                PATCH_OUTPUT_TOKENS.labels("full_rewrite").inc(savings["full_rewrite_tokens"])
+                logger.info(f"✅ Patched {len(result['files'])} files: {savings}")
+                await adispatch_custom_event("files", {
+                    "iteration": iteration,
+                    "count": len(result["files"]),
+                    "files": result["files"]
+                })
+            totals = dict(state.get("patch_savings") or {})
+            for key, value in savings.items():
+                totals[key] = totals.get(key, 0) + value
+            state["patch_savings"] = totals
+            
+            return ToolMessage(
+                content=json.dumps({"applied": result["applied"], "conflicts": result["conflicts"]}),
+                tool_call_id=tool_call_id
+            )
+        
+        if tool_name == "read_files":
+            # Call the underlying function directly: the tool's args_schema would drop `state_files`.
+            result_str = await asyncio.to_thread(read_files.func, tool_args.get("files", []), state["files"])
+            logger.info(f"Read files result: {result_str}")
+            
+            return ToolMessage(
+                content=result_str,
+                tool_call_id=tool_call_id
+            )
+        
+        if tool_name == "search_code":
+            # Writes never run alongside a search (see `_tool_call_paths`), so the index is not updated under it.
+            result_str = await asyncio.to_thread(search_code.func, tool_args.get("query", ""), tool_args.get("limit", 10), index)
+            return ToolMessage(
+                content=result_str,
+                tool_call_id=tool_call_id
+            )
+        
+        if tool_name in SANDBOX_TOOLS and sandbox_enabled():
+            # Call the coroutine directly: the tool's args_schema would drop `state_files`.
+            result_str = await SANDBOX_TOOLS[tool_name].coroutine(dict(state["files"]))
+            return ToolMessage(
+                content=result_str,
+                tool_call_id=tool_call_id
+            )
+        
+        logger.warning(f"Unknown tool requested: {tool_name}")
+        return ToolMessage(
+            content=f"Unknown tool: {tool_name}",
+            tool_call_id=tool_call_id
+        )
+    except Exception as e:
+        error_msg = f"Error processing tool {tool_name}: {str(e)}"
+        logger.error(error_msg)
+        
+        return ToolMessage(
+            content=error_msg,
+            tool_call_id=tool_call_id
+        )
+
+async def _dispatch_tool_calls(tool_calls: List[Dict[str, Any]], state: CodeGenState, iteration: int, index: CodeIndex) -> List[ToolMessage]:
+    """Run a turn's tool calls concurrently and return their ToolMessages in tool call order.
+
+    Reads run alongside each other; a call waits for every earlier call whose paths overlap
+    with its own when either of the two writes. Concurrency is capped by DEV_TOOL_CONCURRENCY.
+    """
+    semaphore = asyncio.Semaphore(int(os.getenv("DEV_TOOL_CONCURRENCY", "8")))
+    tasks = []
+    accesses = []
     
-    messages = []
-    first_user_content = f"{system_prompt}\n\n"
-    user_messages = []
+    async def run(tool_call: Dict[str, Any], dependencies: List[asyncio.Task]) -> ToolMessage:
+        if dependencies:
+            await asyncio.wait(dependencies)
+        async with semaphore:
+            with span("tool_call", iteration, tool=tool_call.get("name")):
+                return await _execute_tool_call(tool_call, state, iteration, index)
     
-    for msg in conversation:
-        if not hasattr(msg, 'type') or not hasattr(msg, 'role') or not hasattr(msg, 'content'):
-            logger.error(f"Invalid message format: {msg}")
-            continue
-        if msg.type != "text":
-            logger.warning(f"Skipping non-text message: {msg}")
-            continue
-        
-        if msg.role == "user":
-            user_messages.append(msg.content)
-        elif msg.role == "assistant":
-            messages.append(AIMessage(content=msg.content))
-        elif msg.role == "tool":
-            messages.append(ToolMessage(content=msg.content, tool_call_id=msg.get("tool_call_id", "unknown")))
+    for tool_call in tool_calls:
+        writes, paths = _tool_call_paths(tool_call)
+        dependencies = [
+            tasks[index] for index, (other_writes, other_paths) in enumerate(accesses)
+            if (writes or other_writes) and (paths & other_paths or "*" in paths or "*" in other_paths)
+        ]
+        accesses.append((writes, paths))
+        tasks.append(asyncio.create_task(run(tool_call, dependencies)))
     
-    if user_messages:
+    return list(await asyncio.gather(*tasks))
+
+def _relevant_files(index: CodeIndex, conversation: List[Message], model: str) -> Dict[str, str]:
+    """Pick the files that best match the latest user message, up to CODE_CONTEXT_TOKEN_BUDGET tokens."""
+    budget = int(os.getenv("CODE_CONTEXT_TOKEN_BUDGET", "8000"))
+    query = next((msg.content for msg in reversed(conversation) if msg.role == "user"), "")
+    if budget <= 0 or not query:
+        return {}
+    with span("code_index"):
+        relevant = index.select(query, model, budget)
+    logger.info(f"Inlining {len(relevant)} relevant files: {list(relevant.keys())}")
+    return relevant
+
+STOP_MESSAGES = {
+    "plan_complete": "Generated all files in the architect's plan.",
+    "tests_passed": "All tests pass.",
+    "max_iterations": "Reached maximum iterations. Files may be incomplete.",
+    "no_progress": "Stopped after several rounds without file changes. Files may be incomplete.",
+    "time_budget": "Stopped to stay within the time budget. Files may be incomplete.",
+    "token_budget": "Stopped to stay within the token budget. Files may be incomplete."
+}
+
+DEVELOPER_TOOLS = [create_or_update_files, apply_file_patches, read_files, search_code]
+
+def _developer_tools() -> List[Any]:
+    """The tool loop's tools; `run_tests` and `typecheck` are offered when SANDBOX_ENABLED=1."""
+    return DEVELOPER_TOOLS + list(SANDBOX_TOOLS.values()) if sandbox_enabled() else DEVELOPER_TOOLS
+
+def _route(state: CodeGenState) -> List[str]:
+    return get_model_router().route("developer", state.get("model"), DEFAULT_MODEL)
+
+def _conversation(state: CodeGenState) -> List[Message]:
+    # The conversation is checkpointed as plain dicts.
+    return [Message.model_validate(msg) if isinstance(msg, dict) else msg for msg in state["messages"][0]["content"]]
+
+def _stop(state: CodeGenState, reason: str) -> Dict[str, Any]:
+    return stop_report(
+        reason,
+        IterationBudget(**state["budget"]),
+        state.get("iteration", 0),
+        state.get("elapsed_seconds", 0.0),
+        (state.get("total_tokens") or {}).get("total_tokens", 0)
+    )
+
+def _code_index(state: CodeGenState, config: RunnableConfig) -> CodeIndex:
+    """The thread's code index, kept across steps so each step only re-indexes the files it changed."""
+    return project_index(config["configurable"]["thread_id"], state["files"])
+
+async def prepare_node(state: CodeGenState, config: RunnableConfig) -> Dict[str, Any]:
+    """Compact the conversation and assemble the prompt for the tool loop.
+
+    Files the conversation's plan names that do not exist yet become `plan`, the early-exit
+    target: once they are all written, the loop can stop without another model call.
+    Like the other nodes, it returns only the keys it changed, so a step's checkpoint writes
+    do not carry the unchanged files and messages again.
+    """
+    started = time.perf_counter()
+    model_name = _route(state)[-1]
+    tdd_enabled = state.get("tdd_enabled", False)
+    system_prompt = DEV_AGENT_PROMPT if tdd_enabled else DEV_AGENT_NO_TDD_PROMPT
+    update: Dict[str, Any] = {}
+    
+    conversation, summary = await compact_conversation(_conversation(state), model_name)
+    if summary:
+        update["summary"] = summary
+    
+    with span("message_assembly"):
+        context = None
         if state.get("files"):
             file_list = "\n".join([f"- {path}" for path in state["files"].keys()])
-            first_user_content += f"\nExisting files in project:\n{file_list}\n\n"
+            context = f"Existing files in project:\n{file_list}"
+            relevant = _relevant_files(_code_index(state, config), conversation, model_name)
+            if relevant:
+                inlined = "\n\n".join(f"### {path}\n```\n{content}\n```" for path, content in relevant.items())
+                context += f"\n\nContents of the files most relevant to this request (no need to read them again):\n\n{inlined}"
         
-        first_user_content += user_messages[0]
-        messages.insert(0, HumanMessage(content=first_user_content))
-        
-        for user_msg in user_messages[1:]:
-            messages.append(HumanMessage(content=user_msg))
+        update["llm_messages"] = build_messages(system_prompt, conversation, context)
+    
+    update["plan"] = [path for path in plan_files(msg.content for msg in _conversation(state)) if path not in state["files"]]
+    update["iteration"] = 0
+    update["elapsed_seconds"] = time.perf_counter() - started
+    return update
+
+async def model_node(state: CodeGenState) -> Dict[str, Any]:
+    """One model call of the tool loop.
+
+    Errors propagate instead of being recorded in the state: the step is then not checkpointed,
+    and a retry on the same thread resumes with this call.
+    """
+    started = time.perf_counter()
+    route = _route(state)
+    iteration = state.get("iteration", 0) + 1
+    logger.info(f"🔄 Iteration {iteration}/{state['budget']['max_iterations']}")
+    
+    tools = _developer_tools()
     
-    llm_with_tools = llm.bind_tools(
-        [create_or_update_files, read_files],
-        tool_choice="auto"
+    def llm_for(model: str):
+        return get_chat_model_with_tools(model, tools, tool_choice="auto")
+    
+    response, decisions = await asyncio.wait_for(
+        routed_ainvoke("developer", route, llm_for, state["llm_messages"], iteration, tools),
+        timeout=15000.0
     )
+    logger.info(f"✅ LLM invocation successful (iteration {iteration})")
+    logger.info(f"Tool calls: {len(response.tool_calls) if getattr(response, 'tool_calls', None) else 0}")
     
-    max_iterations = 3
-    iteration = 0
-    total_tokens = state.get("total_tokens", {"input_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0, "total_tokens": 0})
+    total_tokens = dict(state.get("total_tokens") or empty_tokens())
+    for decision in decisions:
+        add_token_counts(total_tokens, decision["usage"])
+    await adispatch_custom_event("tokens", dict(total_tokens))
     
-    while iteration < max_iterations:
-        iteration += 1
-        logger.info(f"🔄 Iteration {iteration}/{max_iterations}")
-        
-        try:
-            response = await asyncio.wait_for(
-                llm_with_tools.ainvoke(messages), 
-                timeout=15000.0
-            )
-            logger.info(f"✅ LLM invocation successful (iteration {iteration})")
-            logger.info(f"Response type: {type(response)}, has tool_calls: {hasattr(response, 'tool_calls')}")
-            
-            if hasattr(response, 'tool_calls'):
-                logger.info(f"Tool calls: {len(response.tool_calls) if response.tool_calls else 0}")
-            
-            usage_metadata = getattr(response, "usage_metadata", {}) or {}
-            total_tokens["input_tokens"] += usage_metadata.get("input_tokens", 0)
-            total_tokens["output_tokens"] += usage_metadata.get("output_tokens", 0)
-            total_tokens["reasoning_tokens"] += usage_metadata.get("reasoning_tokens", 0)
-            total_tokens["total_tokens"] += usage_metadata.get("total_tokens", 0)
-            
-        except asyncio.TimeoutError:
-            logger.error("LLM invocation timed out")
-            state["messages"].append({
-                "role": "assistant",
-                "content": "Timed out generating code. Please try again with a more specific conversation.",
-                "usage_metadata": {}
-            })
-            state["total_tokens"] = total_tokens
-            return state
-        except Exception as e:
-            logger.error(f"LLM invocation failed: {str(e)}")
-            state["messages"].append({
-                "role": "assistant",
-                "content": f"Error generating code: {str(e)}. Please try again.",
-                "usage_metadata": {}
-            })
-            state["total_tokens"] = total_tokens
-            return state
-        
-        messages.append(response)
-        
-        if not hasattr(response, "tool_calls") or not response.tool_calls:
-            logger.info("✅ No more tool calls, completing")
-            
-            response_content = response.content or "Generated code files for the request."
-            usage_metadata = getattr(response, "usage_metadata", {}) or {}
-            
-            state["messages"].append({
-                "role": "assistant",
-                "content": response_content,
-                "usage_metadata": usage_metadata
-            })
-            
-            files_count = len(state.get("files", {}))
-            if files_count == 0:
-                logger.warning("⚠️ No files were generated!")
-                state["messages"][-1]["content"] += "\n\n⚠️ Warning: No files were generated. Please try again with more explicit instructions."
-            else:
-                logger.info(f"✅ Successfully generated {files_count} files")
-            
-            state["total_tokens"] = total_tokens
-            break
+    seconds = time.perf_counter() - started
+    update: Dict[str, Any] = {
+        "total_tokens": total_tokens,
+        "iteration": iteration,
+        "llm_messages": list(state["llm_messages"]) + [response],
+        "elapsed_seconds": state.get("elapsed_seconds", 0.0) + seconds,
+        "model_seconds": state.get("model_seconds", 0.0) + seconds
+    }
+    if len(route) > 1:
+        update["routing"] = list(state.get("routing") or []) + [
+            {key: value for key, value in decision.items() if key != "usage"} for decision in decisions
+        ]
+    
+    if not getattr(response, "tool_calls", None):
+        logger.info("✅ No more tool calls, completing")
         
-        logger.info(f"🔧 Processing {len(response.tool_calls)} tool calls")
+        content = response.content or "Generated code files for the request."
+        files_count = len(state.get("files", {}))
+        if files_count == 0:
+            logger.warning("⚠️ No files were generated!")
+            content += "\n\n⚠️ Warning: No files were generated. Please try again with more explicit instructions."
+        else:
+            logger.info(f"✅ Successfully generated {files_count} files")
         
-        for tool_call in response.tool_calls:
-            tool_name = tool_call.get("name")
-            tool_args = tool_call.get("args", {})
-            tool_call_id = tool_call.get("id", f"call_{iteration}")
-            
-            logger.info(f"Tool: {tool_name}, Args keys: {list(tool_args.keys()) if isinstance(tool_args, dict) else 'not a dict'}")
-            
+        update["messages"] = list(state["messages"]) + [{
+            "role": "assistant",
+            "content": content,
+            "usage_metadata": getattr(response, "usage_metadata", {}) or {}
+        }]
+        update["stop"] = _stop({**state, **update}, "completed")
+    return update
+
+def _tests_passed(tool_calls: List[Dict[str, Any]], tool_messages: List[ToolMessage]) -> bool:
+    for tool_call, message in zip(tool_calls, tool_messages):
+        if tool_call.get("name") == "run_tests":
             try:
-                if tool_name == "create_or_update_files":
-                    result_str = create_or_update_files.invoke(tool_args)
-                    result = json.loads(result_str)
-                    
-                    if result.get("success") and result.get("state_files"):
-                        state["files"].update(result["state_files"])
-                        logger.info(f"✅ Created/updated {result['count']} files: {result['files_created']}")
-                        
-                        tool_message = ToolMessage(
-                            content=f"Successfully created {result['count']} files: {', '.join(result['files_created'])}",
-                            tool_call_id=tool_call_id
-                        )
-                        messages.append(tool_message)
-                    else:
-                        logger.error(f"❌ Tool returned unsuccessful result: {result}")
-                        tool_message = ToolMessage(
-                            content=f"Failed to create files: {result_str}",
-                            tool_call_id=tool_call_id
-                        )
-                        messages.append(tool_message)
-                
-                elif tool_name == "read_files":
-                    result_str = read_files.invoke({
-                        "files": tool_args.get("files", []),
-                        "state_files": state["files"]
-                    })
-                    logger.info(f"Read files result: {result_str}")
-                    
-                    tool_message = ToolMessage(
-                        content=result_str,
-                        tool_call_id=tool_call_id
-                    )
-                    messages.append(tool_message)
-                
-            except Exception as e:
-                error_msg = f"Error processing tool {tool_name}: {str(e)}"
-                logger.error(error_msg)
-                
-                tool_message = ToolMessage(
-                    content=error_msg,
-                    tool_call_id=tool_call_id
-                )
-                messages.append(tool_message)
-            
-    if iteration >= max_iterations:
-        logger.warning(f"⚠️ Reached maximum iterations ({max_iterations})")
-        state["messages"].append({
+                if json.loads(message.content).get("passed"):
+                    return True
+            except (ValueError, AttributeError):
+                continue
+    return False
+
+async def tools_node(state: CodeGenState, config: RunnableConfig) -> Dict[str, Any]:
+    """Run the tool calls of the last model reply, then decide whether the loop should continue.
+
+    Stops early when the plan's files are all written (only without sandbox tools, which would
+    still have something to verify, and outside TDD runs) or a `run_tests` call passed, and stops when the budget is
+    spent or would be by one more iteration, or after rounds without file changes once files
+    have been written.
+    """
+    started = time.perf_counter()
+    tool_calls = state["llm_messages"][-1].tool_calls
+    logger.info(f"🔧 Processing {len(tool_calls)} tool calls")
+    
+    # Tools write into a copy, so the previous checkpoint's files are never modified in place.
+    previous = {key: state.get(key) for key in ("files", "json_bytes_avoided", "patch_savings")}
+    state = {**state, "files": dict(state["files"])}
+    tool_messages = await _dispatch_tool_calls(tool_calls, state, state["iteration"], _code_index(state, config))
+    changed = state["files"] != previous["files"]
+    
+    # Only the keys that changed: unchanged files are not written to the checkpoint again.
+    update: Dict[str, Any] = {key: state[key] for key, value in previous.items() if state.get(key) != value}
+    update["llm_messages"] = list(state["llm_messages"]) + tool_messages
+    # Rounds without changes only count once the run has written something: reading comes first.
+    update["files_written"] = state.get("files_written", False) or changed
+    update["stale_rounds"] = 0 if changed or not update["files_written"] else state.get("stale_rounds", 0) + 1
+    plan = state.get("plan") or []
+    # TDD runs only finish early on passing tests: written files alone prove nothing there.
+    plan_done = changed and bool(plan) and not sandbox_enabled() and not state.get("tdd_enabled") and all(path in state["files"] for path in plan)
+    update["elapsed_seconds"] = state.get("elapsed_seconds", 0.0) + time.perf_counter() - started
+    
+    reason = next_stop(
+        IterationBudget(**state["budget"]),
+        state["iteration"],
+        update["elapsed_seconds"],
+        state.get("model_seconds", 0.0),
+        state["total_tokens"].get("total_tokens", 0),
+        update["stale_rounds"],
+        plan_done,
+        _tests_passed(tool_calls, tool_messages)
+    )
+    if reason:
+        logger.info(f"⏹️ Stopping the tool loop: {reason}")
+        update["stop"] = _stop({**state, **update}, reason)
+        update["messages"] = list(state["messages"]) + [{
             "role": "assistant",
-            "content": "Reached maximum iterations. Files may be incomplete.",
+            "content": STOP_MESSAGES[reason],
             "usage_metadata": {}
-        })
-        state["total_tokens"] = total_tokens
-    
-    return state
+        }]
+    return update
+
+def _after_model(state: CodeGenState) -> str:
+    return "tools" if getattr(state["llm_messages"][-1], "tool_calls", None) else END
+
+def _after_tools(state: CodeGenState) -> str:
+    return END if state.get("stop") else "model"
+
+def create_developer_graph(checkpointer=None):
+    """Create the Developer agent's tool loop: prepare -> model -> tools -> model ... -> END.
 
-def create_developer_graph():
-    """Create and configure the LangGraph workflow for the Developer agent."""
+    Each model call and each round of tool calls is its own node, so with a checkpointer a
+    failed run resumes from the last completed step.
+    """
     workflow = StateGraph(CodeGenState)
     
-    workflow.add_node("developer_node", developer_node)
+    workflow.add_node("prepare", prepare_node)
+    workflow.add_node("model", model_node)
+    workflow.add_node("tools", tools_node)
     
-    workflow.set_entry_point("developer_node")
-    workflow.add_edge("developer_node", END)
+    workflow.set_entry_point("prepare")
+    workflow.add_edge("prepare", "model")
+    workflow.add_conditional_edges("model", _after_model, {"tools": "tools", END: END})
+    workflow.add_conditional_edges("tools", _after_tools, {"model": "model", END: END})
     
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
-developer_graph = create_developer_graph()
+_developer_graph = None
 
-async def developer(conversation: List[Message], current_folder: Dict[str, str], tdd_enabled: bool, model: str) -> Dict[str, Any]:
-    """Run the Developer agent with the given conversation, current folder, and TDD setting."""
-    start_time = time.time()
+async def get_developer_graph():
+    """The developer graph compiled with the shared checkpointer (see `services.checkpoints`)."""
+    global _developer_graph
+    checkpointer = await get_checkpointer()
+    if _developer_graph is None or _developer_graph.checkpointer is not checkpointer:
+        _developer_graph = create_developer_graph(checkpointer)
+    return _developer_graph
+
+def _config(thread_id: str, **extra: Any) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": thread_id}, **extra}
+
+async def _graph_input(graph, config: Dict[str, Any], initial_state: Dict[str, Any]) -> Dict[str, Any] | None:
+    """None (resume) when the thread has an unfinished run, otherwise the initial state of a new run."""
+    snapshot = await graph.aget_state(config)
+    if snapshot.next:
+        logger.info(f"Resuming developer thread {config['configurable']['thread_id']} at {list(snapshot.next)}")
+        return None
+    return initial_state
+
+def _initial_state(conversation: List[Message], current_folder: Dict[str, str], tdd_enabled: bool, model: str, budget: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    return {
+        "messages": [{"role": "user", "content": [msg.model_dump() if isinstance(msg, BaseModel) else msg for msg in conversation]}],
+        "llm_messages": [],
+        "iteration": 0,
+        "budget": IterationBudget.from_env(budget).as_dict(),
+        "plan": [],
+        "elapsed_seconds": 0.0,
+        "model_seconds": 0.0,
+        "stale_rounds": 0,
+        "files_written": False,
+        "stop": None,
+        "files": current_folder.copy() if current_folder else {},
+        "summary": None,
+        "tdd_enabled": tdd_enabled,
+        "model": model,
+        "total_tokens": empty_tokens(),
+        "json_bytes_avoided": 0,
+        "patch_savings": {},
+        "routing": []
+    }
+
+def validate_file_set(files: Dict[str, str], current_folder: Dict[str, str]) -> str | None:
+    """Quick structural check of a generated project; returns why it is invalid, or None if it is valid.
+
+    Paths and contents are only checked for the files the attempt created or modified, so a file
+    the project already had (an empty `.gitkeep`, say) does not fail every attempt.
+    """
+    if not files or files == current_folder:
+        return "no files were generated"
+    if "package.json" not in files:
+        return "package.json is missing"
+    try:
+        package = json.loads(files["package.json"])
+    except ValueError as e:
+        return f"package.json is not valid JSON: {str(e)}"
+    if not isinstance(package, dict) or not package.get("name"):
+        return "package.json has no name"
+    for path, content in files.items():
+        if current_folder.get(path) == content:
+            continue
+        if path.startswith("/") or ".." in path.split("/"):
+            return f"invalid file path: {path}"
+        if not content.strip():
+            return f"{path} is empty"
+    return None
+
+class _AttemptTokens(AsyncCallbackHandler):
+    """Keeps the running token totals an attempt reports, so cancelled attempts are still counted."""
+
+    def __init__(self):
+        self.tokens = empty_tokens()
+
+    async def on_custom_event(self, name: str, data: Any, **kwargs: Any) -> None:
+        if name == "tokens":
+            self.tokens = dict(data)
+
+async def _speculate(graph, thread_id: str, initial_state: Dict[str, Any], models: List[str]) -> AsyncIterator[Tuple[str, Any]]:
+    """Run one developer attempt per model in parallel; the first with a valid file set wins.
+
+    Yields "attempt" status events, then ("result", (state, speculation)). The other attempts
+    are cancelled as soon as there is a winner. The returned state's `total_tokens` covers all
+    attempts, including the cancelled ones up to their last completed model call.
+    """
+    trackers = [_AttemptTokens() for _ in models]
+    attempts = [{"attempt": index, "model": model, "status": "running", "reason": None} for index, model in enumerate(models)]
+    results: Dict[int, Dict[str, Any]] = {}
+
+    async def attempt(index: int) -> int:
+        state = {
+            **initial_state,
+            "messages": [dict(msg) for msg in initial_state["messages"]],
+            "files": dict(initial_state["files"]),
+            "total_tokens": empty_tokens(),
+            "model": models[index]
+        }
+        config = _config(f"{thread_id}:{index}", callbacks=[trackers[index]])
+        try:
+            results[index] = await graph.ainvoke(state, config)
+        except Exception as e:
+            logger.error(f"Developer attempt {index} ({models[index]}) failed: {str(e)}")
+            attempts[index].update(status="failed", reason=str(e))
+        finally:
+            # Speculative attempts are never resumed, so failed and cancelled ones are dropped too.
+            await asyncio.shield(_release_thread(graph, config))
+        return index
+
+    for info in attempts:
+        yield "attempt", dict(info)
+    tasks = [asyncio.create_task(attempt(index)) for index in range(len(models))]
+    winner = None
     try:
-        initial_state = {
-            "messages": [{"role": "user", "content": conversation}],
-            "files": current_folder.copy() if current_folder else {},
-            "summary": None,
-            "tdd_enabled": tdd_enabled,
-            "model": model,
-            "total_tokens": {"input_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0, "total_tokens": 0}
+        for next_done in asyncio.as_completed(tasks):
+            index = await next_done
+            if index in results:
+                result = results[index]
+                reason = validate_file_set(result["files"], initial_state["files"])
+                attempts[index].update(status="invalid" if reason else "won", reason=reason)
+            yield "attempt", dict(attempts[index])
+            if attempts[index]["status"] == "won":
+                winner = index
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for info in attempts:
+        if info["status"] == "running":
+            info["status"] = "cancelled"
+            yield "attempt", dict(info)
+
+    if winner is None:
+        # No valid file set: fall back to the finished attempt that produced the most files.
+        finished = list(results)
+        if not finished:
+            raise RuntimeError("All developer attempts failed: " + "; ".join(str(info["reason"]) for info in attempts))
+        chosen = max(finished, key=lambda index: len(results[index]["files"]))
+    else:
+        chosen = winner
+
+    total_tokens = empty_tokens()
+    for index in range(len(models)):
+        tokens = results[index]["total_tokens"] if index in results else trackers[index].tokens
+        for key, value in tokens.items():
+            total_tokens[key] = total_tokens.get(key, 0) + value
+    logger.info(f"Speculative developer run: winner={winner}, attempts={[info['status'] for info in attempts]}")
+    yield "result", ({**results[chosen], "total_tokens": total_tokens}, {"winner": winner, "chosen": chosen, "attempts": attempts})
+
+def _build_response(result: Dict[str, Any], start_time: float, current_folder: Dict[str, str] | None = None, snapshot_id: str | None = None) -> Dict[str, Any]:
+    time_taken = time.time() - start_time
+    
+    assistant_messages = [msg for msg in result["messages"] if msg.get("role") == "assistant"]
+    
+    if assistant_messages:
+        assistant_message = assistant_messages[-1]
+        response_content = assistant_message["content"]
+        usage_metadata = assistant_message.get("usage_metadata", {})
+        error = bool(assistant_message.get("error"))
+    else:
+        response_content = "No response generated."
+        usage_metadata = {}
+        error = True
+    
+    files_count = len(result["files"])
+    logger.info(f"📦 Developer agent completed. Generated {files_count} files: {list(result['files'].keys())}")
+    
+    if snapshot_id is not None:
+        new_snapshot_id, changes = get_snapshot_store().commit(snapshot_id, current_folder or {}, result["files"])
+        state = {
+            "snapshot_id": new_snapshot_id,
+            "changes": changes,
+            "summary": result["summary"]
         }
+    else:
+        state = {
+            "files": result["files"],
+            "summary": result["summary"]
+        }
+    
+    response = {
+        "response": response_content,
+        "state": state,
+        "time_taken_seconds": round(time_taken, 3),
+        "tokens": result.get("total_tokens", token_counts(usage_metadata)),
+        "files_count": files_count,
+        "json_bytes_avoided": result.get("json_bytes_avoided", 0),
+        "error": error
+    }
+    if result.get("patch_savings"):
+        savings = dict(result["patch_savings"])
+        savings["tokens_saved"] = savings.get("full_rewrite_tokens", 0) - savings.get("patch_tokens", 0)
+        response["patch_savings"] = savings
+    if result.get("stop"):
+        response["stop"] = result["stop"]
+    if result.get("routing"):
+        response["routing"] = result["routing"]
+    return response
+
+def _error_response(e: Exception, start_time: float) -> Dict[str, Any]:
+    return {
+        "response": f"Error: {str(e)}. No files generated.",
+        "state": {"files": {}, "summary": None},
+        "time_taken_seconds": round(time.time() - start_time, 3),
+        "tokens": empty_tokens(),
+        "files_count": 0,
+        "json_bytes_avoided": 0,
+        "error": True
+    }
+
+async def _release_thread(graph, config: Dict[str, Any]) -> None:
+    """Drop a finished run's checkpoints and code index; they are only needed to resume a failed run."""
+    drop_project_index(config["configurable"]["thread_id"])
+    if graph.checkpointer is not None:
+        await graph.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+async def discard_thread(thread_id: str) -> None:
+    """Drop a run's checkpoints and code index when it will not be resumed (e.g. its job was cancelled)."""
+    await _release_thread(await get_developer_graph(), _config(thread_id))
+
+async def _drop_unsettled(graph, config: Dict[str, Any], settled: bool) -> None:
+    """Drop the checkpoints of a run that ended before its caller learned the thread id: it can never be resumed."""
+    if graph is not None and not settled:
+        await asyncio.shield(_release_thread(graph, config))
+
+def _failure_message(e: Exception) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        return "Timed out generating code. Please try again with a more specific conversation."
+    return f"Error generating code: {str(e)}. Please try again."
+
+async def _failure_response(graph, config: Dict[str, Any], e: Exception, start_time: float, current_folder: Dict[str, str], snapshot_id: str | None) -> Dict[str, Any]:
+    """Error response that keeps the files of the completed steps; resend with `thread_id` to resume."""
+    thread_id = config["configurable"]["thread_id"]
+    snapshot = await graph.aget_state(config) if graph is not None else None
+    if snapshot is None or not snapshot.values:
+        return {**_error_response(e, start_time), "thread_id": thread_id, "resumable": False}
+    values = dict(snapshot.values)
+    values["messages"] = list(values["messages"]) + [{
+        "role": "assistant",
+        "content": _failure_message(e),
+        "usage_metadata": {},
+        "error": True
+    }]
+    if values.get("budget"):
+        values["stop"] = _stop(values, "error")
+    logger.info(f"Developer thread {thread_id} can be resumed at {list(snapshot.next)}")
+    return {**_build_response(values, start_time, current_folder, snapshot_id), "thread_id": thread_id, "resumable": bool(snapshot.next)}
+
+async def developer(conversation: List[Message], current_folder: Dict[str, str], tdd_enabled: bool, model: str, snapshot_id: str | None = None, sample_models: List[str] | None = None, thread_id: str | None = None, budget: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Run the Developer agent with the given conversation, current folder, and TDD setting.
+
+    When `snapshot_id` is given (the snapshot `current_folder` was resolved from), the response
+    carries only the created, modified and deleted files plus the new snapshot id. With more
+    than one `sample_models`, attempts run in parallel and the first valid file set wins.
+    Runs are checkpointed per `thread_id`; calling again with the id of a failed run resumes it.
+    A run cancelled before it could report its generated `thread_id` is dropped.
+    `budget` lowers the server's iteration, time and token limits (see `IterationBudget`).
+    """
+    start_time = time.time()
+    settled = thread_id is not None
+    thread_id = thread_id or uuid.uuid4().hex
+    config = _config(thread_id)
+    graph = None
+    try:
+        graph = await get_developer_graph()
+        initial_state = _initial_state(conversation, current_folder, tdd_enabled, model, budget)
         
-        result = await developer_graph.ainvoke(initial_state)
-        
-        time_taken = time.time() - start_time
-        
-        assistant_messages = [msg for msg in result["messages"] if msg.get("role") == "assistant"]
+        if sample_models and len(sample_models) > 1:
+            async for event, data in _speculate(graph, thread_id, initial_state, sample_models):
+                if event == "result":
+                    result, speculation = data
+            return {**_build_response(result, start_time, current_folder, snapshot_id), "speculation": speculation, "thread_id": thread_id}
         
-        if assistant_messages:
-            assistant_message = assistant_messages[-1]
-            response_content = assistant_message["content"]
-            usage_metadata = assistant_message.get("usage_metadata", {})
-        else:
-            response_content = "No response generated."
-            usage_metadata = {}
+        result = await graph.ainvoke(await _graph_input(graph, config, initial_state), config)
+        await _release_thread(graph, config)
+        settled = True
         
-        files_count = len(result["files"])
-        logger.info(f"📦 Developer agent completed. Generated {files_count} files: {list(result['files'].keys())}")
+        return {**_build_response(result, start_time, current_folder, snapshot_id), "thread_id": thread_id}
+    except Exception as e:
+        logger.error(f"Error in developer agent: {str(e)}")
+        settled = True
+        return await _failure_response(graph, config, e, start_time, current_folder, snapshot_id)
+    finally:
+        await _drop_unsettled(graph, config, settled)
+
+async def developer_stream(conversation: List[Message], current_folder: Dict[str, str], tdd_enabled: bool, model: str, snapshot_id: str | None = None, sample_models: List[str] | None = None, thread_id: str | None = None, budget: Dict[str, Any] | None = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream tokens and "files" events from the Developer agent, then a final "done" event with the usual response body.
+
+    Speculative runs (several `sample_models`) stream "attempt" status events instead of tokens and files.
+    A run whose client disconnects (or whose job is cancelled) before it got the generated
+    `thread_id` is dropped.
+    """
+    start_time = time.time()
+    settled = thread_id is not None
+    thread_id = thread_id or uuid.uuid4().hex
+    config = _config(thread_id)
+    graph = None
+    try:
+        graph = await get_developer_graph()
+        initial_state = _initial_state(conversation, current_folder, tdd_enabled, model, budget)
         
-        response = {
-            "response": response_content,
-            "state": {
-                "files": result["files"],
-                "summary": result["summary"]
-            },
-            "time_taken_seconds": round(time_taken, 3),
-            "tokens": result.get("total_tokens", {
-                "input_tokens": usage_metadata.get("input_tokens", 0),
-                "output_tokens": usage_metadata.get("output_tokens", 0),
-                "reasoning_tokens": usage_metadata.get("reasoning_tokens", 0),
-                "total_tokens": usage_metadata.get("total_tokens", 0)
-            }),
-            "files_count": files_count
-        }
+        if sample_models and len(sample_models) > 1:
+            async for event, data in _speculate(graph, thread_id, initial_state, sample_models):
+                if event == "result":
+                    result, speculation = data
+                    yield "done", {**_build_response(result, start_time, current_folder, snapshot_id), "speculation": speculation, "thread_id": thread_id}
+                else:
+                    yield event, data
+            return
         
-        return response
+        async for event, data in stream_graph_events(graph, await _graph_input(graph, config, initial_state), config):
+            if event == "result":
+                await _release_thread(graph, config)
+                settled = True
+                yield "done", {**_build_response(data, start_time, current_folder, snapshot_id), "thread_id": thread_id}
+            else:
+                yield event, data
     except Exception as e:
-        logger.error(f"Error in developer agent: {str(e)}")
-        return {
-            "response": f"Error: {str(e)}. No files generated.",
-            "state": {"files": {}, "summary": None},
-            "time_taken_seconds": round(time.time() - start_time, 3),
-            "tokens": {"input_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0, "total_tokens": 0},
-            "files_count": 0
-        }
\ No newline at end of file
+        logger.error(f"Error in developer agent stream: {str(e)}")
+        settled = True
+        yield "error", await _failure_response(graph, config, e, start_time, current_folder, snapshot_id)
+    finally:
+        await _drop_unsettled(graph, config, settled)
@@ -0,0 +1,247 @@
+from langgraph.graph import StateGraph, END
+from langchain_core.messages import ToolMessage
+from typing import TypedDict, List, Dict, Any, AsyncIterator, Tuple
+from agents.spec import AgentSpec
+from agents.registry import AGENT_SPECS
+from services.llm_clients import get_chat_model, get_chat_model_with_tools
+from services.routing import get_model_router, routed_ainvoke, AUTO_MODEL
+from services.metrics import span
+from services.messages import build_messages
+from services.context import compact_conversation
+from services.usage import add_token_counts, empty_tokens
+from services.streaming import stream_graph_events
+from services.response_cache import get_response_cache, make_cache_key, cached_response, store_response
+import time
+import json
+import asyncio
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AgentState(TypedDict):
+    messages: List[Dict[str, Any]]
+    model: str
+    total_tokens: Dict[str, int]
+    routing: List[Dict[str, Any]]
+
+class UnknownAgentError(KeyError):
+    pass
+
+def get_agent_spec(name: str) -> AgentSpec:
+    spec = AGENT_SPECS.get(name)
+    if spec is None:
+        raise UnknownAgentError(name)
+    return spec
+
+async def _run_tool(spec: AgentSpec, tool_call: Dict[str, Any], iteration: int) -> ToolMessage:
+    tool_name = tool_call.get("name")
+    tool_call_id = tool_call.get("id", f"call_{iteration}")
+    tool = next((t for t in spec.tools if t.name == tool_name), None)
+    if tool is None:
+        return ToolMessage(content=f"Unknown tool: {tool_name}", tool_call_id=tool_call_id)
+    try:
+        with span("tool_call", iteration, tool=tool_name):
+            result = await tool.ainvoke(tool_call.get("args", {}))
+        return ToolMessage(content=result if isinstance(result, str) else json.dumps(result, default=str), tool_call_id=tool_call_id)
+    except Exception as e:
+        logger.error(f"Error processing tool {tool_name}: {str(e)}")
+        return ToolMessage(content=f"Error processing tool {tool_name}: {str(e)}", tool_call_id=tool_call_id)
+
+def resolve_model(spec: AgentSpec, model: str | None) -> str:
+    """The requested model, else "auto" when the agent has a model cascade, else the agent's default."""
+    return model or (AUTO_MODEL if get_model_router().has_cascade(spec.name) else spec.default_model)
+
+def _make_node(spec: AgentSpec):
+    async def agent_node(state: AgentState) -> AgentState:
+        route = get_model_router().route(spec.name, state.get("model"), spec.default_model)
+        model_name = route[-1]
+
+        def llm_for(model: str):
+            if spec.tools:
+                return get_chat_model_with_tools(model, spec.tools, tool_choice="auto")
+            return get_chat_model(model)
+
+        conversation, _ = await compact_conversation(state["messages"][-1]["content"], model_name)
+
+        with span("message_assembly"):
+            messages = build_messages(spec.system_prompt, conversation)
+
+        total_tokens = state.get("total_tokens") or empty_tokens()
+        state["total_tokens"] = total_tokens
+
+        for iteration in range(1, spec.max_iterations + 1):
+            try:
+                response, decisions = await asyncio.wait_for(
+                    routed_ainvoke(spec.name, route, llm_for, messages, iteration, spec.tools, spec.required_sections),
+                    timeout=spec.timeout_seconds
+                )
+                logger.info(f"{spec.display_name} LLM invocation successful (iteration {iteration})")
+            except asyncio.TimeoutError:
+                logger.error(f"{spec.display_name} LLM invocation timed out")
+                state["messages"].append({
+                    "role": "assistant",
+                    "content": "Timed out generating response. Please try again with a more specific conversation.",
+                    "usage_metadata": {},
+                    "error": True
+                })
+                return state
+            except Exception as e:
+                logger.error(f"{spec.display_name} LLM invocation failed: {str(e)}")
+                state["messages"].append({
+                    "role": "assistant",
+                    "content": f"Error generating response: {str(e)}. Please try again.",
+                    "usage_metadata": {},
+                    "error": True
+                })
+                return state
+
+            usage_metadata = getattr(response, "usage_metadata", {}) or {}
+            for decision in decisions:
+                add_token_counts(total_tokens, decision["usage"])
+            if len(route) > 1:
+                state.setdefault("routing", []).extend(
+                    {key: value for key, value in decision.items() if key != "usage"} for decision in decisions
+                )
+
+            tool_calls = getattr(response, "tool_calls", None) or []
+            if not tool_calls or iteration == spec.max_iterations:
+                state["messages"].append({
+                    "role": "assistant",
+                    "content": response.content or "Generated response for the request.",
+                    "usage_metadata": usage_metadata
+                })
+                return state
+
+            messages.append(response)
+            messages.extend(await asyncio.gather(*[_run_tool(spec, tool_call, iteration) for tool_call in tool_calls]))
+
+        return state
+
+    return agent_node
+
+def create_agent_graph(spec: AgentSpec):
+    workflow = StateGraph(AgentState)
+
+    workflow.add_node("agent_node", _make_node(spec))
+
+    workflow.set_entry_point("agent_node")
+    workflow.add_edge("agent_node", END)
+
+    return workflow.compile()
+
+_graphs: Dict[str, Any] = {}
+
+def get_agent_graph(name: str):
+    """Compile an agent's graph on first use and reuse it afterwards."""
+    graph = _graphs.get(name)
+    if graph is None:
+        graph = create_agent_graph(get_agent_spec(name))
+        _graphs[name] = graph
+        logger.info(f"Compiled graph for agent: {name}")
+    return graph
+
+def _initial_state(conversation: List[Any], model: str) -> Dict[str, Any]:
+    return {
+        "messages": [{"role": "user", "content": conversation}],
+        "model": model,
+        "total_tokens": empty_tokens(),
+        "routing": []
+    }
+
+def _build_response(result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    time_taken = time.time() - start_time
+
+    assistant_message = result["messages"][-1]
+
+    response = {
+        "response": assistant_message["content"],
+        "time_taken_seconds": round(time_taken, 3),
+        "tokens": result.get("total_tokens") or empty_tokens(),
+        "error": bool(assistant_message.get("error"))
+    }
+    if result.get("routing"):
+        response["routing"] = result["routing"]
+    return response
+
+def _error_response(e: Exception, start_time: float) -> Dict[str, Any]:
+    return {
+        "response": f"Error: {str(e)}. No response generated.",
+        "time_taken_seconds": round(time.time() - start_time, 3),
+        "tokens": empty_tokens(),
+        "error": True,
+        "cache_hit": False,
+        "tokens_saved": 0
+    }
+
+def _store(cache, cache_key: str, result: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    if result["messages"][-1].get("error"):
+        return store_response(None, cache_key, response)
+    return store_response(cache, cache_key, response)
+
+def _cache_for(spec: AgentSpec, model: str, conversation: List[Any]):
+    cache = get_response_cache() if spec.cacheable else None
+    cache_key = make_cache_key(spec.name, model, spec.system_prompt, conversation) if cache is not None else None
+    return cache, cache_key
+
+def cached_agent_response(name: str, conversation: List[Any], model: str | None = None) -> Dict[str, Any] | None:
+    """The cached response for an agent request, or None; lets callers answer hits without taking an admission place."""
+    start_time = time.time()
+    spec = get_agent_spec(name)
+    cache, cache_key = _cache_for(spec, resolve_model(spec, model), conversation)
+    if cache is None:
+        return None
+    try:
+        cached = cache.get(cache_key)
+    except Exception as e:
+        logger.warning(f"Response cache lookup failed: {str(e)}")
+        return None
+    return cached_response(cached, start_time) if cached is not None else None
+
+async def run_agent(name: str, conversation: List[Any], model: str | None = None, use_cache: bool = True) -> Dict[str, Any]:
+    """Run a registered agent on a conversation and return the API response body."""
+    start_time = time.time()
+    spec = get_agent_spec(name)
+    model = resolve_model(spec, model)
+    try:
+        cache, cache_key = _cache_for(spec, model, conversation)
+        if cache is not None and use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"{spec.display_name} agent cache hit: {cache_key}")
+                return cached_response(cached, start_time)
+
+        result = await get_agent_graph(name).ainvoke(_initial_state(conversation, model))
+
+        response = _store(cache, cache_key, result, _build_response(result, start_time))
+
+        logger.info(f"{spec.display_name} agent response: {response}")
+        return response
+    except Exception as e:
+        logger.error(f"Error in {spec.display_name} agent: {str(e)}")
+        return _error_response(e, start_time)
+
+async def run_agent_stream(name: str, conversation: List[Any], model: str | None = None, use_cache: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream tokens as they are generated, then a final "done" event with the usual response body."""
+    start_time = time.time()
+    spec = get_agent_spec(name)
+    model = resolve_model(spec, model)
+    try:
+        cache, cache_key = _cache_for(spec, model, conversation)
+        if cache is not None and use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"{spec.display_name} agent cache hit: {cache_key}")
+                yield "done", cached_response(cached, start_time)
+                return
+
+        async for event, data in stream_graph_events(get_agent_graph(name), _initial_state(conversation, model)):
+            if event == "result":
+                response = _store(cache, cache_key, data, _build_response(data, start_time))
+                logger.info(f"{spec.display_name} agent streamed response: {response}")
+                yield "done", response
+            else:
+                yield event, data
+    except Exception as e:
+        logger.error(f"Error in {spec.display_name} agent stream: {str(e)}")
+        yield "error", _error_response(e, start_time)
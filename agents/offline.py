@@ -0,0 +1,113 @@
+from typing import Any, Dict, List, Tuple
+from agents.engine import get_agent_spec, resolve_model
+from agents.spec import AgentSpec
+from agents.developer import Message
+from services.messages import build_messages
+from services.context import compact_conversation
+from services.usage import empty_tokens, token_counts
+from services.response_cache import get_response_cache, make_cache_key, cached_response, store_response
+from services.routing import get_model_router
+from services.provider_batch import get_batch_provider, batch_request, usage_metadata
+from services.jobs import ProgressCallback
+import asyncio
+import os
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _item_response(result: Dict[str, Any] | None, start_time: float) -> Dict[str, Any]:
+    """Turn one provider result line into the usual agent response body."""
+    body = ((result or {}).get("response") or {}).get("body") or {}
+    choices = body.get("choices") or []
+    if not choices:
+        error = (result or {}).get("error") or body.get("error") or {"message": "No result returned by the provider."}
+        return {
+            "response": f"Error generating response: {error.get('message', error)}. Please try again.",
+            "time_taken_seconds": round(time.time() - start_time, 3),
+            "tokens": empty_tokens(),
+            "error": True
+        }
+    return {
+        "response": choices[0].get("message", {}).get("content") or "Generated response for the request.",
+        "time_taken_seconds": round(time.time() - start_time, 3),
+        "tokens": token_counts(usage_metadata(body.get("usage"))),
+        "error": False
+    }
+
+async def _batch_requests(spec: AgentSpec, items: List[Dict[str, Any]], cache, start_time: float) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]], Dict[str, str]]:
+    """Cached responses by custom id, the provider requests for the other items, and their cache keys."""
+    responses: Dict[str, Dict[str, Any]] = {}
+    requests: List[Dict[str, Any]] = []
+    cache_keys: Dict[str, str] = {}
+    for index, item in enumerate(items):
+        custom_id = str(index)
+        model = resolve_model(spec, item.get("model"))
+        conversation = [Message.model_validate(msg) for msg in item["conversation"]]
+        if cache is not None:
+            cache_keys[custom_id] = make_cache_key(spec.name, model, spec.system_prompt, conversation)
+            cached = cache.get(cache_keys[custom_id])
+            if cached is not None:
+                responses[custom_id] = cached_response(cached, start_time)
+                continue
+        # Batch results cannot be checked and escalated, so a cascade runs on its strongest model.
+        model = get_model_router().route(spec.name, model, spec.default_model)[-1]
+        conversation, _ = await compact_conversation(conversation, model)
+        requests.append(batch_request(custom_id, model, build_messages(spec.system_prompt, conversation)))
+    return responses, requests, cache_keys
+
+async def run_offline_batch(payload: Dict[str, Any], progress: ProgressCallback) -> Dict[str, Any]:
+    """Job runner that runs an agent over many conversations through the provider's batch API.
+
+    Items already in the response cache are answered without a request. The provider batch id,
+    the cache hits and the submitted requests are saved in the job payload, so a restarted job
+    polls the same batch and matches its results without looking up or compacting anything again.
+    """
+    start_time = time.time()
+    spec = get_agent_spec(payload["agent"])
+    if spec.tools:
+        raise ValueError(f"Agent '{spec.name}' uses tools and cannot run in provider batch mode")
+
+    cache = get_response_cache() if spec.cacheable else None
+    provider = get_batch_provider()
+    batch_id = payload.get("provider_batch_id")
+    if batch_id and "requests" in payload:
+        responses = dict(payload["cached_responses"])
+        requests = payload["requests"]
+        cache_keys = payload["cache_keys"]
+    else:
+        responses, requests, cache_keys = await _batch_requests(spec, payload["items"], cache, start_time)
+    if requests and not batch_id:
+        batch_id = await provider.submit(requests)
+        progress("payload", {"provider_batch_id": batch_id, "requests": requests, "cached_responses": responses, "cache_keys": cache_keys})
+        logger.info(f"Submitted {len(requests)} {spec.display_name} requests as provider batch {batch_id}")
+
+    if requests:
+        poll_seconds = float(os.getenv("PROVIDER_BATCH_POLL_SECONDS", "30"))
+        while (results := await provider.poll(batch_id)) is None:
+            await asyncio.sleep(poll_seconds)
+        by_id = {result.get("custom_id"): result for result in results}
+        for request in requests:
+            custom_id = request["custom_id"]
+            response = _item_response(by_id.get(custom_id), start_time)
+            responses[custom_id] = store_response(None if response["error"] else cache, cache_keys.get(custom_id), response)
+
+    tokens = empty_tokens()
+    items = []
+    for index, item in enumerate(payload["items"]):
+        response = responses[str(index)]
+        for key, value in response["tokens"].items():
+            tokens[key] = tokens.get(key, 0) + value
+        items.append({"id": item.get("id"), "status": "error" if response.get("error") else "ok", "response": response})
+
+    succeeded = sum(item["status"] == "ok" for item in items)
+    return {
+        "agent": spec.name,
+        "provider_batch_id": batch_id,
+        "items": items,
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "time_taken_seconds": round(time.time() - start_time, 3),
+        "tokens": tokens
+    }
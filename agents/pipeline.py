@@ -0,0 +1,196 @@
+from langgraph.graph import StateGraph, END, START
+from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.callbacks.manager import adispatch_custom_event
+from typing import TypedDict, List, Dict, Any, AsyncIterator, Tuple
+from collections import OrderedDict
+from agents.engine import run_agent, get_agent_spec, resolve_model
+from agents.developer import developer, Message, DEFAULT_MODEL
+from services.usage import empty_tokens
+from services.streaming import stream_graph_events
+from services.routing import get_model_router, AUTO_MODEL
+from services.checkpoints import get_checkpointer
+import os
+import time
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ["ba", "system-architect", "developer"]
+
+class PipelineState(TypedDict):
+    conversation: List[Any]
+    models: Dict[str, str]
+    current_folder: Dict[str, str]
+    tdd_enabled: bool
+    stages: Dict[str, Dict[str, Any]]
+    failed_stage: str | None
+    failure: Dict[str, Any] | None
+    pipeline_id: str
+
+class UnknownPipelineError(KeyError):
+    pass
+
+def _as_conversation(content: str) -> List[Message]:
+    return [Message(type="text", role="user", content=content)]
+
+async def _finish_stage(state: PipelineState, stage: str, response: Dict[str, Any]) -> PipelineState:
+    stages = dict(state.get("stages") or {})
+    if response.get("error"):
+        logger.error(f"Pipeline stage {stage} failed: {response.get('response')}")
+        await adispatch_custom_event("stage_failed", {"stage": stage, "output": response})
+        return {"failed_stage": stage, "failure": response}
+    stages[stage] = response
+    await adispatch_custom_event("stage", {"stage": stage, "output": response})
+    return {"stages": stages, "failed_stage": None, "failure": None}
+
+async def ba_stage(state: PipelineState) -> PipelineState:
+    conversation = [Message.model_validate(msg) for msg in state["conversation"]]
+    response = await run_agent("ba", conversation, state["models"].get("ba"))
+    return await _finish_stage(state, "ba", response)
+
+async def architect_stage(state: PipelineState) -> PipelineState:
+    prd = state["stages"]["ba"]["response"]
+    response = await run_agent("system-architect", _as_conversation(prd), state["models"].get("system-architect"))
+    return await _finish_stage(state, "system-architect", response)
+
+async def developer_stage(state: PipelineState) -> PipelineState:
+    architecture = state["stages"]["system-architect"]["response"]
+    response = await developer(
+        _as_conversation(architecture),
+        state.get("current_folder") or {},
+        state.get("tdd_enabled", False),
+        state["models"].get("developer"),
+        # A retried pipeline resumes the developer run from its last completed step.
+        thread_id=f"{state['pipeline_id']}:developer"
+    )
+    return await _finish_stage(state, "developer", response)
+
+def _next_stage(state: PipelineState) -> str:
+    """Route to the first stage without an output, so a resumed run skips completed stages."""
+    if state.get("failed_stage"):
+        return END
+    completed = state.get("stages") or {}
+    for stage in STAGES:
+        if stage not in completed:
+            return stage
+    return END
+
+def create_pipeline_graph():
+    workflow = StateGraph(PipelineState)
+
+    workflow.add_node("ba", ba_stage)
+    workflow.add_node("system-architect", architect_stage)
+    workflow.add_node("developer", developer_stage)
+
+    routes = {stage: stage for stage in STAGES}
+    routes[END] = END
+    workflow.add_conditional_edges(START, _next_stage, routes)
+    for stage in STAGES:
+        workflow.add_conditional_edges(stage, _next_stage, routes)
+
+    # Completed stage outputs are checkpointed per pipeline id, so a failed run can be resumed.
+    return workflow.compile(checkpointer=InMemorySaver())
+
+pipeline_graph = create_pipeline_graph()
+
+# Unfinished pipelines whose checkpoints are kept for a retry, least recently run first.
+_retained: "OrderedDict[str, None]" = OrderedDict()
+
+def _config(pipeline_id: str) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": pipeline_id}}
+
+async def _retire(pipeline_id: str, completed: bool) -> None:
+    """Drop a completed pipeline's checkpoints; keep unfinished ones for a retry, up to PIPELINE_MAX_RETAINED."""
+    _retained.pop(pipeline_id, None)
+    if completed:
+        # The developer stage already released its own thread when it succeeded.
+        await pipeline_graph.checkpointer.adelete_thread(pipeline_id)
+        return
+    _retained[pipeline_id] = None
+    while len(_retained) > int(os.getenv("PIPELINE_MAX_RETAINED", "100")):
+        evicted, _ = _retained.popitem(last=False)
+        logger.info(f"Dropping checkpoints of unfinished pipeline {evicted}")
+        await pipeline_graph.checkpointer.adelete_thread(evicted)
+        await (await get_checkpointer()).adelete_thread(f"{evicted}:developer")
+
+async def _prepare(pipeline_id: str | None, conversation: List[Any], models: Dict[str, str], current_folder: Dict[str, str], tdd_enabled: bool) -> Tuple[str, Dict[str, Any]]:
+    if pipeline_id is None:
+        pipeline_id = uuid.uuid4().hex
+        return pipeline_id, {
+            # Stored as plain dicts so the checkpoint only holds JSON-compatible values.
+            "conversation": [{"type": msg.type, "role": msg.role, "content": msg.content} for msg in conversation],
+            "models": {
+                "ba": resolve_model(get_agent_spec("ba"), models.get("ba")),
+                "system-architect": resolve_model(get_agent_spec("system-architect"), models.get("system-architect")),
+                "developer": models.get("developer") or (AUTO_MODEL if get_model_router().has_cascade("developer") else DEFAULT_MODEL)
+            },
+            "current_folder": current_folder,
+            "tdd_enabled": tdd_enabled,
+            "stages": {},
+            "failed_stage": None,
+            "failure": None,
+            "pipeline_id": pipeline_id
+        }
+    snapshot = await pipeline_graph.aget_state(_config(pipeline_id))
+    if not snapshot.values:
+        raise UnknownPipelineError(pipeline_id)
+    # Resume: keep completed stage outputs, clear the failure and allow new models for the retry.
+    resume = {"failed_stage": None, "failure": None}
+    if models:
+        resume["models"] = {**snapshot.values.get("models", {}), **models}
+    logger.info(f"Resuming pipeline {pipeline_id} after stages: {list(snapshot.values.get('stages', {}).keys())}")
+    return pipeline_id, resume
+
+def _build_response(pipeline_id: str, result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    tokens = empty_tokens()
+    for stage_output in (result.get("stages") or {}).values():
+        for key, value in (stage_output.get("tokens") or {}).items():
+            tokens[key] = tokens.get(key, 0) + value
+    return {
+        "pipeline_id": pipeline_id,
+        "stages": result.get("stages") or {},
+        "failed_stage": result.get("failed_stage"),
+        "failure": result.get("failure"),
+        "completed": all(stage in (result.get("stages") or {}) for stage in STAGES),
+        "time_taken_seconds": round(time.time() - start_time, 3),
+        "tokens": tokens
+    }
+
+async def run_pipeline(conversation: List[Any], models: Dict[str, str], current_folder: Dict[str, str], tdd_enabled: bool, pipeline_id: str | None = None) -> Dict[str, Any]:
+    """Run BA -> System Architect -> Developer, or resume `pipeline_id` from its first incomplete stage."""
+    start_time = time.time()
+    pipeline_id, pipeline_input = await _prepare(pipeline_id, conversation, models, current_folder, tdd_enabled)
+    response = None
+    try:
+        result = await pipeline_graph.ainvoke(pipeline_input, _config(pipeline_id))
+        response = _build_response(pipeline_id, result, start_time)
+    finally:
+        await _retire(pipeline_id, bool(response and response["completed"]))
+    return response
+
+async def run_pipeline_stream(conversation: List[Any], models: Dict[str, str], current_folder: Dict[str, str], tdd_enabled: bool, pipeline_id: str | None = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Return a stream of tokens and a "stage" event as each stage finishes, then a final "done" event.
+
+    The pipeline is looked up before the stream is returned, so an unknown `pipeline_id` raises
+    UnknownPipelineError here rather than inside the stream.
+    """
+    start_time = time.time()
+    pipeline_id, pipeline_input = await _prepare(pipeline_id, conversation, models, current_folder, tdd_enabled)
+    return _stream_pipeline(pipeline_id, pipeline_input, start_time)
+
+async def _stream_pipeline(pipeline_id: str, pipeline_input: Dict[str, Any], start_time: float) -> AsyncIterator[Tuple[str, Any]]:
+    completed = False
+    try:
+        yield "pipeline", {"pipeline_id": pipeline_id}
+        async for event, data in stream_graph_events(pipeline_graph, pipeline_input, _config(pipeline_id)):
+            if event == "result":
+                response = _build_response(pipeline_id, data, start_time)
+                completed = response["completed"]
+                yield "done", response
+            else:
+                yield event, data
+    finally:
+        # Also runs when the client disconnects, so an abandoned stream is still bounded.
+        await _retire(pipeline_id, completed)
@@ -0,0 +1,31 @@
+from typing import Dict
+from agents.spec import AgentSpec
+from services.metrics import register_models
+from constants.system_prompts.business_analyst import BA_SYSTEM_PROMPT
+from constants.system_prompts.system_architect import SYS_ARCH_SYSTEM_PROMPT
+
+AGENT_SPECS: Dict[str, AgentSpec] = {
+    spec.name: spec
+    for spec in [
+        AgentSpec(
+            name="ba",
+            display_name="Business Analyst",
+            system_prompt=BA_SYSTEM_PROMPT,
+            required_sections=(
+                "Functional Requirements", "Non-Functional Requirements", "Inputs", "Outputs",
+                "Acceptance Criteria", "Constraints", "Example Usage"
+            )
+        ),
+        AgentSpec(
+            name="system-architect",
+            display_name="System Architect",
+            system_prompt=SYS_ARCH_SYSTEM_PROMPT,
+            required_sections=(
+                "Technology Stack", "High-Level Design", "Module Breakdown", "Data Flow",
+                "Error Handling Strategy", "Security Considerations", "Task Breakdown for Developer", "Testing Strategy"
+            )
+        ),
+    ]
+}
+
+register_models(*(spec.default_model for spec in AGENT_SPECS.values()))
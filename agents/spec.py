@@ -0,0 +1,16 @@
+from typing import Any, List, Tuple
+from dataclasses import dataclass, field
+
+@dataclass(frozen=True)
+class AgentSpec:
+    """Everything the agent engine needs to run a conversational agent."""
+    name: str
+    display_name: str
+    system_prompt: str
+    default_model: str = "o1-mini"
+    tools: List[Any] = field(default_factory=list)
+    max_iterations: int = 1
+    timeout_seconds: float = 15000.0
+    cacheable: bool = True
+    # `## Section` headings a final answer must contain; missing ones escalate a model cascade.
+    required_sections: Tuple[str, ...] = ()
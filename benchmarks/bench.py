@@ -0,0 +1,154 @@
+"""Load-test the service in-process against the fake chat model.
+
+Drives `main.app` through an ASGI transport (no network, no real LLM) and reports latency
+percentiles, throughput, RSS and per-request allocation peaks for each endpoint, concurrency
+and `current_folder` size:
+
+    python -m benchmarks.bench --requests 200 --concurrency 1 16 --folder-sizes 0 100 1000
+
+Model latency and output are shaped with the LLM_FAKE_* variables (see README).
+"""
+from typing import Any, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import time
+import tracemalloc
+
+os.environ.setdefault("LLM_FAKE", "1")
+os.environ.setdefault("API_KEY", "bench")
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "none")
+os.environ.setdefault("LLM_MAX_WAITING", "100000")
+os.environ.setdefault("LLM_MAX_CONCURRENCY", "1024")
+os.environ.setdefault("LLM_MAX_CONCURRENCY_PER_MODEL", "1024")
+os.environ.setdefault("JOBS_DB_PATH", ":memory:")
+os.environ.setdefault("DEV_CHECKPOINT_DB", ":memory:")
+
+import httpx
+import main
+
+HEADERS = {"Authorization": f"Bearer {os.environ['API_KEY']}"}
+CONVERSATION = [{"type": "text", "role": "user", "content": "Build a todo list API with users, lists and items."}]
+
+def _folder(files: int, file_bytes: int) -> Dict[str, str]:
+    line = "export const value = 1;\n"
+    body = line * max(1, file_bytes // len(line))
+    return {f"src/feature{index // 20}/module{index}.ts": body for index in range(files)}
+
+ENDPOINTS: Dict[str, Callable[[Dict[str, str]], tuple]] = {
+    "ba": lambda folder: ("/agents/ba", {"conversation": CONVERSATION}),
+    "system-architect": lambda folder: ("/agents/system-architect", {"conversation": CONVERSATION}),
+    "developer": lambda folder: ("/agents/developer", {"conversation": CONVERSATION, "current_folder": folder, "tdd_enabled": False, "model": "o1-mini"}),
+    "developer-stream": lambda folder: ("/agents/developer/stream", {"conversation": CONVERSATION, "current_folder": folder, "tdd_enabled": False, "model": "o1-mini"}),
+    "pipeline": lambda folder: ("/pipeline", {"conversation": CONVERSATION, "current_folder": folder}),
+}
+FOLDER_ENDPOINTS = ("developer", "developer-stream", "pipeline")
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+async def _request(client: httpx.AsyncClient, path: str, body: Dict[str, Any]) -> float:
+    started = time.perf_counter()
+    response = await client.post(path, json=body, headers=HEADERS)
+    await response.aread()
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+    return time.perf_counter() - started
+
+async def _load(client: httpx.AsyncClient, path: str, body: Dict[str, Any], requests: int, concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> float:
+        async with semaphore:
+            return await _request(client, path, body)
+
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[one() for _ in range(requests)])
+    wall = time.perf_counter() - started
+    return {
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "throughput_rps": round(requests / wall, 2),
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1)
+    }
+
+async def _allocations(client: httpx.AsyncClient, path: str, body: Dict[str, Any], samples: int) -> float:
+    """Median peak of Python allocations during one request (KiB), measured sequentially."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            await _request(client, path, body)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return round(statistics.median(peaks) / 1024, 1)
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for endpoint in args.endpoints:
+                sizes = args.folder_sizes if endpoint in FOLDER_ENDPOINTS else [0]
+                for files in sizes:
+                    path, body = ENDPOINTS[endpoint](_folder(files, args.file_bytes))
+                    await _request(client, path, body)  # warm-up: graph compilation, client creation
+                    allocations = await _allocations(client, path, body, args.allocation_samples) if args.allocation_samples else None
+                    for concurrency in args.concurrency:
+                        row = {
+                            "endpoint": endpoint,
+                            "folder_files": files,
+                            "concurrency": concurrency,
+                            "requests": args.requests,
+                            **await _load(client, path, body, args.requests, concurrency),
+                            "alloc_peak_kib": allocations
+                        }
+                        results.append(row)
+                        print(
+                            f"{endpoint:<18} files={files:<6} c={concurrency:<4} "
+                            f"p50={row['p50_ms']:>8.2f}ms p95={row['p95_ms']:>8.2f}ms p99={row['p99_ms']:>8.2f}ms "
+                            f"rps={row['throughput_rps']:>8.2f} rss={row['rss_mb']:>7.1f}MB alloc={allocations}KiB",
+                            flush=True
+                        )
+    return results
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--folder-sizes", type=int, nargs="+", default=[0, 100, 1000], help="Files in current_folder")
+    parser.add_argument("--file-bytes", type=int, default=2000, help="Size of each current_folder file")
+    parser.add_argument("--allocation-samples", type=int, default=5, help="Sequential requests traced for allocations (0 to skip)")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
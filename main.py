@@ -1,12 +1,28 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel
-from typing import Dict, List
-from agents.ba_agent import business_analyst
-from agents.system_architect import system_architect
-from agents.developer import developer
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from agents.engine import run_agent, run_agent_stream, get_agent_spec, resolve_model, cached_agent_response, UnknownAgentError
+from agents.pipeline import run_pipeline, run_pipeline_stream, UnknownPipelineError, STAGES
+from agents.developer import developer, developer_stream, discard_thread, DEFAULT_MODEL
+from agents.offline import run_offline_batch
+from services.streaming import sse_response_body, SSE_HEADERS
+from services.snapshots import get_snapshot_store, SnapshotNotFoundError
+from services.jobs import get_job_manager
+from services.admission import get_admission_controller, admission_scope, AdmissionRejected, AdmissionMiddleware
+from services.metrics import TracingMiddleware, begin_agent, finish_agent
+from services.batch import run_batch, batch_concurrency, ndjson_body
+from services.routing import get_model_router
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from services.llm_clients import close_chat_models
+from services.checkpoints import close_checkpointer
+from services.sandbox import start_sandbox
+from services.dep_cache import get_dependency_cache
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
+import uuid
 
 load_dotenv()
 
@@ -25,7 +41,35 @@ async def verify_api_key(authorization: str = Depends(api_key_header)):
         )
     return authorization
 
-app = FastAPI()
+def cache_bypass(request: Request) -> bool:
+    """True when the client asked to skip the response cache via `X-Cache-Bypass` or `Cache-Control: no-cache`."""
+    bypass = request.headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes")
+    cache_control = request.headers.get("Cache-Control", "").lower()
+    return bypass or "no-cache" in cache_control or "no-store" in cache_control
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_manager = get_job_manager()
+    job_manager.register("developer", run_developer_job, on_cancel=discard_developer_job)
+    job_manager.register("agent-batch", run_offline_batch)
+    await job_manager.start()
+    await start_sandbox()
+    yield
+    await job_manager.stop()
+    await close_chat_models()
+    await close_checkpointer()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(AdmissionMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 class Message(BaseModel):
     type: str
@@ -37,29 +81,286 @@ class PromptRequest(BaseModel):
 
 class CovRequest(BaseModel):
     conversation: List[Message]
-    model: str
+    model: Optional[str] = None
+
+class DeveloperBudget(BaseModel):
+    max_iterations: Optional[int] = Field(None, ge=1)
+    max_seconds: Optional[float] = Field(None, gt=0)
+    max_tokens: Optional[int] = Field(None, ge=1)
 
 class DeveloperRequest(BaseModel):
     conversation: List[Message]
-    current_folder: Dict[str, str]
+    current_folder: Dict[str, str] = {}
     tdd_enabled: bool
     model: str
+    base_snapshot_id: Optional[str] = None
+    changed_files: Dict[str, str] = {}
+    deleted_files: List[str] = []
+    incremental: bool = False
+    samples: int = 1
+    sample_models: List[str] = []
+    thread_id: Optional[str] = None
+    budget: Optional[DeveloperBudget] = None
+
+def developer_budget(request: DeveloperRequest) -> Optional[Dict[str, Any]]:
+    return request.budget.model_dump(exclude_none=True) if request.budget else None
+
+def resolve_agent_model(agent_name: str, request: CovRequest) -> str:
+    """Return the model for a registered agent request, falling back to the agent's default."""
+    try:
+        spec = get_agent_spec(agent_name)
+    except UnknownAgentError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown agent '{agent_name}'")
+    return resolve_model(spec, request.model)
+
+def admit_model(agent_name: str, model: str, default_model: str) -> None:
+    """Admission check against the first model the request will call ("auto" resolves to its cascade)."""
+    get_admission_controller().admit(get_model_router().route(agent_name, model, default_model)[0])
+
+def resolve_current_folder(request: DeveloperRequest) -> Tuple[Dict[str, str], Optional[str]]:
+    """Return the project files for a developer request and, for incremental requests, their snapshot id."""
+    if not request.incremental and not request.base_snapshot_id:
+        return request.current_folder, None
+    try:
+        snapshot_id, files = get_snapshot_store().apply(
+            request.base_snapshot_id,
+            {**request.current_folder, **request.changed_files},
+            request.deleted_files
+        )
+    except SnapshotNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Unknown snapshot '{request.base_snapshot_id}'. Resend the full current_folder with incremental=true."
+        )
+    return files, snapshot_id
+
+def developer_sample_models(request: DeveloperRequest) -> List[str]:
+    """Models for a speculative developer run (one attempt each), or [] for a single run."""
+    models = request.sample_models or [request.model] * max(1, request.samples)
+    limit = int(os.getenv("DEV_MAX_SAMPLES", "4"))
+    if len(models) > limit:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {limit} parallel samples are allowed")
+    return models if len(models) > 1 else []
+
+def admit_developer(request: DeveloperRequest) -> List[str]:
+    sample_models = developer_sample_models(request)
+    for model in set(sample_models or [request.model]):
+        admit_model("developer", model, DEFAULT_MODEL)
+    return sample_models
+
+class PipelineRequest(BaseModel):
+    conversation: List[Message] = []
+    model: Optional[str] = None
+    models: Dict[str, str] = {}
+    current_folder: Dict[str, str] = {}
+    tdd_enabled: bool = False
+    pipeline_id: Optional[str] = None
+
+def pipeline_models(request: PipelineRequest) -> Dict[str, str]:
+    """Per-stage models: `models[stage]`, else `model`, else (for new pipelines) each agent's default."""
+    if not request.pipeline_id and not request.conversation:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="conversation is required to start a pipeline")
+    models = {stage: request.models.get(stage) or request.model for stage in STAGES}
+    return {stage: model for stage, model in models.items() if model}
+
+class BatchItem(BaseModel):
+    agent: str
+    request: Dict[str, Any]
+    id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
+
+async def run_batch_item(item: BatchItem, use_cache: bool) -> Dict[str, Any]:
+    """Run one batch item: a `DeveloperRequest` for "developer", otherwise a `CovRequest` for a registered agent.
+
+    Each item holds its own admission places in the batch pool, released when the item ends.
+    """
+    with admission_scope("batch"):
+        return await _run_batch_item(item, use_cache)
+
+async def _run_batch_item(item: BatchItem, use_cache: bool) -> Dict[str, Any]:
+    result = {"id": item.id, "agent": item.agent}
+    try:
+        if item.agent == "developer":
+            request = DeveloperRequest.model_validate(item.request)
+            begin_agent("developer", request.model)
+            sample_models = admit_developer(request)
+            current_folder, snapshot_id = resolve_current_folder(request)
+            response = await developer(request.conversation, current_folder, request.tdd_enabled, request.model, snapshot_id, sample_models, request.thread_id, developer_budget(request))
+        else:
+            request = CovRequest.model_validate(item.request)
+            model = resolve_agent_model(item.agent, request)
+            begin_agent(item.agent, model)
+            response = cached_agent_response(item.agent, request.conversation, model) if use_cache else None
+            if response is None:
+                admit_model(item.agent, model, get_agent_spec(item.agent).default_model)
+                response = await run_agent(item.agent, request.conversation, model, use_cache=use_cache)
+    except ValidationError as e:
+        return {**result, "status": "error", "status_code": 422, "error": e.errors(include_url=False)}
+    except HTTPException as e:
+        return {**result, "status": "error", "status_code": e.status_code, "error": e.detail}
+    except AdmissionRejected as e:
+        return {**result, "status": "error", "status_code": status.HTTP_429_TOO_MANY_REQUESTS, "error": e.reason, "retry_after": e.retry_after}
+    response = finish_agent(response)
+    return {**result, "status": "error" if response.get("error") else "ok", "response": response}
+
+class OfflineBatchItem(CovRequest):
+    id: Optional[str] = None
+
+class OfflineBatchRequest(BaseModel):
+    items: List[OfflineBatchItem]
+    webhook_url: Optional[str] = None
+
+class DeveloperJobRequest(DeveloperRequest):
+    webhook_url: Optional[str] = None
+
+async def run_developer_job(payload: Dict, progress) -> Dict:
+    """Job runner for background developer runs; forwards partial files and tokens to the job store."""
+    request = DeveloperRequest.model_validate(payload["request"])
+    begin_agent("developer", request.model)
+    snapshot_id = payload.get("snapshot_id")
+    if snapshot_id:
+        # The snapshot store is in-memory; re-register the folder in case the job outlived it.
+        snapshot_id = get_snapshot_store().put(payload["current_folder"])
+    events = developer_stream(
+        request.conversation, payload["current_folder"], request.tdd_enabled, request.model, snapshot_id,
+        developer_sample_models(request), request.thread_id, developer_budget(request)
+    )
+    async for event, data in events:
+        if event == "done":
+            return finish_agent(data)
+        if event == "error":
+            raise RuntimeError(data["response"])
+        progress(event, data)
+    raise RuntimeError("Developer run ended without a result.")
+
+async def discard_developer_job(payload: Dict) -> None:
+    """A cancelled job is not resumed, so its checkpoints are dropped."""
+    await discard_thread(payload["request"]["thread_id"])
 
 @app.get("/", dependencies=[Depends(verify_api_key)])
 def read_root():
     return {"Hello": "World Version 1.0.1"}
 
-@app.post("/agents/ba", dependencies=[Depends(verify_api_key)])
-async def run_ba_agent(request: CovRequest):
-    response = await business_analyst(request.conversation, request.model)
-    return response
+@app.get("/metrics", dependencies=[Depends(verify_api_key)])
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-@app.post("/agents/system-architect", dependencies=[Depends(verify_api_key)])
-async def run_system_architect_agent(request: CovRequest):
-    response = await system_architect(request.conversation, request.model)
-    return response
+@app.get("/routing/stats", dependencies=[Depends(verify_api_key)])
+def routing_stats():
+    return {"routes": get_model_router().stats()}
+
+@app.get("/dependency-cache/stats", dependencies=[Depends(verify_api_key)])
+def dependency_cache_stats():
+    return get_dependency_cache().stats()
 
 @app.post("/agents/developer", dependencies=[Depends(verify_api_key)])
 async def run_developer_agent(request: DeveloperRequest):
-    response = await developer(request.conversation, request.current_folder, request.tdd_enabled, request.model)
-    return response
\ No newline at end of file
+    begin_agent("developer", request.model)
+    sample_models = admit_developer(request)
+    current_folder, snapshot_id = resolve_current_folder(request)
+    response = await developer(request.conversation, current_folder, request.tdd_enabled, request.model, snapshot_id, sample_models, request.thread_id, developer_budget(request))
+    return finish_agent(response)
+
+@app.post("/agents/developer/stream", dependencies=[Depends(verify_api_key)])
+async def stream_developer_agent(request: DeveloperRequest):
+    begin_agent("developer", request.model)
+    sample_models = admit_developer(request)
+    current_folder, snapshot_id = resolve_current_folder(request)
+    events = developer_stream(request.conversation, current_folder, request.tdd_enabled, request.model, snapshot_id, sample_models, request.thread_id, developer_budget(request))
+    return StreamingResponse(sse_response_body(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/agents/developer/jobs", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(verify_api_key)])
+async def submit_developer_job(request: DeveloperJobRequest):
+    developer_sample_models(request)
+    current_folder, snapshot_id = resolve_current_folder(request)
+    # A fixed thread id lets a job interrupted by a restart resume from its last completed step.
+    request.thread_id = request.thread_id or uuid.uuid4().hex
+    payload = {
+        "request": request.model_dump(exclude={"webhook_url", "current_folder", "changed_files", "deleted_files"}),
+        "current_folder": current_folder,
+        "snapshot_id": snapshot_id
+    }
+    return get_job_manager().submit("developer", payload, request.webhook_url)
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def get_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def cancel_job(job_id: str):
+    job = await get_job_manager().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@app.post("/agents/batch", dependencies=[Depends(verify_api_key)])
+async def run_agent_batch(request: BatchRequest, bypass: bool = Depends(cache_bypass)):
+    """Run many agent requests with bounded concurrency and stream one NDJSON line per item as it completes."""
+    # Label the request trace; each item then runs under its own trace.
+    begin_agent("batch", "mixed")
+    results = run_batch(
+        request.items,
+        lambda index, item: run_batch_item(item, use_cache=not bypass),
+        batch_concurrency(request.concurrency)
+    )
+    return StreamingResponse(ndjson_body(results), media_type="application/x-ndjson")
+
+@app.post("/agents/{agent_name}/batch-jobs", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(verify_api_key)])
+async def submit_offline_batch(agent_name: str, request: OfflineBatchRequest):
+    """Queue a job that runs the agent over every item through the provider's (discounted) batch API."""
+    try:
+        spec = get_agent_spec(agent_name)
+    except UnknownAgentError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown agent '{agent_name}'")
+    if spec.tools:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Agent '{agent_name}' uses tools and cannot run in provider batch mode")
+    payload = {"agent": agent_name, "items": [item.model_dump() for item in request.items]}
+    return get_job_manager().submit("agent-batch", payload, request.webhook_url)
+
+@app.post("/agents/{agent_name}", dependencies=[Depends(verify_api_key)])
+async def run_registered_agent(agent_name: str, request: CovRequest, bypass: bool = Depends(cache_bypass)):
+    model = resolve_agent_model(agent_name, request)
+    begin_agent(agent_name, model)
+    response = None if bypass else cached_agent_response(agent_name, request.conversation, model)
+    if response is None:
+        admit_model(agent_name, model, get_agent_spec(agent_name).default_model)
+        response = await run_agent(agent_name, request.conversation, model, use_cache=not bypass)
+    return finish_agent(response)
+
+@app.post("/agents/{agent_name}/stream", dependencies=[Depends(verify_api_key)])
+async def stream_registered_agent(agent_name: str, request: CovRequest, bypass: bool = Depends(cache_bypass)):
+    model = resolve_agent_model(agent_name, request)
+    begin_agent(agent_name, model)
+    admit_model(agent_name, model, get_agent_spec(agent_name).default_model)
+    events = run_agent_stream(agent_name, request.conversation, model, use_cache=not bypass)
+    return StreamingResponse(sse_response_body(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/pipeline", dependencies=[Depends(verify_api_key)])
+async def run_pipeline_route(request: PipelineRequest):
+    models = pipeline_models(request)
+    begin_agent("pipeline", request.model or "default")
+    for stage, model in models.items():
+        admit_model(stage, model, DEFAULT_MODEL if stage == "developer" else get_agent_spec(stage).default_model)
+    try:
+        response = await run_pipeline(request.conversation, models, request.current_folder, request.tdd_enabled, request.pipeline_id)
+    except UnknownPipelineError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pipeline not found")
+    return finish_agent(response)
+
+@app.post("/pipeline/stream", dependencies=[Depends(verify_api_key)])
+async def stream_pipeline_route(request: PipelineRequest):
+    models = pipeline_models(request)
+    begin_agent("pipeline", request.model or "default")
+    for stage, model in models.items():
+        admit_model(stage, model, DEFAULT_MODEL if stage == "developer" else get_agent_spec(stage).default_model)
+    try:
+        events = await run_pipeline_stream(request.conversation, models, request.current_folder, request.tdd_enabled, request.pipeline_id)
+    except UnknownPipelineError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pipeline not found")
+    return StreamingResponse(sse_response_body(events), media_type="text/event-stream", headers=SSE_HEADERS)
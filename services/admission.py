@@ -0,0 +1,244 @@
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import asyncio
+import json
+import math
+import os
+import time
+import logging
+from langchain_core.messages import message_chunk_to_message
+from services.metrics import span, observe_ttft, model_label
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TPM_WINDOW_SECONDS = 60.0
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _ModelLimiter:
+    def __init__(self, concurrency: int, tpm_limit: int):
+        self.concurrency = concurrency
+        self.tpm_limit = tpm_limit
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Interactive and batch work queue separately, so a large batch cannot fill the interactive queue.
+        self.waiting = {"interactive": 0, "batch": 0}
+        self.reserved = {"interactive": 0, "batch": 0}
+        self.in_flight = 0
+        self.usage: Deque[Tuple[float, int]] = deque()
+        self.avg_call_seconds = 5.0
+
+    def tokens_in_window(self, now: float) -> int:
+        while self.usage and self.usage[0][0] <= now - TPM_WINDOW_SECONDS:
+            self.usage.popleft()
+        return sum(tokens for _, tokens in self.usage)
+
+    def queued(self, pool: str) -> int:
+        """Calls of `pool` waiting for a slot plus its admitted requests that have not reached their first one."""
+        return self.waiting[pool] + self.reserved[pool]
+
+class _Reservations:
+    """Queue places held by one unit of work (an HTTP request or a batch item), per limiter, until its first slot or its end."""
+
+    def __init__(self, pool: str):
+        self.pool = pool
+        self.held: List[_ModelLimiter] = []
+
+    def add(self, limiter: _ModelLimiter) -> None:
+        limiter.reserved[self.pool] += 1
+        self.held.append(limiter)
+
+    def take(self, limiter: _ModelLimiter) -> bool:
+        if limiter not in self.held:
+            return False
+        self.held.remove(limiter)
+        limiter.reserved[self.pool] -= 1
+        return True
+
+    def release(self) -> None:
+        for limiter in self.held:
+            limiter.reserved[self.pool] -= 1
+        self.held = []
+
+_reservations: ContextVar[Optional[_Reservations]] = ContextVar("admission_reservations", default=None)
+
+@contextmanager
+def admission_scope(pool: str = "interactive"):
+    """Hold the `admit()` reservations made inside the block and release what is left at its end.
+
+    `pool="batch"` queues the work against LLM_BATCH_MAX_WAITING instead of LLM_MAX_WAITING.
+    """
+    reservations = _Reservations(pool)
+    token = _reservations.set(reservations)
+    try:
+        yield
+    finally:
+        reservations.release()
+        _reservations.reset(token)
+
+def _pool() -> str:
+    reservations = _reservations.get()
+    return reservations.pool if reservations is not None else "interactive"
+
+class AdmissionController:
+    """Per-model and global concurrency limits, token-per-minute budgets and a bounded wait queue.
+
+    `admit()` is checked once per API request and fails fast. Inside an `admission_scope` (one per
+    HTTP request, and one per batch item) it also reserves a place in the model's wait queue,
+    held until the scope's first slot for that model or the end of the scope, so a burst of
+    admitted requests cannot overrun `max_waiting`. `slot()` gates every LLM call: it waits for a
+    free slot, or raises AdmissionRejected when it would have to queue behind `max_waiting`
+    others, and feeds observed token usage back into the per-model TPM window. Batch scopes
+    queue separately, against `max_batch_waiting`.
+    """
+
+    def __init__(self, global_concurrency: int, default_concurrency: int, default_tpm: int, max_waiting: int, model_limits: Dict[str, Dict[str, int]], max_batch_waiting: int = 16):
+        self.default_concurrency = default_concurrency
+        self.default_tpm = default_tpm
+        self.max_waiting = max_waiting
+        self.max_batch_waiting = max_batch_waiting
+        self.model_limits = model_limits
+        self._global = asyncio.Semaphore(global_concurrency)
+        self._models: Dict[str, _ModelLimiter] = {}
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        # Unknown model names share the "other" limiter, so clients cannot grow this dict without bound.
+        label = model_label(model)
+        limiter = self._models.get(label)
+        if limiter is None:
+            limits = self.model_limits.get(label, {})
+            limiter = _ModelLimiter(
+                int(limits.get("concurrency", self.default_concurrency)),
+                int(limits.get("tpm", self.default_tpm))
+            )
+            self._models[label] = limiter
+        return limiter
+
+    def _queue_full(self, limiter: _ModelLimiter, model: str, pool: str) -> Optional[AdmissionRejected]:
+        queued = limiter.queued(pool)
+        if queued < (self.max_batch_waiting if pool == "batch" else self.max_waiting):
+            return None
+        retry_after = limiter.avg_call_seconds * queued / max(limiter.concurrency, 1)
+        return AdmissionRejected(f"Too many queued requests for model '{model}'", max(1, math.ceil(retry_after)))
+
+    def admit(self, model: str) -> None:
+        limiter = self._limiter(model)
+        now = time.time()
+        rejected = self._queue_full(limiter, model, _pool())
+        if rejected:
+            raise rejected
+        if limiter.tpm_limit and limiter.tokens_in_window(now) >= limiter.tpm_limit:
+            retry_after = limiter.usage[0][0] + TPM_WINDOW_SECONDS - now
+            raise AdmissionRejected(f"Token-per-minute budget exhausted for model '{model}'", max(1, math.ceil(retry_after)))
+        reservations = _reservations.get()
+        if reservations is not None:
+            reservations.add(limiter)
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        limiter = self._limiter(model)
+        reservations = _reservations.get()
+        pool = _pool()
+        if not (reservations is not None and reservations.take(limiter)):
+            # Not this scope's first call (or not admitted): it may only queue within the bound.
+            busy = limiter.semaphore.locked() or self._global.locked()
+            rejected = self._queue_full(limiter, model, pool) if busy else None
+            if rejected:
+                raise rejected
+        limiter.waiting[pool] += 1
+        try:
+            await limiter.semaphore.acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                limiter.semaphore.release()
+                raise
+        finally:
+            limiter.waiting[pool] -= 1
+        limiter.in_flight += 1
+        started = time.time()
+        try:
+            yield
+        finally:
+            limiter.in_flight -= 1
+            limiter.avg_call_seconds = 0.8 * limiter.avg_call_seconds + 0.2 * (time.time() - started)
+            self._global.release()
+            limiter.semaphore.release()
+
+    def record_usage(self, model: str, total_tokens: int) -> None:
+        if total_tokens:
+            self._limiter(model).usage.append((time.time(), total_tokens))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            model: {
+                "concurrency": limiter.concurrency,
+                "in_flight": limiter.in_flight,
+                "waiting": dict(limiter.waiting),
+                "reserved": dict(limiter.reserved),
+                "tokens_last_minute": limiter.tokens_in_window(now),
+                "tpm_limit": limiter.tpm_limit
+            }
+            for model, limiter in self._models.items()
+        }
+
+class AdmissionMiddleware:
+    """ASGI middleware that scopes `admit()` queue reservations to an HTTP request and releases them when it ends."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with admission_scope():
+            await self.app(scope, receive, send)
+
+_controller: AdmissionController | None = None
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            global_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            default_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "8")),
+            default_tpm=int(os.getenv("LLM_TPM_LIMIT", "0")),
+            max_waiting=int(os.getenv("LLM_MAX_WAITING", "64")),
+            model_limits=json.loads(os.getenv("LLM_MODEL_LIMITS", "{}")),
+            max_batch_waiting=int(os.getenv("LLM_BATCH_MAX_WAITING", "16"))
+        )
+    return _controller
+
+async def admitted_ainvoke(model: str, llm: Any, messages: List[Any], iteration: int = 1) -> Any:
+    """Invoke `llm` inside an admission slot for `model` and record the tokens it used.
+
+    The call is streamed and the chunks merged back into one message, so time-to-first-token
+    can be measured alongside the total LLM latency.
+    """
+    controller = get_admission_controller()
+    async with controller.slot(model):
+        with span("llm", iteration):
+            started = time.perf_counter()
+            response = None
+            async for chunk in llm.astream(messages):
+                if response is None:
+                    observe_ttft(time.perf_counter() - started, iteration)
+                    response = chunk
+                else:
+                    response = response + chunk
+    if response is None:
+        raise ValueError("LLM returned an empty stream")
+    response = message_chunk_to_message(response)
+    usage_metadata = getattr(response, "usage_metadata", {}) or {}
+    controller.record_usage(model, usage_metadata.get("total_tokens", 0) or 0)
+    return response
@@ -0,0 +1,57 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+import asyncio
+import json
+import os
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def batch_concurrency(requested: int | None = None) -> int:
+    """Concurrency for a batch: the requested value, capped by BATCH_MAX_CONCURRENCY."""
+    limit = max(1, int(os.getenv("BATCH_MAX_CONCURRENCY", "4")))
+    return min(limit, requested) if requested and requested > 0 else limit
+
+async def run_batch(items: List[Any], run_item: Callable[[int, Any], Awaitable[Dict[str, Any]]], concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+    """Run `run_item(index, item)` for every item with at most `concurrency` in flight.
+
+    Yields each item's result as soon as it finishes (completion order), then a summary. An
+    exception in one item becomes an error result for that item only. Items still running when
+    the consumer stops (e.g. the client disconnected) are cancelled.
+    """
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, item: Any) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return {"index": index, **await run_item(index, item)}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {str(e)}")
+                return {"index": index, "status": "error", "error": str(e)}
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            succeeded += result.get("status") == "ok"
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "done": True,
+        "count": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "time_taken_seconds": round(time.time() - start_time, 3)
+    }
+
+async def ndjson_body(results: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for result in results:
+        yield json.dumps(result, default=str) + "\n"
@@ -0,0 +1,117 @@
+from typing import Any
+from langgraph.checkpoint.memory import InMemorySaver
+import asyncio
+import os
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_checkpointer: Any = None
+_connection: Any = None
+_loop: asyncio.AbstractEventLoop | None = None
+_lock: asyncio.Lock | None = None
+
+def _pruning_sqlite_saver(connection, ttl_seconds: float):
+    """An AsyncSqliteSaver that keeps only the latest checkpoint of each thread and drops idle threads.
+
+    Resuming a run only needs its latest checkpoint and that checkpoint's pending writes, so older
+    ones are deleted as each new one is saved. Threads not written for `ttl_seconds` (runs that
+    failed and were never retried) are swept at most every `ttl_seconds / 24`; 0 disables the sweep.
+    """
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    class PruningSqliteSaver(AsyncSqliteSaver):
+        last_sweep = 0.0
+
+        async def setup(self) -> None:
+            if self.is_setup:
+                return
+            await super().setup()
+            async with self.lock:
+                await self.conn.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+                await self.conn.commit()
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            saved = await super().aput(config, checkpoint, metadata, new_versions)
+            thread_id = str(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            async with self.lock:
+                # Checkpoint ids are time-ordered, so everything before the new id is superseded.
+                for table in ("checkpoints", "writes"):
+                    await self.conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                        (thread_id, checkpoint_ns, checkpoint["id"])
+                    )
+                await self.conn.execute(
+                    "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)", (thread_id, time.time())
+                )
+                await self.conn.commit()
+            if time.time() - self.last_sweep > ttl_seconds / 24:
+                await self.sweep()
+            return saved
+
+        async def adelete_thread(self, thread_id: str) -> None:
+            await super().adelete_thread(thread_id)
+            async with self.lock:
+                await self.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+                await self.conn.commit()
+
+        async def sweep(self) -> int:
+            if ttl_seconds <= 0:
+                return 0
+            self.last_sweep = time.time()
+            async with self.lock:
+                async with self.conn.execute(
+                    "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (self.last_sweep - ttl_seconds,)
+                ) as cursor:
+                    expired = [row[0] for row in await cursor.fetchall()]
+            for thread_id in expired:
+                await self.adelete_thread(thread_id)
+            if expired:
+                logger.info(f"Dropped checkpoints of {len(expired)} developer threads idle for over {ttl_seconds:.0f}s")
+            return len(expired)
+
+    return PruningSqliteSaver(connection)
+
+async def get_checkpointer():
+    """Process-wide LangGraph checkpointer backed by SQLite (DEV_CHECKPOINT_DB).
+
+    Only the latest checkpoint of a thread is kept, and threads idle for DEV_CHECKPOINT_TTL_SECONDS
+    are dropped. Falls back to an in-memory saver when `langgraph-checkpoint-sqlite` is not installed, in
+    which case checkpoints do not survive a restart.
+    """
+    global _checkpointer, _connection, _loop, _lock
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # The SQLite connection and the lock are bound to the loop that created them.
+        _checkpointer, _connection, _loop, _lock = None, None, loop, asyncio.Lock()
+    if _checkpointer is not None:
+        return _checkpointer
+    async with _lock:
+        if _checkpointer is None:
+            path = os.getenv("DEV_CHECKPOINT_DB", "checkpoints.sqlite3")
+            try:
+                import aiosqlite
+                import langgraph.checkpoint.sqlite.aio
+            except ImportError:
+                logger.warning("langgraph-checkpoint-sqlite is not installed; developer checkpoints are kept in memory")
+                _checkpointer = InMemorySaver()
+                return _checkpointer
+            _connection = await aiosqlite.connect(path)
+            saver = _pruning_sqlite_saver(_connection, float(os.getenv("DEV_CHECKPOINT_TTL_SECONDS", "86400")))
+            await saver.setup()
+            await saver.sweep()
+            _checkpointer = saver
+            logger.info(f"Developer checkpoints stored in {path}")
+    return _checkpointer
+
+async def close_checkpointer() -> None:
+    global _checkpointer, _connection, _loop
+    connection = _connection
+    _checkpointer = None
+    _connection = None
+    _loop = None
+    if connection is not None:
+        await connection.close()
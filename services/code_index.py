@@ -0,0 +1,269 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+from services.context import count_tokens
+import hashlib
+import json
+import posixpath
+import os
+import re
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = (".ts", ".tsx", ".js", ".jsx", ".mjs", ".cjs")
+
+_IMPORT = re.compile(r"""(?:import\s+(?:[\w*{}\s,]+\s+from\s+)?|export\s+[\w*{}\s,]+\s+from\s+|require\s*\(\s*|import\s*\(\s*)['"]([^'"]+)['"]""")
+_EXPORT_DECL = re.compile(r"^\s*export\s+(?:default\s+)?(?:declare\s+)?(?:async\s+)?(?:abstract\s+)?(?:function\*?|class|const|let|var|interface|type|enum)\s+([A-Za-z_$][\w$]*)", re.M)
+_EXPORT_LIST = re.compile(r"^\s*export\s*\{([^}]*)\}", re.M)
+_DECL = re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\*?|class|interface|type|enum)\s+([A-Za-z_$][\w$]*)|^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=", re.M)
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9]+")
+_CAMEL = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "into", "add", "make", "use", "please",
+    "should", "would", "can", "file", "files", "code", "new", "update", "create", "fix", "all"
+}
+
+@dataclass(frozen=True)
+class FileSymbols:
+    imports: Tuple[str, ...]
+    exports: Tuple[str, ...]
+    symbols: Tuple[str, ...]
+
+def _terms(text: str) -> Set[str]:
+    """Lower-cased search terms, with camelCase and snake_case identifiers split into their parts."""
+    terms = set()
+    for word in _WORD.findall(text):
+        terms.add(word.lower())
+        for part in _CAMEL.findall(word):
+            terms.add(part.lower())
+    return {term for term in terms if len(term) >= 3 and term not in _STOPWORDS}
+
+def parse_source(content: str) -> FileSymbols:
+    imports = tuple(dict.fromkeys(_IMPORT.findall(content)))
+    exports = list(_EXPORT_DECL.findall(content))
+    for names in _EXPORT_LIST.findall(content):
+        for name in names.split(","):
+            name = name.strip().split(" as ")[-1].strip()
+            if name:
+                exports.append(name)
+    symbols = [a or b for a, b in _DECL.findall(content)]
+    return FileSymbols(imports, tuple(dict.fromkeys(exports)), tuple(dict.fromkeys(symbols)))
+
+_parsed: "OrderedDict[str, FileSymbols]" = OrderedDict()
+_parsed_lock = threading.Lock()
+_PARSED_MAX = int(os.getenv("CODE_INDEX_CACHE_SIZE", "20000"))
+
+def _parse_cached(content_hash: str, content: str) -> FileSymbols:
+    with _parsed_lock:
+        parsed = _parsed.get(content_hash)
+        if parsed is not None:
+            _parsed.move_to_end(content_hash)
+            return parsed
+    parsed = parse_source(content)
+    with _parsed_lock:
+        _parsed[content_hash] = parsed
+        while len(_parsed) > _PARSED_MAX:
+            _parsed.popitem(last=False)
+    return parsed
+
+_EMPTY = FileSymbols((), (), ())
+
+_SIGNATURE = re.compile(
+    r"^\s*(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:async\s+)?(?:abstract\s+)?"
+    r"(?:function\*?|class|interface|type|enum|namespace|module)\s+[A-Za-z_$][\w$]*"
+    r"|^\s*(?:export\s+)?(?:const|let|var)\s+[A-Za-z_$][\w$]*\s*(?::[^=]+)?=\s*(?:async\s+)?(?:\([^)]*\)|[A-Za-z_$][\w$]*)\s*(?::[^=]+)?=>"
+    r"|^\s*export\s+(?:default\s+|\{|\*|const|let|var)"
+    r"|^\s+(?:(?:public|private|protected|static|readonly|async|get|set|abstract|override)\s+)*(?!if\b|for\b|while\b|switch\b|catch\b|return\b)[A-Za-z_$#][\w$]*\s*(?:<[^>]*>)?\s*\([^)]*\)?\s*(?::\s*[^{;]+)?\s*\{?\s*$"
+)
+_HEADING = re.compile(r"^#{1,6}\s")
+_OUTLINE_MAX_LINES = 400
+
+def _source_outline(content: str) -> List[str]:
+    lines = content.split("\n")
+    symbols = _parse_cached(hashlib.sha256(content.encode("utf-8")).hexdigest(), content)
+    outline = [f"imports: {', '.join(symbols.imports)}"] if symbols.imports else []
+    for number, line in enumerate(lines, 1):
+        if _SIGNATURE.match(line) and not line.lstrip().startswith(("import ", "//", "*", "/*")):
+            outline.append(f"{number}: {line.rstrip().rstrip('{').rstrip()[:200]}")
+    return outline
+
+def _json_outline(content: str) -> List[str]:
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return ["(invalid JSON)"]
+    if not isinstance(data, dict):
+        return [f"{type(data).__name__} with {len(data) if hasattr(data, '__len__') else 1} items"]
+    outline = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            names = list(value)
+            shown = ", ".join(names[:20]) + (f", ... ({len(names)} keys)" if len(names) > 20 else "")
+            outline.append(f"{key}: {{{shown}}}")
+        elif isinstance(value, list):
+            outline.append(f"{key}: [{len(value)} items]")
+        else:
+            outline.append(f"{key}: {json.dumps(value)[:200]}")
+    return outline
+
+def _build_outline(path: str, content: str) -> str:
+    if path.endswith(SOURCE_EXTENSIONS):
+        outline = _source_outline(content)
+    elif path.endswith(".json"):
+        outline = _json_outline(content)
+    elif path.endswith((".md", ".markdown")):
+        outline = [f"{number}: {line.strip()}" for number, line in enumerate(content.split("\n"), 1) if _HEADING.match(line)]
+    else:
+        outline = [f"{number}: {line[:200]}" for number, line in enumerate(content.split("\n")[:20], 1)]
+    if len(outline) > _OUTLINE_MAX_LINES:
+        outline = outline[:_OUTLINE_MAX_LINES] + [f"[... {len(outline) - _OUTLINE_MAX_LINES} more outline lines ...]"]
+    return "\n".join(outline)
+
+_outlines: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_OUTLINES_MAX = int(os.getenv("CODE_OUTLINE_CACHE_SIZE", "4096"))
+
+def outline(path: str, content: str) -> str:
+    """Imports, declarations and signatures with line numbers (JSON: top-level keys, Markdown: headings).
+
+    Cached per content hash and file type, so re-reading an unchanged file in a tool loop is a hash.
+    """
+    key = (hashlib.sha256(content.encode("utf-8")).hexdigest(), os.path.splitext(path)[1])
+    with _parsed_lock:
+        cached = _outlines.get(key)
+        if cached is not None:
+            _outlines.move_to_end(key)
+            return cached
+    result = _build_outline(path, content)
+    with _parsed_lock:
+        _outlines[key] = result
+        while len(_outlines) > _OUTLINES_MAX:
+            _outlines.popitem(last=False)
+    return result
+
+class CodeIndex:
+    """Symbols, imports and exports of a project's TS/JS files.
+
+    `update` only re-parses files whose content hash changed; parsed results are also shared
+    across indexes by content hash, so re-indexing an unchanged project is a hashing pass.
+    `sync` brings the index in line with a project's files, skipping files it already holds.
+    """
+
+    def __init__(self):
+        self._hashes: Dict[str, str] = {}
+        self._files: Dict[str, FileSymbols] = {}
+        self._contents: Dict[str, str] = {}
+
+    def update(self, files: Dict[str, str]) -> None:
+        for path, content in files.items():
+            content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            self._contents[path] = content
+            if self._hashes.get(path) == content_hash:
+                continue
+            self._hashes[path] = content_hash
+            self._files[path] = _parse_cached(content_hash, content) if path.endswith(SOURCE_EXTENSIONS) else _EMPTY
+
+    def remove(self, paths: List[str]) -> None:
+        for path in paths:
+            self._hashes.pop(path, None)
+            self._files.pop(path, None)
+            self._contents.pop(path, None)
+
+    def sync(self, files: Dict[str, str]) -> None:
+        # The same string objects when the files were written through `update`: no hashing needed.
+        self.update({path: content for path, content in files.items() if self._contents.get(path) is not content})
+        self.remove([path for path in self._contents if path not in files])
+
+    def _resolve(self, importer: str, specifier: str) -> Optional[str]:
+        if not specifier.startswith("."):
+            return None
+        base = posixpath.normpath(posixpath.join(posixpath.dirname(importer), specifier))
+        candidates = [base] + [base + ext for ext in SOURCE_EXTENSIONS] + [f"{base}/index{ext}" for ext in SOURCE_EXTENSIONS]
+        return next((candidate for candidate in candidates if candidate in self._files), None)
+
+    def dependencies(self, path: str) -> List[str]:
+        resolved = (self._resolve(path, specifier) for specifier in self._files.get(path, _EMPTY).imports)
+        return [dependency for dependency in resolved if dependency]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Rank files by how well their path, exports, symbols and content match the query terms."""
+        terms = _terms(query)
+        if not terms:
+            return []
+        scores: Dict[str, float] = {}
+        for path, symbols in self._files.items():
+            path_terms = _terms(path)
+            export_terms = _terms(" ".join(symbols.exports))
+            symbol_terms = _terms(" ".join(symbols.symbols))
+            content = self._contents[path].lower()
+            score = 0.0
+            for term in terms:
+                score += 3 * (term in path_terms) + 4 * (term in export_terms) + 2 * (term in symbol_terms)
+                score += min(content.count(term), 5) * 0.2
+            if score:
+                scores[path] = score
+        # Files imported by a strong match are likely needed to change it.
+        for path, score in sorted(scores.items(), key=lambda item: -item[1])[:limit]:
+            for dependency in self.dependencies(path):
+                scores[dependency] = scores.get(dependency, 0.0) + score * 0.25
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [
+            {
+                "path": path,
+                "score": round(score, 2),
+                "exports": list(self._files[path].exports),
+                "imports": list(self._files[path].imports),
+                "matches": self._matching_lines(path, terms)
+            }
+            for path, score in ranked
+        ]
+
+    def _matching_lines(self, path: str, terms: Set[str], limit: int = 3) -> List[str]:
+        matches = []
+        for number, line in enumerate(self._contents[path].splitlines(), 1):
+            lowered = line.lower()
+            if any(term in lowered for term in terms):
+                matches.append(f"{number}: {line.strip()[:200]}")
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def select(self, query: str, model: str, budget: int) -> Dict[str, str]:
+        """Contents of the files most relevant to `query` that fit in `budget` tokens."""
+        selected: Dict[str, str] = {}
+        remaining = budget
+        for match in self.search(query, limit=int(os.getenv("CODE_CONTEXT_MAX_FILES", "12"))):
+            content = self._contents[match["path"]]
+            tokens = count_tokens(content, model)
+            if tokens > remaining:
+                continue
+            selected[match["path"]] = content
+            remaining -= tokens
+        return selected
+
+_indexes: "OrderedDict[str, CodeIndex]" = OrderedDict()
+_INDEXES_MAX = int(os.getenv("CODE_INDEX_MAX_PROJECTS", "256"))
+
+def project_index(key: str, files: Dict[str, str]) -> CodeIndex:
+    """The index kept for `key` (e.g. a developer thread), synced with `files`.
+
+    Callers keep it current with `update` after writing files, so the next sync is a pass of
+    identity checks. The least recently used indexes beyond CODE_INDEX_MAX_PROJECTS are dropped.
+    """
+    with _parsed_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CodeIndex()
+        _indexes.move_to_end(key)
+        while len(_indexes) > _INDEXES_MAX:
+            _indexes.popitem(last=False)
+    index.sync(files)
+    return index
+
+def drop_project_index(key: str) -> None:
+    with _parsed_lock:
+        _indexes.pop(key, None)
@@ -0,0 +1,162 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from langchain_core.messages import SystemMessage, HumanMessage
+from services.llm_clients import get_chat_model
+from services.admission import get_admission_controller
+from services.metrics import span
+import hashlib
+import os
+import re
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DIFF_MARKER = re.compile(r"^\s*\[[+\-]\]")
+_HEADING = re.compile(r"^\s*#{1,6}\s")
+
+SUMMARY_PROMPT = '''Summarize the following conversation turn so it can replace the original in a long-running session.
+Keep every decision, requirement, API name and constraint. Copy every line that starts with `[+]` or `[-]`
+verbatim, since those mark recently added and removed content. Reply with the summary only.'''
+
+_encoders: Dict[str, Any] = {}
+_encoder_lock = threading.Lock()
+
+def _encoder(model: str):
+    """tiktoken encoder for a model, or None when tiktoken or its encoding files are unavailable."""
+    with _encoder_lock:
+        if model in _encoders:
+            return _encoders[model]
+        encoder = None
+        try:
+            import tiktoken
+            try:
+                encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(f"Local tokenizer unavailable for {model}, estimating tokens from length: {str(e)}")
+        _encoders[model] = encoder
+        return encoder
+
+def count_tokens(text: str, model: str) -> int:
+    encoder = _encoder(model)
+    if encoder is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoder.encode(text, disallowed_special=()))
+
+class _SummaryCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+_summaries = _SummaryCache(int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "2048")))
+
+def _marker_lines(content: str) -> List[str]:
+    return [line for line in content.splitlines() if _DIFF_MARKER.match(line)]
+
+def elide(content: str) -> str:
+    """Deterministic compaction: keep the first line, headings and `[+]`/`[-]` lines, drop the rest."""
+    lines = content.splitlines()
+    kept = []
+    elided = 0
+    for index, line in enumerate(lines):
+        if index == 0 or _DIFF_MARKER.match(line) or _HEADING.match(line):
+            if elided:
+                kept.append(f"[... {elided} lines elided ...]")
+                elided = 0
+            kept.append(line)
+        else:
+            elided += 1
+    if elided:
+        kept.append(f"[... {elided} lines elided ...]")
+    return "\n".join(kept)
+
+async def _summarize(role: str, content: str, summary_model: str) -> str:
+    llm = get_chat_model(summary_model)
+    messages = [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=f"Role: {role}\n\n{content}")]
+    async with get_admission_controller().slot(summary_model):
+        # Empty callbacks keep the summary out of the caller's token stream.
+        response = await llm.ainvoke(messages, config={"callbacks": []})
+    summary = response.content if isinstance(response.content, str) else str(response.content)
+    missing = [line for line in _marker_lines(content) if line not in summary]
+    if missing:
+        summary = summary.rstrip() + "\n" + "\n".join(missing)
+    return summary
+
+async def _compact_message(role: str, content: str, summary_model: Optional[str]) -> str:
+    key = hashlib.sha256(f"{summary_model or 'elide'}\0{role}\0{content}".encode("utf-8")).hexdigest()
+    cached = _summaries.get(key)
+    if cached is not None:
+        return cached
+    compacted = None
+    if summary_model:
+        try:
+            compacted = await _summarize(role, content, summary_model)
+        except Exception as e:
+            logger.warning(f"Summarizing older turn failed, eliding instead: {str(e)}")
+    if compacted is None:
+        compacted = elide(content)
+    _summaries.set(key, compacted)
+    return compacted
+
+async def compact_conversation(conversation: List[Any], model: str, budget: Optional[int] = None) -> Tuple[List[Any], Optional[str]]:
+    """Fit a conversation into a token budget (CONTEXT_TOKEN_BUDGET; 0 disables compaction).
+
+    The most recent turns are kept verbatim. Older turns are replaced, one message at a time, by a
+    cached summary (CONTEXT_SUMMARY_MODEL) or an elided copy that keeps `[+]`/`[-]` lines. If that is
+    still over budget, the oldest compacted turns are dropped. Returns the new conversation and the
+    text of the compacted turns (None when nothing was compacted).
+    """
+    if budget is None:
+        budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "60000"))
+    if budget <= 0 or not conversation:
+        return conversation, None
+
+    with span("context_compaction"):
+        token_counts = [count_tokens(getattr(msg, "content", "") or "", model) for msg in conversation]
+        total = sum(token_counts)
+        if total <= budget:
+            return conversation, None
+
+        recent_budget = int(budget * float(os.getenv("CONTEXT_RECENT_FRACTION", "0.6")))
+        split = len(conversation) - 1
+        used = token_counts[-1]
+        while split > 0 and used + token_counts[split - 1] <= recent_budget:
+            split -= 1
+            used += token_counts[split]
+
+        summary_model = os.getenv("CONTEXT_SUMMARY_MODEL") or None
+        compacted = []
+        for msg in conversation[:split]:
+            if getattr(msg, "type", None) != "text":
+                continue
+            content = await _compact_message(msg.role, msg.content, summary_model)
+            compacted.append((msg.model_copy(update={"content": content}), count_tokens(content, model)))
+
+        while compacted and used + sum(tokens for _, tokens in compacted) > budget:
+            compacted.pop(0)
+
+        summary = "\n\n".join(f"{msg.role}: {msg.content}" for msg, _ in compacted) or None
+        result = [msg for msg, _ in compacted] + list(conversation[split:])
+        logger.info(
+            f"Compacted conversation from {total} to ~{used + sum(tokens for _, tokens in compacted)} tokens "
+            f"({split} older turns, {len(compacted)} kept as summaries)"
+        )
+        return result, summary
@@ -0,0 +1,233 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from services.metrics import DEPENDENCY_CACHE_LOOKUPS
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DEPENDENCY_FIELDS = ("dependencies", "devDependencies", "optionalDependencies", "peerDependencies")
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+CommandRunner = Callable[[List[str], str, Dict[str, str]], Awaitable[Dict[str, Any]]]
+
+class DependencyInstallError(Exception):
+    """`npm install` failed for a dependency set; `output` is the tail of its log."""
+
+    def __init__(self, output: str):
+        super().__init__("npm install failed")
+        self.output = output
+
+def normalize_package_json(package_json: str) -> Dict[str, Any]:
+    """The parts of a package.json that decide its installed tree: non-empty dependency fields, sorted, ranges without whitespace.
+
+    Name, version, scripts and formatting are dropped, so generated packages that only differ
+    in those share one cache entry.
+    """
+    package = json.loads(package_json)
+    if not isinstance(package, dict):
+        raise ValueError("package.json must be a JSON object")
+    normalized = {}
+    for field in _DEPENDENCY_FIELDS:
+        dependencies = package.get(field) or {}
+        if not isinstance(dependencies, dict):
+            raise ValueError(f"package.json {field} must be an object")
+        if dependencies:
+            normalized[field] = {name: re.sub(r"\s+", "", str(spec)) for name, spec in sorted(dependencies.items())}
+    return normalized
+
+def dependency_key(package_json: str, lockfile: Optional[str] = None) -> str:
+    """Cache key of a dependency set: the normalized package.json, plus the lockfile's resolved packages when there is one."""
+    material: Dict[str, Any] = {"package": normalize_package_json(package_json)}
+    if lockfile:
+        try:
+            lock = json.loads(lockfile)
+            # The root entry repeats the project's name and version; only the resolved tree matters.
+            material["lock"] = {path: entry for path, entry in (lock.get("packages") or {}).items() if path} or lock.get("dependencies")
+        except (ValueError, AttributeError):
+            material["lock"] = hashlib.sha256(lockfile.encode("utf-8")).hexdigest()
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+def _absolutize_external_links(source: str, destination: str) -> None:
+    """Repoint relative symlinks that leave the copied tree (e.g. `file:` dependencies) at their absolute targets.
+
+    Links inside the tree, like `.bin` entries, stay relative so they resolve within the copy.
+    """
+    source_root = os.path.realpath(source)
+    for directory, dirnames, filenames in os.walk(destination):
+        for name in dirnames + filenames:
+            path = os.path.join(directory, name)
+            if not os.path.islink(path):
+                continue
+            target = os.readlink(path)
+            if os.path.isabs(target):
+                continue
+            original = os.path.normpath(os.path.join(source, os.path.relpath(directory, destination), target))
+            if os.path.commonpath([source_root, os.path.realpath(original)]) != source_root:
+                os.unlink(path)
+                os.symlink(original, path)
+
+class _Stats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.install_failures = 0
+        self.install_seconds = 0.0
+        self.materializations = 0
+        self.materialize_seconds = 0.0
+
+class DependencyCache:
+    """Content-addressed cache of installed `node_modules` trees, one per `dependency_key`.
+
+    A miss installs the normalized package.json once, with npm's package cache in a local
+    mirror directory (DEP_CACHE_MIRROR_DIR), so later installs of overlapping sets skip the
+    network; DEP_CACHE_REGISTRY can point npm at a local registry mirror. Trees are
+    materialized into a project with reflinks (default; copies where the filesystem has no
+    copy-on-write), plain copies or hardlinks, and the least recently used entries beyond
+    DEP_CACHE_MAX_ENTRIES are evicted. Hardlinks share inodes with the cached tree, so code that
+    can write the project's `node_modules` could rewrite the cache for every later project.
+    """
+
+    def __init__(self, root: str, mirror_dir: str, max_entries: int, link_mode: str, registry: Optional[str] = None, offline: bool = False):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Unknown DEP_CACHE_LINK_MODE '{link_mode}'")
+        self.root = root
+        self.mirror_dir = mirror_dir
+        self.max_entries = max_entries
+        self.link_mode = link_mode
+        self.registry = registry
+        self.offline = offline
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        self._install_locks: Dict[str, asyncio.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = _Stats()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def npm_env(self) -> Dict[str, str]:
+        env = {"npm_config_cache": self.mirror_dir}
+        if self.registry:
+            env["npm_config_registry"] = self.registry
+        return env
+
+    def _touch(self, key: str) -> None:
+        os.utime(self._entry(key))
+
+    def _evict(self) -> None:
+        entries = [
+            (os.path.getmtime(path), path) for path in
+            (os.path.join(self.root, name) for name in os.listdir(self.root))
+            if os.path.isdir(os.path.join(path, "node_modules"))
+        ]
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            logger.info(f"Evicting cached dependencies {os.path.basename(path)}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._stats.hits += 1
+            else:
+                self._stats.misses += 1
+        DEPENDENCY_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+    async def ensure(self, package_json: str, lockfile: Optional[str], run: CommandRunner) -> Dict[str, Any]:
+        """Make sure the dependency set is installed in the cache; concurrent misses for one key install once.
+
+        `run(argv, cwd, env)` executes the install (the caller applies its own limits). Returns
+        the key, whether it was a hit and the install time. Raises DependencyInstallError.
+        """
+        key = dependency_key(package_json, lockfile)
+        lock = self._install_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if os.path.isdir(os.path.join(self._entry(key), "node_modules")):
+                self._record(True)
+                await asyncio.to_thread(self._touch, key)
+                return {"key": key, "cached": True, "seconds": 0.0}
+            self._record(False)
+            staging = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root)
+            with open(os.path.join(staging, "package.json"), "w", encoding="utf-8") as f:
+                json.dump({"name": "dependency-cache", "version": "0.0.0", "private": True, **normalize_package_json(package_json)}, f, indent=2)
+            if lockfile:
+                with open(os.path.join(staging, "package-lock.json"), "w", encoding="utf-8") as f:
+                    f.write(lockfile)
+            argv = ["npm", "install", "--ignore-scripts", "--no-audit", "--no-fund", "--prefer-offline"]
+            if self.offline:
+                argv.append("--offline")
+            logger.info(f"Installing dependencies {key}")
+            result = await run(argv, staging, self.npm_env())
+            if result["exit_code"] != 0 or result["timed_out"]:
+                shutil.rmtree(staging, ignore_errors=True)
+                with self._lock:
+                    self._stats.install_failures += 1
+                raise DependencyInstallError(result["output"])
+            os.makedirs(os.path.join(staging, "node_modules"), exist_ok=True)
+            os.replace(staging, self._entry(key))
+            with self._lock:
+                self._stats.install_seconds += result["seconds"]
+            await asyncio.to_thread(self._evict)
+            return {"key": key, "cached": False, "seconds": result["seconds"]}
+
+    def materialize(self, key: str, destination: str) -> None:
+        """Create `destination` as a copy of the cached tree, sharing file data where the link mode allows."""
+        started = time.perf_counter()
+        source = os.path.join(self._entry(key), "node_modules")
+        if self.link_mode == "reflink":
+            subprocess.run(["cp", "-a", "--reflink=auto", source, destination], check=True)
+        elif self.link_mode == "hardlink":
+            try:
+                shutil.copytree(source, destination, symlinks=True, copy_function=os.link)
+            except shutil.Error:
+                # Cross-device or unsupported: fall back to copying.
+                shutil.rmtree(destination, ignore_errors=True)
+                shutil.copytree(source, destination, symlinks=True)
+        else:
+            shutil.copytree(source, destination, symlinks=True)
+        _absolutize_external_links(source, destination)
+        with self._lock:
+            self._stats.materializations += 1
+            self._stats.materialize_seconds += time.perf_counter() - started
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self._stats
+            lookups = stats.hits + stats.misses
+            report = {
+                "hits": stats.hits,
+                "misses": stats.misses,
+                "hit_rate": round(stats.hits / lookups, 3) if lookups else None,
+                "install_failures": stats.install_failures,
+                "install_seconds": round(stats.install_seconds, 3),
+                "materializations": stats.materializations,
+                "avg_materialize_seconds": round(stats.materialize_seconds / stats.materializations, 3) if stats.materializations else None,
+                "link_mode": self.link_mode
+            }
+        report["entries"] = sum(os.path.isdir(os.path.join(self.root, name, "node_modules")) for name in os.listdir(self.root))
+        return report
+
+_cache: DependencyCache | None = None
+
+def get_dependency_cache() -> DependencyCache:
+    global _cache
+    if _cache is None:
+        root = os.getenv("DEP_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "agents-dependency-cache")
+        _cache = DependencyCache(
+            os.path.join(root, "trees"),
+            os.getenv("DEP_CACHE_MIRROR_DIR") or os.path.join(root, "mirror"),
+            int(os.getenv("DEP_CACHE_MAX_ENTRIES", "50")),
+            os.getenv("DEP_CACHE_LINK_MODE", "reflink"),
+            os.getenv("DEP_CACHE_REGISTRY") or None,
+            os.getenv("DEP_CACHE_OFFLINE", "0") == "1"
+        )
+    return _cache
@@ -0,0 +1,154 @@
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+
+_WORDS = ("system", "module", "service", "handler", "request", "response", "schema", "config", "client", "record")
+
+def _parse_latency(spec: str):
+    """Parse LLM_FAKE_LATENCY: `constant:S`, `uniform:MIN:MAX` or `lognormal:MEDIAN:SIGMA` (seconds)."""
+    kind, *params = spec.split(":")
+    values = [float(value) for value in params]
+    if kind == "constant":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown LLM_FAKE_LATENCY distribution '{kind}'")
+
+def _developer_script(file_count: int, file_bytes: int) -> List[Dict[str, Any]]:
+    """Default tool-loop script: read package.json, write a generated project, then finish."""
+    files = [{"path": "package.json", "content": json.dumps({"name": "fake-project", "version": "1.0.0", "scripts": {"test": "jest"}}, indent=2)}]
+    for index in range(1, file_count):
+        body = "\n".join(f"export const value{line} = {line};" for line in range(max(1, file_bytes // 28)))
+        files.append({"path": f"src/module{index}.ts", "content": body})
+    return [
+        {"tool_calls": [{"name": "read_files", "args": {"files": ["package.json"]}}]},
+        {"tool_calls": [{"name": "create_or_update_files", "args": {"files": files}}]},
+        {"content": None}
+    ]
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline stand-in for ChatOpenAI, enabled with LLM_FAKE=1.
+
+    Latency is drawn from a seeded distribution per request. Usage is reported like the provider
+    does. When tools are bound, the model follows a script, one step per assistant turn already
+    in the conversation (LLM_FAKE_SCRIPT, a JSON file of `{"content", "tool_calls"}` steps; by
+    default read_files -> create_or_update_files -> final answer). Scripted calls to tools that
+    are not bound are dropped.
+    """
+
+    model_name: str = "fake"
+    tool_names: List[str] = []
+    latency: str = "constant:0.05"
+    ttft_fraction: float = 0.3
+    output_tokens: int = 200
+    chunks: int = 8
+    seed: int = 0
+    script: List[Dict[str, Any]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @classmethod
+    def from_env(cls, model: str) -> "FakeChatModel":
+        script_path = os.getenv("LLM_FAKE_SCRIPT")
+        if script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                script = json.load(f)
+        else:
+            script = _developer_script(int(os.getenv("LLM_FAKE_FILES", "5")), int(os.getenv("LLM_FAKE_FILE_BYTES", "2000")))
+        return cls(
+            model_name=model,
+            latency=os.getenv("LLM_FAKE_LATENCY", "constant:0.05"),
+            ttft_fraction=float(os.getenv("LLM_FAKE_TTFT_FRACTION", "0.3")),
+            output_tokens=int(os.getenv("LLM_FAKE_OUTPUT_TOKENS", "200")),
+            chunks=int(os.getenv("LLM_FAKE_CHUNKS", "8")),
+            seed=int(os.getenv("LLM_FAKE_SEED", "0")),
+            script=script
+        )
+
+    def bind_tools(self, tools: List[Any], **kwargs: Any) -> "FakeChatModel":
+        return self.model_copy(update={"tool_names": [getattr(t, "name", None) or t.__name__ for t in tools]})
+
+    def _plan(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """The reply for this turn: content, tool calls, usage and latency, all derived from the input."""
+        text = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(f"{self.seed}\0{self.model_name}\0{text}".encode("utf-8")).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big"))
+
+        tool_calls = []
+        content = None
+        if self.tool_names and self.script:
+            last_human = max((i for i, message in enumerate(messages) if message.type == "human"), default=-1)
+            turn = sum(message.type == "ai" for message in messages[last_human + 1:])
+            step = self.script[min(turn, len(self.script) - 1)]
+            content = step.get("content")
+            for index, call in enumerate(step.get("tool_calls") or []):
+                if call["name"] in self.tool_names:
+                    tool_calls.append({"name": call["name"], "args": call.get("args", {}), "id": f"call_{digest.hex()[:12]}_{index}"})
+        if content is None and not tool_calls:
+            content = " ".join(rng.choice(_WORDS) for _ in range(self.output_tokens))
+
+        output_tokens = self.output_tokens if content else max(1, len(json.dumps([c["args"] for c in tool_calls])) // 4)
+        input_tokens = max(1, len(text) // 4)
+        return {
+            "content": content or "",
+            "tool_calls": tool_calls,
+            "latency": max(0.0, _parse_latency(self.latency)(rng)),
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        }
+
+    def _message(self, plan: Dict[str, Any]) -> AIMessage:
+        return AIMessage(content=plan["content"], tool_calls=plan["tool_calls"], usage_metadata=plan["usage"])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        time.sleep(plan["latency"])
+        return ChatResult(generations=[ChatGeneration(message=self._message(plan))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        await asyncio.sleep(plan["latency"])
+        return ChatResult(generations=[ChatGeneration(message=self._message(plan))])
+
+    def _chunks(self, plan: Dict[str, Any]) -> List[AIMessageChunk]:
+        content = plan["content"]
+        count = max(1, self.chunks)
+        size = max(1, math.ceil(len(content) / count))
+        pieces = [content[i:i + size] for i in range(0, len(content), size)] or [""]
+        chunks = [AIMessageChunk(content=piece) for piece in pieces]
+        chunks[-1] = AIMessageChunk(
+            content=pieces[-1],
+            tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                for index, call in enumerate(plan["tool_calls"])
+            ],
+            usage_metadata=plan["usage"]
+        )
+        return chunks
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        chunks = self._chunks(plan)
+        time.sleep(plan["latency"] * self.ttft_fraction)
+        for chunk in chunks:
+            yield ChatGenerationChunk(message=chunk)
+            time.sleep(plan["latency"] * (1 - self.ttft_fraction) / len(chunks))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        chunks = self._chunks(plan)
+        await asyncio.sleep(plan["latency"] * self.ttft_fraction)
+        for chunk in chunks:
+            yield ChatGenerationChunk(message=chunk)
+            await asyncio.sleep(plan["latency"] * (1 - self.ttft_fraction) / len(chunks))
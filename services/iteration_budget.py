@@ -0,0 +1,147 @@
+from typing import Any, Dict, Iterable, List, Optional
+from dataclasses import dataclass, asdict
+from services.metrics import DEVELOPER_STOPS, DEVELOPER_ITERATIONS
+import os
+import re
+
+# Stop reasons that mean the run finished its work; any other reason may leave files incomplete.
+COMPLETE_REASONS = ("completed", "plan_complete", "tests_passed")
+
+_PATH = re.compile(r"^(?:\./)?((?:[\w.@-]+/)*[\w.-]+\.(?:ts|tsx|js|jsx|mjs|cjs|json|md))$")
+# A list item that is a path, optionally followed by a description: "- `src/index.ts` — entry point".
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+(?:\*\*|`)*([^\s`*]+?)(?:\*\*|`)*(?:\s*(?:[:(—–-]|$).*)?$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_ROOT_FILE = re.compile(r"^(package\.json|tsconfig(\.[\w-]+)?\.json|README\.md|[\w-]+\.config\.(ts|js|mjs|cjs)|\.[\w.-]+)$")
+_TREE_LINE = re.compile(r"^([\s│|]*)(?:[├└|`+]──|[├└]─)\s*(\S.*)$")
+_TREE_NAME = re.compile(r"^/?[\w.@-]+/?$")
+
+@dataclass(frozen=True)
+class IterationBudget:
+    max_iterations: int
+    max_seconds: float
+    max_tokens: int
+    no_progress_rounds: int
+
+    @classmethod
+    def from_env(cls, overrides: Optional[Dict[str, Any]] = None) -> "IterationBudget":
+        """Server limits (DEV_MAX_ITERATIONS, DEV_MAX_SECONDS, DEV_MAX_TOKENS), optionally lowered per request."""
+        budget = {
+            "max_iterations": int(os.getenv("DEV_MAX_ITERATIONS", "8")),
+            "max_seconds": float(os.getenv("DEV_MAX_SECONDS", "900")),
+            "max_tokens": int(os.getenv("DEV_MAX_TOKENS", "400000")),
+            "no_progress_rounds": int(os.getenv("DEV_NO_PROGRESS_ROUNDS", "2"))
+        }
+        for key, value in (overrides or {}).items():
+            if key in budget and value is not None:
+                budget[key] = type(budget[key])(min(budget[key], value))
+        return cls(**budget)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def _tree_paths(text: str) -> List[str]:
+    """File paths from a drawn folder tree (`├── src/` / `│   └── index.ts`)."""
+    paths = []
+    directories: List[str] = []
+    for line in text.splitlines():
+        match = _TREE_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(1)) // 4
+        name = match.group(2).split()[0]
+        if not _TREE_NAME.match(name):
+            continue
+        directories = directories[:depth]
+        if name.endswith("/") or name.startswith("/") or "." not in name:
+            directories.append(name.strip("/"))
+        else:
+            paths.append("/".join(directories + [name]))
+    return paths
+
+def _plan_path(candidate: str) -> Optional[str]:
+    """`candidate` as a project file path, or None; bare names only for root files like package.json."""
+    match = _PATH.match(candidate.strip())
+    if not match:
+        return None
+    path = match.group(1)
+    first = path.split("/")[0]
+    if "/" in path and "." in first.strip(".") and not first.startswith("."):
+        return None  # a host name, as in "example.com/readme.md"
+    return path if "/" in path or _ROOT_FILE.match(path) else None
+
+def _listed_paths(text: str) -> List[str]:
+    """Paths given as list items, or as the lines of a fenced block that only lists paths."""
+    paths = []
+    block: List[str] | None = None
+    for line in text.splitlines():
+        if _FENCE.match(line):
+            if block is not None:
+                entries = [entry.split("#")[0].strip() for entry in block if entry.strip()]
+                listed = [_plan_path(entry) for entry in entries]
+                if listed and all(listed):
+                    paths.extend(listed)
+            block = [] if block is None else None
+            continue
+        if block is not None:
+            block.append(line)
+            continue
+        match = _LIST_ITEM.match(line)
+        path = _plan_path(match.group(1)) if match else None
+        if path:
+            paths.append(path)
+    return paths
+
+def plan_files(texts: Iterable[str]) -> List[str]:
+    """File paths the conversation lays out as a plan (e.g. the architect's file structure), used as an early-exit target.
+
+    Only explicit plans count: drawn folder trees, list items that are a path, and fenced blocks
+    listing paths. Paths mentioned in prose ("see docs/usage.md", "example.com/readme.md") do not.
+    """
+    paths: List[str] = []
+    for text in texts:
+        found = _tree_paths(text or "") + _listed_paths(text or "")
+        paths.extend(path for path in found if path not in paths)
+    return paths
+
+def next_stop(
+    budget: IterationBudget,
+    iteration: int,
+    elapsed_seconds: float,
+    model_seconds: float,
+    total_tokens: int,
+    stale_rounds: int,
+    plan_done: bool,
+    tests_passed: bool
+) -> Optional[str]:
+    """Decide, after a round of tool calls, whether to stop before the next model call.
+
+    Early exits come first: the plan's files are all written, or the tests pass. Budgets are
+    checked against the projected cost of one more iteration, using the average so far, so a
+    run stops before it would overrun rather than after.
+    """
+    if tests_passed:
+        return "tests_passed"
+    if plan_done:
+        return "plan_complete"
+    if iteration >= budget.max_iterations:
+        return "max_iterations"
+    if stale_rounds >= budget.no_progress_rounds:
+        return "no_progress"
+    if elapsed_seconds + model_seconds / max(iteration, 1) > budget.max_seconds:
+        return "time_budget"
+    if total_tokens + total_tokens / max(iteration, 1) > budget.max_tokens:
+        return "token_budget"
+    return None
+
+def stop_report(reason: str, budget: IterationBudget, iteration: int, elapsed_seconds: float, total_tokens: int) -> Dict[str, Any]:
+    """The structured `stop` block of a developer response; also recorded in the stop metrics."""
+    DEVELOPER_STOPS.labels(reason).inc()
+    DEVELOPER_ITERATIONS.labels(reason).observe(iteration)
+    return {
+        "reason": reason,
+        "complete": reason in COMPLETE_REASONS,
+        "iterations": iteration,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "total_tokens": total_tokens,
+        "budget": budget.as_dict()
+    }
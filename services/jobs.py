@@ -0,0 +1,384 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import httpx
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+ProgressCallback = Callable[[str, Any], None]
+JobRunner = Callable[[Dict[str, Any], ProgressCallback], Awaitable[Dict[str, Any]]]
+JobCleanup = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_JSON_COLUMNS = ("payload", "files", "tokens", "result")
+
+class JobStore:
+    """SQLite-backed job records, so queued and interrupted jobs survive a restart."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "webhook_url TEXT, files TEXT, tokens TEXT, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "owner TEXT, lease_expires_at REAL, cancel_requested INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("owner", "TEXT"), ("lease_expires_at", "REAL"), ("cancel_requested", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.commit()
+
+    def create(self, kind: str, payload: Dict[str, Any], webhook_url: Optional[str]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, webhook_url, files, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), webhook_url, json.dumps({}), time.time())
+            )
+            self._conn.commit()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for column in _JSON_COLUMNS:
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+
+    def update(self, job_id: str, where: Optional[Dict[str, Any]] = None, **fields: Any) -> bool:
+        """Set `fields` on a job, only if its current columns match `where`; returns whether a row changed."""
+        columns = []
+        values = []
+        for column, value in fields.items():
+            columns.append(f"{column} = ?")
+            values.append(json.dumps(value, default=str) if column in _JSON_COLUMNS else value)
+        conditions = ["id = ?"]
+        values.append(job_id)
+        for column, value in (where or {}).items():
+            conditions.append(f"{column} = ?")
+            values.append(value)
+        with self._lock:
+            changed = self._conn.execute(f"UPDATE jobs SET {', '.join(columns)} WHERE {' AND '.join(conditions)}", values).rowcount
+            self._conn.commit()
+        return changed > 0
+
+    def queued(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)).fetchall()
+        return [row["id"] for row in rows]
+
+    def renew_leases(self, owner: str, job_ids: List[str], expires_at: float) -> List[str]:
+        """Extend `owner`'s leases on running jobs; returns the ids among them with a pending cancel request."""
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET lease_expires_at = ? WHERE owner = ? AND status = ? AND id IN ({placeholders})",
+                (expires_at, owner, RUNNING, *job_ids)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})", job_ids
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def reclaim_expired(self, now: float) -> List[str]:
+        """Requeue running jobs whose owner stopped renewing its lease (e.g. the worker process died)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)", (RUNNING, now)
+            ).fetchall()
+            job_ids = [row["id"] for row in rows]
+            for job_id in job_ids:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, lease_expires_at = NULL, started_at = NULL WHERE id = ? AND status = ?",
+                    (QUEUED, job_id, RUNNING)
+                )
+            self._conn.commit()
+        return job_ids
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job record as returned to clients (the stored request payload is omitted)."""
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "files": job["files"] or {},
+        "tokens": job["tokens"],
+        "result": job["result"],
+        "error": job["error"]
+    }
+
+class _ProgressWriter:
+    """Coalesces a running job's progress updates into at most one store write per `interval`, off the event loop."""
+
+    def __init__(self, store: JobStore, job_id: str, interval: float):
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval
+        self._pending: Dict[str, Any] = {}
+        self._timer: Optional[asyncio.Task] = None
+
+    def set(self, urgent: bool = False, **fields: Any) -> None:
+        self._pending.update(fields)
+        if urgent:
+            # e.g. an external id a resumed job needs: write now rather than after the interval.
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = asyncio.create_task(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        # Copies: the runner keeps updating these while the worker thread serializes them.
+        fields = {column: dict(value) if isinstance(value, dict) else value for column, value in self._pending.items()}
+        self._pending.clear()
+        await asyncio.to_thread(self.store.update, self.job_id, **fields)
+
+    async def close(self) -> None:
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+
+class JobManager:
+    """Runs queued jobs on a fixed number of asyncio workers.
+
+    Several processes (e.g. uvicorn workers) can share one job store. A job is claimed with an
+    atomic status change and its owner holds a lease it renews every `lease_seconds / 3`; only
+    jobs whose lease expired are reclaimed by other processes. Cancelling a job that runs in
+    another process sets `cancel_requested`, which its owner acts on at the next renewal.
+    A kind's `on_cancel` hook gets the payload of each job of that kind that is cancelled (not
+    of jobs interrupted by a shutdown, which resume), to drop state kept only for resuming.
+    """
+
+    def __init__(self, store: JobStore, concurrency: int, lease_seconds: float = 60.0, progress_interval: float = 1.0):
+        self.store = store
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.progress_interval = progress_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._runners: Dict[str, JobRunner] = {}
+        self._on_cancel: Dict[str, JobCleanup] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: set = set()
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+    def register(self, kind: str, runner: JobRunner, on_cancel: Optional[JobCleanup] = None) -> None:
+        self._runners[kind] = runner
+        if on_cancel is not None:
+            self._on_cancel[kind] = on_cancel
+
+    async def _cancelled(self, job: Dict[str, Any]) -> None:
+        on_cancel = self._on_cancel.get(job["kind"])
+        if on_cancel is None:
+            return
+        try:
+            await on_cancel(job["payload"])
+        except Exception as e:
+            logger.error(f"Cleanup of cancelled job {job['id']} failed: {str(e)}")
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def _sweep(self) -> None:
+        """Requeue jobs with expired leases and pick up queued jobs, e.g. ones submitted to a process that exited."""
+        self.store.reclaim_expired(time.time())
+        for job_id in self.store.queued():
+            self._enqueue(job_id)
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._sweep()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._heartbeat = asyncio.create_task(self._renew_leases())
+        logger.info(f"Started {self.concurrency} job workers as {self.owner} ({self._queue.qsize()} jobs resumed)")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                cancelled = self.store.renew_leases(self.owner, list(self._running), time.time() + self.lease_seconds)
+                for job_id in cancelled:
+                    if job_id in self._running:
+                        logger.info(f"Cancelling job {job_id} on request")
+                        self._running[job_id].cancel()
+                self._sweep()
+            except Exception as e:
+                logger.error(f"Job lease renewal failed: {str(e)}")
+
+    def submit(self, kind: str, payload: Dict[str, Any], webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in self._runners:
+            raise ValueError(f"No runner registered for job kind '{kind}'")
+        job_id = self.store.create(kind, payload, webhook_url)
+        self._enqueue(job_id)
+        logger.info(f"Queued {kind} job {job_id}")
+        return public_job(self.store.get(job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        return public_job(job) if job else None
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == QUEUED and self.store.update(job_id, where={"status": QUEUED}, status=CANCELLED, finished_at=time.time()):
+            await self._cancelled(job)
+            await self._notify(job_id)
+        elif job_id in self._running:
+            self._running[job_id].cancel()
+        elif job["status"] in (QUEUED, RUNNING):
+            # Claimed meanwhile, or running in another process: its owner cancels it at the next lease renewal.
+            self.store.update(job_id, cancel_requested=1)
+        return self.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker failed on {job_id}: {str(e)}")
+
+    async def _run(self, job_id: str) -> None:
+        job = self.store.get(job_id)
+        if job is None or job["status"] != QUEUED:
+            return
+        if job["cancel_requested"]:
+            if self.store.update(job_id, where={"status": QUEUED}, status=CANCELLED, finished_at=time.time()):
+                await self._cancelled(job)
+                await self._notify(job_id)
+            return
+        runner = self._runners.get(job["kind"])
+        if runner is None:
+            self.store.update(job_id, status=FAILED, error=f"No runner for job kind '{job['kind']}'", finished_at=time.time())
+            await self._notify(job_id)
+            return
+
+        partial_files = job["files"] or {}
+        writer = _ProgressWriter(self.store, job_id, self.progress_interval)
+
+        def progress(event: str, data: Any) -> None:
+            if event == "files":
+                partial_files.update(data.get("files", {}))
+                writer.set(files=partial_files)
+            elif event == "tokens":
+                writer.set(tokens=data)
+            elif event == "payload":
+                # Lets a runner save state (e.g. an external id) that a resumed job needs.
+                job["payload"].update(data)
+                writer.set(urgent=True, payload=job["payload"])
+
+        now = time.time()
+        claimed = self.store.update(
+            job_id, where={"status": QUEUED},
+            status=RUNNING, started_at=now, owner=self.owner, lease_expires_at=now + self.lease_seconds
+        )
+        if not claimed:
+            # Another process claimed or cancelled it first.
+            return
+        owned = {"owner": self.owner, "status": RUNNING}
+        task = asyncio.create_task(runner(job["payload"], progress))
+        self._running[job_id] = task
+        try:
+            result = await task
+            await writer.close()
+            self.store.update(job_id, where=owned, status=SUCCEEDED, result=result, tokens=result.get("tokens"), finished_at=time.time())
+            logger.info(f"Job {job_id} succeeded")
+        except asyncio.CancelledError:
+            # Keep the partial files of the interrupted run.
+            await asyncio.shield(writer.close())
+            if self._stopping:
+                # Shutting down: release the job so the next start() (here or in another process) resumes it.
+                self.store.update(job_id, where=owned, status=QUEUED, started_at=None, owner=None, lease_expires_at=None)
+                raise
+            self.store.update(job_id, where=owned, status=CANCELLED, finished_at=time.time())
+            await asyncio.shield(self._cancelled(job))
+            logger.info(f"Job {job_id} cancelled")
+        except Exception as e:
+            await writer.close()
+            self.store.update(job_id, where=owned, status=FAILED, error=str(e), finished_at=time.time())
+            logger.error(f"Job {job_id} failed: {str(e)}")
+        finally:
+            self._running.pop(job_id, None)
+        await self._notify(job_id)
+
+    async def _notify(self, job_id: str) -> None:
+        job = self.store.get(job_id)
+        if job is None or not job["webhook_url"]:
+            return
+        body = public_job(job)
+        for attempt in range(3):
+            try:
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    response = await client.post(job["webhook_url"], json=body)
+                    response.raise_for_status()
+                logger.info(f"Delivered webhook for job {job_id}")
+                return
+            except Exception as e:
+                logger.warning(f"Webhook delivery for job {job_id} failed (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(2 ** attempt)
+
+_manager: JobManager | None = None
+
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        store = JobStore(os.getenv("JOBS_DB_PATH", "jobs.sqlite3"))
+        _manager = JobManager(
+            store,
+            int(os.getenv("JOBS_MAX_CONCURRENCY", "2")),
+            float(os.getenv("JOBS_LEASE_SECONDS", "60")),
+            float(os.getenv("JOBS_PROGRESS_INTERVAL_SECONDS", "1"))
+        )
+    return _manager
@@ -0,0 +1,94 @@
+from typing import Dict, List, Any, Tuple
+from langchain_openai import ChatOpenAI
+import httpx
+import os
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_async_http_client: httpx.AsyncClient | None = None
+_sync_http_client: httpx.Client | None = None
+_chat_models: Dict[str, ChatOpenAI] = {}
+_tool_models: Dict[Tuple[str, Tuple[str, ...], str], Any] = {}
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60")),
+    )
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(os.getenv("LLM_HTTP_TIMEOUT", "600")),
+        connect=float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10")),
+    )
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    global _async_http_client, _sync_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        limits = _pool_limits()
+        timeout = _http_timeout()
+        _async_http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        _sync_http_client = httpx.Client(limits=limits, timeout=timeout)
+        logger.info(
+            f"Created shared LLM HTTP pool (max_connections={limits.max_connections}, "
+            f"max_keepalive={limits.max_keepalive_connections}, keepalive_expiry={limits.keepalive_expiry}s)"
+        )
+    return _sync_http_client, _async_http_client
+
+def get_chat_model(model: str) -> ChatOpenAI:
+    """Return the process-wide ChatOpenAI client for a model, creating it on first use.
+
+    With LLM_FAKE=1 a deterministic offline stand-in is returned instead (see `services.fake_llm`).
+    """
+    with _lock:
+        llm = _chat_models.get(model)
+        if llm is None and os.getenv("LLM_FAKE", "").lower() in ("1", "true", "yes"):
+            from services.fake_llm import FakeChatModel
+            llm = FakeChatModel.from_env(model)
+            _chat_models[model] = llm
+            logger.info(f"Registered fake chat model for model: {model}")
+        if llm is None:
+            http_client, http_async_client = _get_http_clients()
+            llm = ChatOpenAI(
+                model=model,
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+                stream_usage=True,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            _chat_models[model] = llm
+            logger.info(f"Registered ChatOpenAI client for model: {model}")
+        return llm
+
+def get_chat_model_with_tools(model: str, tools: List[Any], tool_choice: str = "auto"):
+    """Return a cached `bind_tools` variant of the shared client for a model and tool set."""
+    key = (model, tuple(t.name for t in tools), tool_choice)
+    bound = _tool_models.get(key)
+    if bound is None:
+        llm = get_chat_model(model)
+        with _lock:
+            bound = _tool_models.get(key)
+            if bound is None:
+                bound = llm.bind_tools(tools, tool_choice=tool_choice)
+                _tool_models[key] = bound
+    return bound
+
+async def close_chat_models() -> None:
+    """Close the shared HTTP pool and drop all cached clients."""
+    global _async_http_client, _sync_http_client
+    with _lock:
+        async_client, sync_client = _async_http_client, _sync_http_client
+        _async_http_client = None
+        _sync_http_client = None
+        _chat_models.clear()
+        _tool_models.clear()
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
+    logger.info("Closed shared LLM HTTP pool")
@@ -0,0 +1,35 @@
+from typing import Any, List
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, ToolMessage
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def build_messages(system_prompt: str, conversation: List[Any], context: str | None = None) -> List[BaseMessage]:
+    """Assemble the model input so that its prefix stays stable across requests and turns.
+
+    The system prompt is sent first as a real SystemMessage, followed by the conversation in its
+    original order. Per-request context (e.g. the current file list) goes last, so it never shifts
+    the cacheable prefix that provider-side prompt caching matches on.
+    """
+    messages: List[BaseMessage] = [SystemMessage(content=system_prompt)]
+    
+    for msg in conversation:
+        if not hasattr(msg, 'type') or not hasattr(msg, 'role') or not hasattr(msg, 'content'):
+            logger.error(f"Invalid message format: {msg}")
+            continue
+        if msg.type != "text":
+            logger.warning(f"Skipping non-text message: {msg}")
+            continue
+        
+        if msg.role == "user":
+            messages.append(HumanMessage(content=msg.content))
+        elif msg.role == "assistant":
+            messages.append(AIMessage(content=msg.content))
+        elif msg.role == "tool":
+            messages.append(ToolMessage(content=msg.content, tool_call_id=getattr(msg, "tool_call_id", "unknown")))
+    
+    if context:
+        messages.append(HumanMessage(content=context))
+    
+    return messages
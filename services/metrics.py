@@ -0,0 +1,219 @@
+from typing import Any, Dict, FrozenSet, List, Optional, Set
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from prometheus_client import Counter, Histogram
+import json
+import os
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "agent_stage_duration_seconds",
+    "Duration of each stage of an agent request",
+    ["agent", "model", "stage", "iteration"],
+    buckets=_BUCKETS
+)
+LLM_TTFT_SECONDS = Histogram(
+    "agent_llm_time_to_first_token_seconds",
+    "Time from sending an LLM request to receiving its first chunk",
+    ["agent", "model", "iteration"],
+    buckets=_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "agent_request_duration_seconds",
+    "End-to-end duration of agent requests, including response serialization",
+    ["agent", "model"],
+    buckets=_BUCKETS
+)
+TOKENS = Counter(
+    "agent_tokens_total",
+    "Tokens reported by the provider, by type",
+    ["agent", "model", "type"]
+)
+ROUTE_DECISIONS = Counter(
+    "agent_route_decisions_total",
+    "Model cascade decisions: a model's reply accepted or escalated to the next model",
+    ["agent", "model", "outcome"]
+)
+DEVELOPER_STOPS = Counter(
+    "developer_stops_total",
+    "Developer tool loops by the reason they stopped",
+    ["reason"]
+)
+DEVELOPER_ITERATIONS = Histogram(
+    "developer_iterations",
+    "Model calls per developer tool loop, by stop reason",
+    ["reason"],
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20)
+)
+PATCH_OUTPUT_TOKENS = Counter(
+    "developer_patch_output_tokens_total",
+    "Output tokens of apply_file_patches calls (patch) and of writing the same files in full (full_rewrite)",
+    ["kind"]
+)
+DEPENDENCY_CACHE_LOOKUPS = Counter(
+    "dependency_cache_lookups_total",
+    "Dependency cache lookups for sandbox installs, by outcome (hit or miss)",
+    ["outcome"]
+)
+
+OTHER_MODEL = "other"
+# Labels for requests that span several models or have not named one yet.
+_BUILTIN_MODEL_LABELS = {"auto", "default", "mixed", "unknown"}
+_registered_models: Set[str] = set()
+
+@lru_cache(maxsize=1)
+def _configured_models() -> FrozenSet[str]:
+    """Models named in LLM_MODELS (comma-separated), LLM_MODEL_LIMITS, MODEL_CASCADES and MODEL_PRICES."""
+    models = {model.strip() for model in os.getenv("LLM_MODELS", "").split(",") if model.strip()}
+    for variable in ("LLM_MODEL_LIMITS", "MODEL_PRICES"):
+        models.update(json.loads(os.getenv(variable, "{}") or "{}"))
+    for cascade in json.loads(os.getenv("MODEL_CASCADES", "{}") or "{}").values():
+        models.update(cascade)
+    return frozenset(models)
+
+def register_models(*models: str) -> None:
+    """Add built-in defaults (e.g. agents' default models) to the known models."""
+    _registered_models.update(models)
+
+def model_label(model: Optional[str]) -> str:
+    """`model` if it is a known model, else "other", so client-chosen names cannot create unbounded series."""
+    if model in _BUILTIN_MODEL_LABELS or model in _registered_models or model in _configured_models():
+        return model
+    return OTHER_MODEL
+
+class Trace:
+    """Timing spans collected for one agent request."""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.agent = "unknown"
+        self.model = "unknown"
+        self.include_in_response = False
+        self.finished_at: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+
+    def record(self, stage: str, started: float, duration: float, iteration: Optional[int] = None, **extra: Any) -> None:
+        self.spans.append({
+            "stage": stage,
+            "iteration": iteration,
+            "start_ms": round((started - self.start) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            **extra
+        })
+        STAGE_SECONDS.labels(self.agent, self.model, stage, str(iteration or 0)).observe(duration)
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["duration_ms"]
+        return totals
+
+_current: ContextVar[Optional[Trace]] = ContextVar("agent_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def start_trace(start: float | None = None) -> Trace:
+    trace = Trace(start if start is not None else time.perf_counter())
+    _current.set(trace)
+    return trace
+
+def begin_agent(agent: str, model: str) -> Trace:
+    """Label the current trace with its agent and model and record the request parsing span.
+
+    Starts a fresh trace when there is none (e.g. background jobs) or the current one already
+    belongs to another agent run.
+    """
+    trace = current_trace()
+    if trace is None or trace.agent != "unknown":
+        trace = start_trace()
+    trace.agent = agent
+    trace.model = model_label(model)
+    now = time.perf_counter()
+    if now > trace.start:
+        trace.record("request_parsing", trace.start, now - trace.start)
+    return trace
+
+@contextmanager
+def span(stage: str, iteration: Optional[int] = None, **extra: Any):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current_trace()
+        if trace is not None:
+            trace.record(stage, started, time.perf_counter() - started, iteration, **extra)
+
+def observe_ttft(seconds: float, iteration: Optional[int] = None) -> None:
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.record("llm_first_token", time.perf_counter() - seconds, seconds, iteration)
+    LLM_TTFT_SECONDS.labels(trace.agent, trace.model, str(iteration or 0)).observe(seconds)
+
+def finish_agent(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Count the response's tokens and, if requested, attach the collected spans as `timings`."""
+    trace = current_trace()
+    if trace is None:
+        return response
+    trace.finished_at = time.perf_counter()
+    for token_type, count in (response.get("tokens") or {}).items():
+        if count:
+            TOKENS.labels(trace.agent, trace.model, token_type).inc(count)
+    if trace.include_in_response:
+        response["timings"] = {
+            "spans": list(trace.spans),
+            "totals_ms": trace.totals()
+        }
+    return response
+
+class TracingMiddleware:
+    """ASGI middleware that starts a trace per HTTP request.
+
+    It records response serialization (agent finished to response start, or to the last body
+    chunk for streamed responses, whose agent finishes after the headers are sent) and the
+    overall request duration, and adds a `Server-Timing` header. Send `X-Include-Timings: true`
+    to also get the spans in the response body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = start_trace()
+        headers = dict(scope.get("headers") or [])
+        trace.include_in_response = headers.get(b"x-include-timings", b"").lower() in (b"1", b"true", b"yes")
+
+        serialized = False
+
+        async def send_with_timing(message):
+            nonlocal serialized
+            if message["type"] == "http.response.start" and trace.finished_at is not None:
+                now = time.perf_counter()
+                trace.record("response_serialization", trace.finished_at, now - trace.finished_at)
+                serialized = True
+                server_timing = ", ".join(
+                    f"{stage};dur={duration:.2f}" for stage, duration in trace.totals().items()
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", server_timing.encode("latin-1"))]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not serialized and trace.finished_at is not None:
+                now = time.perf_counter()
+                trace.record("response_serialization", trace.finished_at, now - trace.finished_at)
+                serialized = True
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if trace.agent != "unknown":
+                REQUEST_SECONDS.labels(trace.agent, trace.model).observe(time.perf_counter() - trace.start)
@@ -0,0 +1,181 @@
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+import difflib
+import os
+import re
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class PatchConflict(Exception):
+    """A hunk or edit that could not be placed; `details` is reported back to the model."""
+
+    def __init__(self, reason: str, **details: Any):
+        super().__init__(reason)
+        self.details = {"reason": reason, **details}
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int = 1
+    lines: List[Tuple[str, str]] = field(default_factory=list)  # (" " | "-" | "+", text)
+
+    @property
+    def old(self) -> List[str]:
+        return [text for kind, text in self.lines if kind != "+"]
+
+def fuzzy_threshold() -> float:
+    return float(os.getenv("PATCH_FUZZY_THRESHOLD", "0.85"))
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """Hunks of a unified diff for one file; `---`/`+++` headers are optional."""
+    hunks: List[Hunk] = []
+    for line in diff.split("\n"):
+        header = _HUNK_HEADER.match(line)
+        if header:
+            hunks.append(Hunk(int(header.group(1)), int(header.group(2) or 1)))
+        elif line.startswith(("---", "+++", "diff ", "index ")) and (not hunks or not hunks[-1].lines):
+            continue
+        elif hunks and line.startswith(("+", "-", " ")):
+            hunks[-1].lines.append((line[0], line[1:]))
+        elif hunks and line == "":
+            # Editors and models often drop the leading space of blank context lines.
+            hunks[-1].lines.append((" ", ""))
+        elif line.startswith("\\"):
+            continue
+    for hunk in hunks:
+        # Trailing blank lines beyond the header's old line count are the diff's own line ends,
+        # not blank context lines of the file.
+        while hunk.lines and hunk.lines[-1] == (" ", "") and len(hunk.old) > hunk.old_count:
+            hunk.lines.pop()
+    if not hunks:
+        raise PatchConflict("no hunks found in diff")
+    return hunks
+
+def _normalize(line: str) -> str:
+    return " ".join(line.split())
+
+def locate(lines: List[str], block: List[str], hint: Optional[int] = None) -> Tuple[int, str, float]:
+    """Find `block` in `lines`: exactly, then ignoring whitespace, then by similarity.
+
+    Returns (start, match kind, similarity). With several equally good places, the one nearest
+    `hint` wins; without a hint that is a conflict. Raises PatchConflict with the closest candidate.
+    """
+    size = len(block)
+    windows = range(0, max(0, len(lines) - size) + 1)
+
+    def pick(candidates: List[int], kind: str) -> Optional[Tuple[int, str, float]]:
+        if not candidates:
+            return None
+        if len(candidates) > 1 and hint is None:
+            raise PatchConflict(f"text matches {len(candidates)} places; include more surrounding lines", lines=[start + 1 for start in candidates[:5]])
+        return min(candidates, key=lambda start: abs(start - (hint or 0))), kind, 1.0
+
+    found = pick([start for start in windows if lines[start:start + size] == block], "exact")
+    if found:
+        return found
+    normalized_block = [_normalize(line) for line in block]
+    normalized = [_normalize(line) for line in lines]
+    found = pick([start for start in windows if normalized[start:start + size] == normalized_block], "whitespace")
+    if found:
+        return found
+
+    target = "\n".join(normalized_block)
+    threshold = fuzzy_threshold()
+    best: Tuple[float, int] = (0.0, -1)
+    for start in windows:
+        matcher = difflib.SequenceMatcher(None, "\n".join(normalized[start:start + size]), target, autojunk=False)
+        if matcher.real_quick_ratio() < max(threshold, best[0]) or matcher.quick_ratio() < max(threshold, best[0]):
+            continue
+        ratio = matcher.ratio()
+        if ratio > best[0] or (ratio == best[0] and hint is not None and abs(start - hint) < abs(best[1] - hint)):
+            best = (ratio, start)
+    if best[1] >= 0 and best[0] >= threshold:
+        return best[1], "fuzzy", round(best[0], 3)
+
+    closest = max(
+        windows,
+        key=lambda start: difflib.SequenceMatcher(None, "\n".join(normalized[start:start + size]), target).quick_ratio(),
+        default=None
+    )
+    details: Dict[str, Any] = {}
+    if closest is not None:
+        details["closest"] = {"line": closest + 1, "text": "\n".join(lines[closest:closest + size])[:1000]}
+    raise PatchConflict("lines to replace were not found", **details)
+
+def apply_unified_diff(content: Optional[str], diff: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Apply a unified diff to `content` (None for a new file); returns the new content and how each hunk matched."""
+    lines = content.split("\n") if content is not None else []
+    matches = []
+    offset = 0
+    for index, hunk in enumerate(parse_unified_diff(diff)):
+        old = hunk.old
+        # Where the hunk should go after the earlier hunks: its first old line, or for a hunk
+        # without old lines, the line after `old_start` (it inserts after that line).
+        expected = hunk.old_start - 1 + offset if old else hunk.old_start + offset
+        try:
+            if old:
+                start, kind, similarity = locate(lines, old, max(0, expected))
+            else:
+                start, kind, similarity = min(max(0, expected), len(lines)), "insert", 1.0
+        except PatchConflict as e:
+            e.details["hunk"] = index
+            raise
+        # Keep the file's own context lines: a fuzzy match may differ from the diff's copy.
+        replacement = []
+        position = start
+        for kind_of_line, text in hunk.lines:
+            if kind_of_line == " ":
+                replacement.append(lines[position])
+                position += 1
+            elif kind_of_line == "-":
+                position += 1
+            else:
+                replacement.append(text)
+        lines[start:start + len(old)] = replacement
+        offset += len(replacement) - len(old) + (start - expected)
+        matches.append({"hunk": index, "line": start + 1, "match": kind, "similarity": similarity})
+    return "\n".join(lines), matches
+
+def apply_search_replace(content: Optional[str], edits: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Apply search/replace edits in order; an empty `search` on a new or empty file writes `replace`."""
+    text = content or ""
+    matches = []
+    for index, edit in enumerate(edits):
+        search, replace = edit.get("search", ""), edit.get("replace", "")
+        try:
+            if not search:
+                if text:
+                    raise PatchConflict("empty search text on a non-empty file")
+                text = replace
+                matches.append({"edit": index, "match": "insert", "similarity": 1.0})
+                continue
+            occurrences = text.count(search)
+            if occurrences == 1:
+                position = text.index(search)
+                text = text[:position] + replace + text[position + len(search):]
+                matches.append({"edit": index, "line": text.count("\n", 0, position) + 1, "match": "exact", "similarity": 1.0})
+                continue
+            if occurrences > 1:
+                raise PatchConflict(f"search text matches {occurrences} places; include more surrounding lines")
+            lines = text.split("\n")
+            block = search.strip("\n").split("\n")
+            start, kind, similarity = locate(lines, block)
+            lines[start:start + len(block)] = replace.strip("\n").split("\n") if replace.strip("\n") else []
+            text = "\n".join(lines)
+            matches.append({"edit": index, "line": start + 1, "match": kind, "similarity": similarity})
+        except PatchConflict as e:
+            e.details["edit"] = index
+            raise
+    return text, matches
+
+def apply_patch(content: Optional[str], diff: Optional[str] = None, edits: Optional[List[Dict[str, str]]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    """Apply one file's patch, given as a unified diff or search/replace edits. Raises PatchConflict."""
+    if diff:
+        return apply_unified_diff(content, diff)
+    if edits:
+        return apply_search_replace(content, edits)
+    raise PatchConflict("patch has neither a diff nor edits")
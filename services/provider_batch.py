@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, Optional
+from abc import ABC, abstractmethod
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from services.llm_clients import get_chat_model
+import asyncio
+import json
+import os
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant", "tool": "tool"}
+
+def to_openai_message(message: BaseMessage) -> Dict[str, Any]:
+    converted = {"role": _ROLES.get(message.type, "user"), "content": message.content}
+    if isinstance(message, ToolMessage):
+        converted["tool_call_id"] = message.tool_call_id
+    return converted
+
+def from_openai_message(message: Dict[str, Any]) -> BaseMessage:
+    role = message.get("role")
+    content = message.get("content") or ""
+    if role in ("system", "developer"):
+        return SystemMessage(content=content)
+    if role == "assistant":
+        return AIMessage(content=content)
+    if role == "tool":
+        return ToolMessage(content=content, tool_call_id=message.get("tool_call_id", ""))
+    return HumanMessage(content=content)
+
+def batch_request(custom_id: str, model: str, messages: List[BaseMessage]) -> Dict[str, Any]:
+    """One line of a provider batch input file (OpenAI Batch API format)."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": {"model": model, "messages": [to_openai_message(message) for message in messages]}
+    }
+
+def usage_metadata(usage: Dict[str, Any] | None) -> Dict[str, Any]:
+    """Convert an OpenAI `usage` block to LangChain `usage_metadata`, as used by `services.usage`."""
+    usage = usage or {}
+    return {
+        "input_tokens": usage.get("prompt_tokens", 0) or 0,
+        "output_tokens": usage.get("completion_tokens", 0) or 0,
+        "total_tokens": usage.get("total_tokens", 0) or 0,
+        "input_token_details": {"cache_read": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0},
+        "output_token_details": {"reasoning": (usage.get("completion_tokens_details") or {}).get("reasoning_tokens", 0) or 0}
+    }
+
+class BatchProvider(ABC):
+    """Submits chat completion requests as one asynchronous batch and collects the results later."""
+
+    @abstractmethod
+    async def submit(self, requests: List[Dict[str, Any]]) -> str:
+        ...
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Result lines once the batch has finished, or None while it is still in progress."""
+
+def _jsonl(lines: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+
+def _parse_jsonl(text: str) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI Batch API: discounted pricing, results within the completion window."""
+
+    def __init__(self, completion_window: str = "24h"):
+        self.completion_window = completion_window
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI()
+        return self._client
+
+    async def submit(self, requests: List[Dict[str, Any]]) -> str:
+        client = self._get_client()
+        input_file = await client.files.create(file=("batch.jsonl", _jsonl(requests)), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Optional[List[Dict[str, Any]]]:
+        client = self._get_client()
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled") and not batch.output_file_id:
+            raise RuntimeError(f"Provider batch {batch_id} {batch.status}")
+        if batch.status not in ("completed", "expired", "cancelled"):
+            return None
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                results.extend(_parse_jsonl(content.text))
+        return results
+
+class LocalBatchProvider(BatchProvider):
+    """File-based stand-in for a provider batch API, for offline runs and tests.
+
+    `submit` writes `<id>.input.jsonl` to a directory. The requests are then completed in the
+    background with the regular chat models, and the results are written to `<id>.output.jsonl`
+    in the provider's output format. An input without an output is picked up again on the next
+    poll, so batches survive a restart.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tasks: Dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    async def submit(self, requests: List[Dict[str, Any]]) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        await asyncio.to_thread(self._write, self._path(batch_id, "input"), _jsonl(requests))
+        self._start(batch_id)
+        return batch_id
+
+    async def poll(self, batch_id: str) -> Optional[List[Dict[str, Any]]]:
+        output_path = self._path(batch_id, "output")
+        if os.path.exists(output_path):
+            with open(output_path, "r", encoding="utf-8") as f:
+                return _parse_jsonl(f.read())
+        if not os.path.exists(self._path(batch_id, "input")):
+            raise RuntimeError(f"Unknown provider batch {batch_id}")
+        self._start(batch_id)
+        return None
+
+    def _start(self, batch_id: str) -> None:
+        task = self._tasks.get(batch_id)
+        if task is None or task.done():
+            self._tasks[batch_id] = asyncio.create_task(self._process(batch_id))
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def _complete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        body = request["body"]
+        try:
+            response = await get_chat_model(body["model"]).ainvoke([from_openai_message(m) for m in body["messages"]])
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+        usage = response.usage_metadata or {}
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": response.content}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": usage.get("input_tokens", 0),
+                        "completion_tokens": usage.get("output_tokens", 0),
+                        "total_tokens": usage.get("total_tokens", 0),
+                        "prompt_tokens_details": {"cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0)},
+                        "completion_tokens_details": {"reasoning_tokens": (usage.get("output_token_details") or {}).get("reasoning", 0)}
+                    }
+                }
+            },
+            "error": None
+        }
+
+    async def _process(self, batch_id: str) -> None:
+        with open(self._path(batch_id, "input"), "r", encoding="utf-8") as f:
+            requests = _parse_jsonl(f.read())
+        semaphore = asyncio.Semaphore(int(os.getenv("PROVIDER_BATCH_LOCAL_CONCURRENCY", "4")))
+
+        async def complete(request: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._complete(request)
+
+        results = await asyncio.gather(*[complete(request) for request in requests])
+        await asyncio.to_thread(self._write, self._path(batch_id, "output"), _jsonl(list(results)))
+        logger.info(f"Local provider batch {batch_id} completed {len(results)} requests")
+
+_provider: BatchProvider | None = None
+
+def get_batch_provider() -> BatchProvider:
+    """Provider selected by PROVIDER_BATCH_BACKEND: "openai" (default) or "local"."""
+    global _provider
+    if _provider is None:
+        backend = os.getenv("PROVIDER_BATCH_BACKEND", "openai").lower()
+        if backend == "local":
+            _provider = LocalBatchProvider(os.getenv("PROVIDER_BATCH_LOCAL_DIR", "provider_batches"))
+        elif backend == "openai":
+            _provider = OpenAIBatchProvider(os.getenv("PROVIDER_BATCH_COMPLETION_WINDOW", "24h"))
+        else:
+            raise ValueError(f"Unknown PROVIDER_BATCH_BACKEND '{backend}'")
+        logger.info(f"Provider batch backend: {backend}")
+    return _provider
@@ -0,0 +1,171 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from services.usage import empty_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _normalize_conversation(conversation: List[Any]) -> List[Dict[str, str]]:
+    normalized = []
+    for msg in conversation:
+        if getattr(msg, "type", None) != "text":
+            continue
+        content = (getattr(msg, "content", "") or "").replace("\r\n", "\n").strip()
+        normalized.append({"role": getattr(msg, "role", ""), "content": content})
+    return normalized
+
+def make_cache_key(agent: str, model: str, system_prompt: str, conversation: List[Any]) -> str:
+    """Content-address an agent call by agent, model, system prompt version and normalized conversation."""
+    prompt_version = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+    payload = json.dumps({
+        "agent": agent,
+        "model": model,
+        "prompt_version": prompt_version,
+        "conversation": _normalize_conversation(conversation)
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class MemoryResponseCache:
+    """In-process LRU cache with a TTL and entry/byte size limits."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            logger.warning(f"Response too large to cache ({size} bytes)")
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.time() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+class SqliteResponseCache:
+    """On-disk cache backed by SQLite, with the same TTL and size limits as the in-memory cache."""
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        data = json.dumps(value, default=str)
+        if len(data) > self.max_bytes:
+            logger.warning(f"Response too large to cache ({len(data)} bytes)")
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + self.ttl_seconds, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+_cache = None
+_cache_initialized = False
+
+def get_response_cache():
+    """Return the configured response cache, or None when RESPONSE_CACHE_BACKEND is unset or "none"."""
+    global _cache, _cache_initialized
+    if _cache_initialized:
+        return _cache
+    backend = os.getenv("RESPONSE_CACHE_BACKEND", "none").lower()
+    ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    if backend == "memory":
+        _cache = MemoryResponseCache(ttl_seconds, max_entries, max_bytes)
+    elif backend == "sqlite":
+        path = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+        _cache = SqliteResponseCache(path, ttl_seconds, max_entries, max_bytes)
+    elif backend != "none":
+        logger.warning(f"Unknown RESPONSE_CACHE_BACKEND '{backend}', response cache disabled")
+    if _cache is not None:
+        logger.info(f"Response cache enabled (backend={backend}, ttl={ttl_seconds}s, max_entries={max_entries})")
+    _cache_initialized = True
+    return _cache
+
+def cached_response(cached: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    """Build the response body for a cache hit; no tokens are spent, the cached call's tokens are reported as saved."""
+    response = dict(cached)
+    response["time_taken_seconds"] = round(time.time() - start_time, 3)
+    response["tokens"] = empty_tokens()
+    response["cache_hit"] = True
+    response["tokens_saved"] = cached.get("tokens", {}).get("total_tokens", 0)
+    return response
+
+def store_response(cache, key: str, response: Dict[str, Any]) -> Dict[str, Any]:
+    """Store a fresh response (when a cache is configured) and mark it as a cache miss."""
+    if cache is not None:
+        cache.set(key, {k: v for k, v in response.items() if k != "time_taken_seconds"})
+    response["cache_hit"] = False
+    response["tokens_saved"] = 0
+    return response
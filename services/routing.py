@@ -0,0 +1,214 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from langchain_core.callbacks.manager import adispatch_custom_event
+from services.admission import admitted_ainvoke
+from services.metrics import ROUTE_DECISIONS, model_label
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AUTO_MODEL = "auto"
+
+# Tags the model calls a cascade may still escalate; `services.streaming` holds their tokens back
+# until the CASCADE_DECISION event for the attempt says whether they were accepted.
+CASCADE_ATTEMPT_TAG = "cascade_attempt:"
+CASCADE_DECISION = "cascade_decision"
+
+def check_output(response: Any, tools: Sequence[Any] = (), required_sections: Sequence[str] = ()) -> Optional[str]:
+    """Cheap checks on a model reply; returns why it should be escalated, or None if it is acceptable.
+
+    Flags empty replies, tool calls whose arguments did not parse or do not match the tool's
+    schema, and final answers missing a `## Section` heading the agent's prompt requires.
+    """
+    tool_calls = getattr(response, "tool_calls", None) or []
+    if getattr(response, "invalid_tool_calls", None):
+        return "malformed tool call arguments"
+    schemas = {t.name: getattr(t, "args_schema", None) for t in tools}
+    for tool_call in tool_calls:
+        schema = schemas.get(tool_call.get("name"))
+        if tool_call.get("name") not in schemas:
+            return f"unknown tool {tool_call.get('name')}"
+        if schema is not None and hasattr(schema, "model_validate"):
+            try:
+                schema.model_validate(tool_call.get("args", {}))
+            except Exception as e:
+                return f"invalid arguments for {tool_call.get('name')}: {str(e).splitlines()[0]}"
+    if tool_calls:
+        return None
+    content = response.content if isinstance(response.content, str) else str(response.content or "")
+    if not content.strip():
+        return "empty response"
+    headings = {line.strip("#* ").lower() for line in content.splitlines() if re.match(r"^\s*#{1,6}\s", line)}
+    missing = [section for section in required_sections if not any(section.lower() in heading for heading in headings)]
+    if missing:
+        return f"missing sections: {', '.join(missing)}"
+    return None
+
+class _ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.accepted_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.accepted_input_tokens = 0
+        self.accepted_output_tokens = 0
+
+class ModelRouter:
+    """Cascades of models per agent: try the cheapest first, escalate when its output fails the checks.
+
+    Cascades come from MODEL_CASCADES, e.g. `{"ba": ["gpt-4o-mini", "o1-mini"]}`, and apply when a
+    request asks for model "auto" (or, for agents with a cascade, names no model). Prices from MODEL_PRICES
+    (USD per 1M tokens, `{"o1-mini": {"input": 3, "output": 12}}`) are used to estimate savings.
+    """
+
+    def __init__(self, cascades: Dict[str, List[str]], prices: Dict[str, Dict[str, float]]):
+        self.cascades = cascades
+        self.prices = prices
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, Tuple[str, ...]], Dict[str, _ModelStats]] = {}
+
+    def has_cascade(self, agent: str) -> bool:
+        return bool(self.cascades.get(agent))
+
+    def route(self, agent: str, model: str | None, default_model: str) -> List[str]:
+        """Models to try for a call: the agent's cascade for "auto", otherwise just the requested model."""
+        if not model or model == AUTO_MODEL:
+            return list(self.cascades.get(agent) or [default_model])
+        return [model]
+
+    def record(self, agent: str, route: List[str], model: str, accepted: bool, seconds: float, usage: Dict[str, Any]) -> None:
+        route = [model_label(m) for m in route]
+        model = model_label(model)
+        with self._lock:
+            stats = self._stats.setdefault((agent, tuple(route)), {}).setdefault(model, _ModelStats())
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.input_tokens += usage.get("input_tokens", 0) or 0
+            stats.output_tokens += usage.get("output_tokens", 0) or 0
+            if accepted:
+                stats.accepted += 1
+                stats.accepted_seconds += seconds
+                stats.accepted_input_tokens += usage.get("input_tokens", 0) or 0
+                stats.accepted_output_tokens += usage.get("output_tokens", 0) or 0
+            else:
+                stats.rejected += 1
+        ROUTE_DECISIONS.labels(agent, model, "accepted" if accepted else "escalated").inc()
+
+    def _cost(self, model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+        price = self.prices.get(model)
+        if price is None:
+            return None
+        return (input_tokens * price.get("input", 0) + output_tokens * price.get("output", 0)) / 1_000_000
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per route: decisions per model, and the latency and cost saved against always using the last model."""
+        with self._lock:
+            routes = list(self._stats.items())
+        report = []
+        for (agent, route), by_model in routes:
+            top = route[-1]
+            top_stats = by_model.get(top)
+            top_latency = top_stats.seconds / top_stats.calls if top_stats and top_stats.calls else None
+            latency_saved = 0.0 if top_latency is not None else None
+            cost_saved: Optional[float] = 0.0
+            for model, stats in by_model.items():
+                if model == top:
+                    continue
+                if latency_saved is not None:
+                    # Calls served by a cheaper model avoided a top-model call; rejected ones added latency.
+                    latency_saved += stats.accepted * top_latency - stats.seconds
+                top_cost = self._cost(top, stats.accepted_input_tokens, stats.accepted_output_tokens)
+                spent = self._cost(model, stats.input_tokens, stats.output_tokens)
+                if cost_saved is not None and top_cost is not None and spent is not None:
+                    cost_saved += top_cost - spent
+                else:
+                    cost_saved = None
+            report.append({
+                "agent": agent,
+                "route": list(route),
+                "models": {
+                    model: {
+                        "calls": stats.calls,
+                        "accepted": stats.accepted,
+                        "escalated": stats.rejected,
+                        "avg_latency_seconds": round(stats.seconds / stats.calls, 3) if stats.calls else None,
+                        "input_tokens": stats.input_tokens,
+                        "output_tokens": stats.output_tokens
+                    }
+                    for model, stats in by_model.items()
+                },
+                "latency_saved_seconds": round(latency_saved, 3) if latency_saved is not None else None,
+                "estimated_cost_saved_usd": round(cost_saved, 6) if cost_saved is not None else None
+            })
+        return report
+
+_router: ModelRouter | None = None
+
+def get_model_router() -> ModelRouter:
+    global _router
+    if _router is None:
+        _router = ModelRouter(
+            json.loads(os.getenv("MODEL_CASCADES", "{}") or "{}"),
+            json.loads(os.getenv("MODEL_PRICES", "{}") or "{}")
+        )
+    return _router
+
+async def routed_ainvoke(
+    agent: str,
+    route: List[str],
+    llm_for: Callable[[str], Any],
+    messages: List[Any],
+    iteration: int = 1,
+    tools: Sequence[Any] = (),
+    required_sections: Sequence[str] = ()
+) -> Tuple[Any, List[Dict[str, Any]]]:
+    """Call the route's models in order until one reply passes `check_output`.
+
+    Returns the accepted reply (or the last model's reply, which is never escalated) and one
+    decision per model tried, each with the usage to bill. A provider error on a cheaper model
+    also escalates; on the last model it is raised. Every model but the last is called with a
+    `CASCADE_ATTEMPT_TAG` tag and its outcome dispatched as a `CASCADE_DECISION` event, so a
+    stream never shows a reply that was escalated.
+    """
+    if len(route) == 1:
+        response = await admitted_ainvoke(route[0], llm_for(route[0]), messages, iteration)
+        return response, [{"iteration": iteration, "model": route[0], "accepted": True, "reason": None, "usage": getattr(response, "usage_metadata", {}) or {}}]
+    router = get_model_router()
+    decisions = []
+    for position, model in enumerate(route):
+        last = position == len(route) - 1
+        started = time.perf_counter()
+        attempt = None if last else f"{CASCADE_ATTEMPT_TAG}{uuid.uuid4().hex}"
+        llm = llm_for(model) if last else llm_for(model).with_config(tags=[attempt])
+        try:
+            response = await admitted_ainvoke(model, llm, messages, iteration)
+        except Exception as e:
+            if last:
+                raise
+            reason = f"error: {str(e)}"
+            await adispatch_custom_event(CASCADE_DECISION, {"attempt": attempt, "model": model, "accepted": False, "reason": reason})
+            seconds = time.perf_counter() - started
+            router.record(agent, route, model, False, seconds, {})
+            decisions.append({"iteration": iteration, "model": model, "accepted": False, "reason": reason, "seconds": round(seconds, 3), "usage": {}})
+            logger.warning(f"Escalating {agent} from {model}: {reason}")
+            continue
+        seconds = time.perf_counter() - started
+        usage = getattr(response, "usage_metadata", {}) or {}
+        reason = None if last else check_output(response, tools, required_sections)
+        router.record(agent, route, model, reason is None, seconds, usage)
+        decisions.append({"iteration": iteration, "model": model, "accepted": reason is None, "reason": reason, "seconds": round(seconds, 3), "usage": usage})
+        if attempt:
+            await adispatch_custom_event(CASCADE_DECISION, {"attempt": attempt, "model": model, "accepted": reason is None, "reason": reason})
+        if reason is None:
+            return response, decisions
+        logger.info(f"Escalating {agent} from {model}: {reason}")
+    raise RuntimeError("Empty model route")
@@ -0,0 +1,278 @@
+from typing import Any, Dict, List, Optional, Tuple
+from services.dep_cache import DependencyInstallError, get_dependency_cache
+import asyncio
+import os
+import pwd
+import resource
+import shlex
+import shutil
+import signal
+import tempfile
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SANDBOX_COMMANDS: Dict[str, List[str]] = {
+    "test": ["npm", "test", "--silent"],
+    "typecheck": ["npx", "--no-install", "tsc", "--noEmit"]
+}
+def sandbox_enabled() -> bool:
+    return os.getenv("SANDBOX_ENABLED", "0") == "1"
+
+def _truncate(output: str, limit: int) -> str:
+    """Keep the tail of a command's output, where test runners and compilers put their summary."""
+    if len(output) <= limit:
+        return output
+    return f"[... {len(output) - limit} characters truncated ...]\n" + output[-limit:]
+
+def _sandbox_user() -> Optional[Tuple[int, int]]:
+    """(uid, gid) of SANDBOX_USER, given as a user name or a numeric uid."""
+    user = os.getenv("SANDBOX_USER")
+    if not user:
+        return None
+    entry = pwd.getpwuid(int(user)) if user.isdigit() else pwd.getpwnam(user)
+    return entry.pw_uid, entry.pw_gid
+
+def _safe_path(root: str, path: str) -> str:
+    if path.startswith("/") or ".." in path.split("/") or path.split("/")[0] == "node_modules":
+        raise ValueError(f"invalid file path: {path}")
+    return os.path.join(root, path)
+
+def _kill_group(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+class _Worker:
+    """A scratch project directory reused across runs; `deps_key` is the dependency set materialized in it."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.deps_key: Optional[str] = None
+
+class SandboxPool:
+    """Runs a generated project's typecheck and test commands in pre-warmed scratch directories.
+
+    Each worker directory keeps its `node_modules` between runs, and installed dependency
+    trees come from the shared dependency cache (`services.dep_cache`), so only the first run
+    of a dependency set pays for `npm install`. Commands get an environment without the
+    service's variables, a wall-clock timeout, CPU, address-space, process, file-size and
+    open-file limits, and a V8 heap cap.
+
+    That alone is not isolation: the generated code runs as the service's user, with its
+    filesystem (including the service's `.env`) and network. SANDBOX_USER runs commands as a
+    separate unprivileged user, and SANDBOX_WRAPPER prefixes them with a container or
+    namespace tool (e.g. bwrap or nsjail) that limits mounts and network.
+    """
+
+    def __init__(self, root: str, workers: int):
+        self.root = root
+        self.dependencies = get_dependency_cache()
+        self.timeout = float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "120"))
+        self.install_timeout = float(os.getenv("SANDBOX_INSTALL_TIMEOUT_SECONDS", "300"))
+        self.cpu_seconds = int(os.getenv("SANDBOX_CPU_SECONDS", "120"))
+        self.memory_mb = int(os.getenv("SANDBOX_MEMORY_MB", "1024"))
+        self.max_file_mb = int(os.getenv("SANDBOX_MAX_FILE_MB", "64"))
+        self.address_space_mb = int(os.getenv("SANDBOX_ADDRESS_SPACE_MB", str(self.memory_mb * 4)))
+        self.max_processes = int(os.getenv("SANDBOX_MAX_PROCESSES", "256"))
+        self.output_chars = int(os.getenv("SANDBOX_OUTPUT_CHARS", "6000"))
+        self.user = _sandbox_user()
+        if self.user is not None and os.geteuid() != 0:
+            raise RuntimeError("SANDBOX_USER needs the service to run as root to switch users")
+        self.wrapper = shlex.split(os.getenv("SANDBOX_WRAPPER", ""))
+        if not self.user and not self.wrapper:
+            logger.warning("Sandbox commands run as the service user with its filesystem and network; set SANDBOX_USER or SANDBOX_WRAPPER to isolate them")
+        if self.dependencies.link_mode == "hardlink" and self.user is None:
+            logger.warning("DEP_CACHE_LINK_MODE=hardlink without SANDBOX_USER lets generated code rewrite cached dependencies in place")
+        os.makedirs(self.root, exist_ok=True)
+        self._workers = [_Worker(os.path.join(self.root, f"worker-{index}")) for index in range(max(1, workers))]
+        for worker in self._workers:
+            os.makedirs(worker.root, exist_ok=True)
+        self._idle = list(self._workers)
+        self._slots = asyncio.Semaphore(len(self._workers))
+
+    def _env(self, home: str) -> Dict[str, str]:
+        return {
+            "PATH": os.getenv("SANDBOX_PATH", os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin")),
+            "HOME": home,
+            "CI": "1",
+            "NODE_ENV": "test",
+            "NODE_OPTIONS": f"--max-old-space-size={self.memory_mb}",
+            # Per worker, so generated code cannot write to the shared npm mirror; installs override it.
+            "npm_config_cache": os.path.join(home, ".npm"),
+            "npm_config_update_notifier": "false",
+            "npm_config_fund": "false",
+            "npm_config_audit": "false"
+        }
+
+    def _limits(self, untrusted: bool) -> None:
+        # Runs in the child before exec.
+        resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (self.max_file_mb * 1024 * 1024,) * 2)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (1024, 1024))
+        resource.setrlimit(resource.RLIMIT_AS, (self.address_space_mb * 1024 * 1024,) * 2)
+        if not untrusted:
+            return
+        # Counted per user (and not enforced for root): it contains a fork bomb when the command runs as SANDBOX_USER.
+        resource.setrlimit(resource.RLIMIT_NPROC, (self.max_processes, self.max_processes))
+
+    async def _exec(self, argv: List[str], cwd: str, timeout: float, env: Optional[Dict[str, str]] = None, untrusted: bool = False) -> Dict[str, Any]:
+        """Run a command with the sandbox limits; `untrusted` ones (generated code) also run as SANDBOX_USER, inside SANDBOX_WRAPPER, with a process limit."""
+        started = time.perf_counter()
+        user = {}
+        if untrusted and self.wrapper:
+            argv = [arg.replace("{workdir}", cwd) for arg in self.wrapper] + argv
+        if untrusted and self.user is not None:
+            user = {"user": self.user[0], "group": self.user[1], "extra_groups": []}
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            cwd=cwd,
+            env={**self._env(cwd), **(env or {})},
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            preexec_fn=lambda: self._limits(untrusted),
+            start_new_session=True,
+            **user
+        )
+        timed_out = False
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # Kill the whole process group: npm and test runners spawn children.
+            _kill_group(process.pid)
+            output, _ = await process.communicate()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            timed_out = True
+        # Background processes the command left behind.
+        _kill_group(process.pid)
+        return {
+            "exit_code": process.returncode,
+            "timed_out": timed_out,
+            "seconds": round(time.perf_counter() - started, 3),
+            "output": _truncate(output.decode("utf-8", errors="replace"), self.output_chars)
+        }
+
+    async def _install(self, package_json: str, lockfile: Optional[str]) -> Dict[str, Any]:
+        async def run(argv: List[str], cwd: str, env: Dict[str, str]) -> Dict[str, Any]:
+            return await self._exec(argv, cwd, self.install_timeout, env)
+        return await self.dependencies.ensure(package_json, lockfile, run)
+
+    def _checkout(self, key: str) -> _Worker:
+        # Prefer a worker that already has this dependency set linked.
+        worker = next((w for w in self._idle if w.deps_key == key), self._idle[0])
+        self._idle.remove(worker)
+        return worker
+
+    def _prepare(self, worker: _Worker, key: str, files: Dict[str, str]) -> None:
+        """Replace the worker's project files and materialize the cached dependencies into it."""
+        node_modules = os.path.join(worker.root, "node_modules")
+        if worker.deps_key is not None and (not os.path.isdir(node_modules) or os.lstat(node_modules).st_uid != os.geteuid()):
+            # A previous command replaced the linked tree (the sandbox user owns the worker directory).
+            worker.deps_key = None
+        for entry in os.listdir(worker.root):
+            if entry == "node_modules" and worker.deps_key == key:
+                continue
+            path = os.path.join(worker.root, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        if worker.deps_key != key:
+            worker.deps_key = None
+            self.dependencies.materialize(key, os.path.join(worker.root, "node_modules"))
+            worker.deps_key = key
+        for path, content in files.items():
+            full_path = _safe_path(worker.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(content)
+        if self.user is not None:
+            # The project belongs to the sandbox user; node_modules stays the service's, read-only to it.
+            uid, gid = self.user
+            for directory, dirnames, filenames in os.walk(worker.root):
+                if directory == worker.root and "node_modules" in dirnames:
+                    dirnames.remove("node_modules")
+                os.chown(directory, uid, gid)
+                for name in filenames:
+                    os.chown(os.path.join(directory, name), uid, gid, follow_symlinks=False)
+
+    async def warm(self, package_json: str) -> None:
+        """Install a common dependency set and materialize it in every worker ahead of the first run."""
+        try:
+            key = (await self._install(package_json, None))["key"]
+        except DependencyInstallError as e:
+            logger.warning(f"Sandbox warm-up install failed: {e.output[-500:]}")
+            return
+        for _ in self._workers:
+            async with self._slots:
+                worker = next((w for w in self._idle if w.deps_key != key), None)
+                if worker is None:
+                    break
+                self._idle.remove(worker)
+                try:
+                    await asyncio.to_thread(self._prepare, worker, key, {})
+                finally:
+                    self._idle.append(worker)
+        logger.info(f"Warmed {len(self._workers)} sandbox workers with dependencies {key}")
+
+    async def run(self, files: Dict[str, str], command: str) -> Dict[str, Any]:
+        """Write `files` into a worker and run one of SANDBOX_COMMANDS; returns exit code, timing and output tail."""
+        if command not in SANDBOX_COMMANDS:
+            raise ValueError(f"Unknown sandbox command '{command}'")
+        if "package.json" not in files:
+            return {"command": command, "passed": False, "error": "package.json is missing"}
+        if command == "typecheck" and "tsconfig.json" not in files:
+            return {"command": command, "passed": False, "error": "tsconfig.json is missing"}
+        try:
+            install = await self._install(files["package.json"], files.get("package-lock.json"))
+        except ValueError as e:
+            return {"command": command, "passed": False, "error": f"package.json is not valid: {str(e)}"}
+        except DependencyInstallError as e:
+            return {"command": command, "passed": False, "error": str(e), "output": e.output}
+        key = install.pop("key")
+
+        async with self._slots:
+            worker = self._checkout(key)
+            try:
+                await asyncio.to_thread(self._prepare, worker, key, files)
+                result = await self._exec(SANDBOX_COMMANDS[command], worker.root, self.timeout, untrusted=True)
+            except ValueError as e:
+                return {"command": command, "passed": False, "error": str(e)}
+            finally:
+                self._idle.append(worker)
+        logger.info(f"Sandbox {command}: exit {result['exit_code']} in {result['seconds']}s (dependencies cached: {install['cached']})")
+        return {
+            "command": command,
+            "passed": result["exit_code"] == 0 and not result["timed_out"],
+            **result,
+            "install": install
+        }
+
+_pool: SandboxPool | None = None
+_warm_task: asyncio.Task | None = None
+
+def get_sandbox_pool() -> SandboxPool:
+    global _pool
+    if _pool is None:
+        _pool = SandboxPool(
+            os.getenv("SANDBOX_DIR") or os.path.join(tempfile.gettempdir(), "agents-sandbox"),
+            int(os.getenv("SANDBOX_WORKERS", "2"))
+        )
+    return _pool
+
+async def start_sandbox() -> None:
+    """Create the worker pool at startup and, with SANDBOX_WARM_PACKAGE_JSON, pre-install its dependencies."""
+    global _warm_task
+    if not sandbox_enabled():
+        return
+    pool = get_sandbox_pool()
+    warm_path = os.getenv("SANDBOX_WARM_PACKAGE_JSON")
+    if warm_path:
+        with open(warm_path, "r", encoding="utf-8") as f:
+            package_json = f.read()
+        _warm_task = asyncio.create_task(pool.warm(package_json))
@@ -0,0 +1,118 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SnapshotNotFoundError(KeyError):
+    pass
+
+def _hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _snapshot_id(file_hashes: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(file_hashes):
+        digest.update(f"{path}\0{file_hashes[path]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+class SnapshotStore:
+    """Content-addressed project snapshots, so clients only send and receive changed files.
+
+    A snapshot id is a hash over every (path, content hash) pair. Per-file hashes are kept
+    with each snapshot, so deriving a new snapshot from a base only hashes the changed files.
+    The least recently used snapshots are evicted beyond `max_snapshots` or `max_bytes` of
+    content. Snapshots live in process memory, so they are not shared between worker processes.
+    """
+
+    def __init__(self, max_snapshots: int, max_bytes: int):
+        self.max_snapshots = max_snapshots
+        self.max_bytes = max_bytes
+        self._snapshots: "OrderedDict[str, Tuple[Dict[str, str], Dict[str, str]]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _put(self, files: Dict[str, str], file_hashes: Dict[str, str]) -> str:
+        snapshot_id = _snapshot_id(file_hashes)
+        # Character count: cheap, and close enough to bytes for a memory bound.
+        size = sum(len(path) + len(content) for path, content in files.items())
+        with self._lock:
+            if snapshot_id not in self._snapshots:
+                self._sizes[snapshot_id] = size
+                self._total_bytes += size
+            self._snapshots[snapshot_id] = (files, file_hashes)
+            self._snapshots.move_to_end(snapshot_id)
+            while len(self._snapshots) > 1 and (len(self._snapshots) > self.max_snapshots or self._total_bytes > self.max_bytes):
+                evicted, _ = self._snapshots.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(evicted)
+        return snapshot_id
+
+    def _entry(self, snapshot_id: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+        with self._lock:
+            entry = self._snapshots.get(snapshot_id)
+            if entry is None:
+                raise SnapshotNotFoundError(snapshot_id)
+            self._snapshots.move_to_end(snapshot_id)
+            return entry
+
+    def put(self, files: Dict[str, str]) -> str:
+        files = dict(files)
+        return self._put(files, {path: _hash_content(content) for path, content in files.items()})
+
+    def get(self, snapshot_id: str) -> Dict[str, str]:
+        """Return a copy of the snapshot's files. Raises SnapshotNotFoundError for unknown or evicted ids."""
+        return dict(self._entry(snapshot_id)[0])
+
+    def apply(self, base_snapshot_id: Optional[str], changed_files: Dict[str, str], deleted_files: List[str]) -> Tuple[str, Dict[str, str]]:
+        """Build a new snapshot from a base plus changed and deleted paths; returns (snapshot_id, files)."""
+        if base_snapshot_id:
+            base_files, base_hashes = self._entry(base_snapshot_id)
+            files, file_hashes = dict(base_files), dict(base_hashes)
+        else:
+            files, file_hashes = {}, {}
+        for path in deleted_files:
+            files.pop(path, None)
+            file_hashes.pop(path, None)
+        for path, content in changed_files.items():
+            files[path] = content
+            file_hashes[path] = _hash_content(content)
+        return self._put(files, file_hashes), dict(files)
+
+    def commit(self, base_snapshot_id: str, before: Dict[str, str], after: Dict[str, str]) -> Tuple[str, Dict[str, object]]:
+        """Store `after` as a snapshot derived from `before` (the files of `base_snapshot_id`) and return its id with the diff.
+
+        If the base was evicted meanwhile (e.g. during a long run), `after` is stored in full instead.
+        """
+        changes = diff_files(before, after)
+        try:
+            snapshot_id, _ = self.apply(
+                base_snapshot_id,
+                {**changes["created"], **changes["modified"]},
+                changes["deleted"]
+            )
+        except SnapshotNotFoundError:
+            logger.info(f"Base snapshot {base_snapshot_id} was evicted; storing the result in full")
+            snapshot_id = self.put(after)
+        return snapshot_id, changes
+
+def diff_files(before: Dict[str, str], after: Dict[str, str]) -> Dict[str, object]:
+    created = {path: content for path, content in after.items() if path not in before}
+    modified = {path: content for path, content in after.items() if path in before and before[path] != content}
+    deleted = [path for path in before if path not in after]
+    return {"created": created, "modified": modified, "deleted": deleted}
+
+_store: SnapshotStore | None = None
+
+def get_snapshot_store() -> SnapshotStore:
+    global _store
+    if _store is None:
+        _store = SnapshotStore(
+            int(os.getenv("SNAPSHOT_STORE_MAX_SNAPSHOTS", "500")),
+            int(os.getenv("SNAPSHOT_STORE_MAX_MB", "512")) * 1024 * 1024
+        )
+    return _store
@@ -0,0 +1,74 @@
+from typing import Any, AsyncIterator, Dict, List, Tuple
+import json
+import logging
+from services.metrics import finish_agent
+from services.routing import CASCADE_ATTEMPT_TAG, CASCADE_DECISION
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+def chunk_text(chunk: Any) -> str:
+    """Extract the plain text from a streamed AIMessageChunk."""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, str):
+                parts.append(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                parts.append(part.get("text", ""))
+        return "".join(parts)
+    return ""
+
+async def stream_graph_events(graph, initial_state: Dict[str, Any], config: Dict[str, Any] | None = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Run a compiled graph and yield ("token" | <custom event name> | "result", data) tuples.
+
+    Tokens come from every chat model call inside the graph, custom events from
+    `adispatch_custom_event` in the nodes, and "result" carries the final graph state. Tokens of
+    a model cascade attempt are held back until it is accepted; an escalated attempt's tokens are
+    dropped and an "escalated" event is sent instead.
+    """
+    held: Dict[str, List[str]] = {}
+    async for event in graph.astream_events(initial_state, config, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            text = chunk_text(event["data"].get("chunk"))
+            attempt = next((tag for tag in event.get("tags") or [] if tag.startswith(CASCADE_ATTEMPT_TAG)), None)
+            if text and attempt:
+                held.setdefault(attempt, []).append(text)
+            elif text:
+                yield "token", {"content": text}
+        elif kind == "on_custom_event" and event["name"] == CASCADE_DECISION:
+            decision = event["data"]
+            texts = held.pop(decision["attempt"], [])
+            if decision["accepted"]:
+                if texts:
+                    yield "token", {"content": "".join(texts)}
+            else:
+                yield "escalated", {"model": decision["model"], "reason": decision["reason"]}
+        elif kind == "on_custom_event":
+            yield event["name"], event["data"]
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            yield "result", event["data"].get("output")
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def sse_response_body(events: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[str]:
+    """Encode (event, data) tuples from an agent stream as Server-Sent Events."""
+    try:
+        async for event, data in events:
+            if event in ("done", "error"):
+                data = finish_agent(data)
+            yield format_sse(event, data)
+    except Exception as e:
+        logger.error(f"Error while streaming response: {str(e)}")
+        yield format_sse("error", {"response": f"Error: {str(e)}."})
@@ -0,0 +1,25 @@
+from typing import Any, Dict
+
+def empty_tokens() -> Dict[str, int]:
+    return {"input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0, "total_tokens": 0}
+
+def token_counts(usage_metadata: Dict[str, Any] | None) -> Dict[str, int]:
+    """Map a LangChain `usage_metadata` dict to the `tokens` block returned by the API.
+
+    `cached_input_tokens` is the part of the input served from the provider's prompt cache.
+    """
+    usage_metadata = usage_metadata or {}
+    input_details = usage_metadata.get("input_token_details", {}) or {}
+    output_details = usage_metadata.get("output_token_details", {}) or {}
+    return {
+        "input_tokens": usage_metadata.get("input_tokens", 0) or 0,
+        "cached_input_tokens": input_details.get("cache_read", 0) or 0,
+        "output_tokens": usage_metadata.get("output_tokens", 0) or 0,
+        "reasoning_tokens": usage_metadata.get("reasoning_tokens", 0) or output_details.get("reasoning", 0) or 0,
+        "total_tokens": usage_metadata.get("total_tokens", 0) or 0
+    }
+
+def add_token_counts(total: Dict[str, int], usage_metadata: Dict[str, Any] | None) -> Dict[str, int]:
+    for key, value in token_counts(usage_metadata).items():
+        total[key] = total.get(key, 0) + value
+    return total